@@ -70,4 +70,13 @@ def create_app(config_name=None):
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
+    from .commands import register_commands
+    register_commands(app)
+
+    from .request_metrics import init_request_metrics
+    init_request_metrics(app)
+
+    from .metrics import init_metrics
+    init_metrics(app)
+
     return app
@@ -0,0 +1,339 @@
+"""Bell grading scenario engine.
+
+All scenarios are computed with NumPy over a (tests x students) matrix of points, so
+the preview (bell_grade_scenarios) and the write path (apply_bell_selection) share one
+set of formulas, and a whole semester of tests can be curved in one pass.
+
+Percentages are 0-100. Absent or ungraded students are NaN and stay NaN in every
+scenario.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import Float, Integer, case, column, update, values
+
+from . import db
+from .models import School, Classroom, Student, Test, Grade
+
+SCENARIOS = ('original', 'linear', 'percentage', 'sqrt')
+
+SCENARIO_NAMES = {
+    'linear': 'Equal Adjustment',
+    'sqrt': 'Lower Boost',
+    'percentage': 'Typical Distribution',
+    'original': 'Original'
+}
+
+SCENARIO_DETAIL_TYPES = {
+    'linear': 'Linear scaling',
+    'percentage': '% scaling',
+    'sqrt': 'Square root',
+    'original': 'Original'
+}
+
+# Dialects that support UPDATE ... FROM (VALUES ...) AS v (columns) and UPDATEs in a WITH clause
+_UPDATE_FROM_VALUES_DIALECTS = ('postgresql',)
+
+# Upper bound on tests curved by one batch request, to keep request time bounded
+MAX_BATCH_TESTS = 100
+
+# Grades per UPDATE. The CASE form binds 3 parameters per grade and the VALUES form 2,
+# so a chunk stays under SQLite's 32766 and PostgreSQL's 65535 bind parameter limits
+GRADE_UPDATE_CHUNK_SIZE = 5000
+
+# "Typical Distribution" compresses scores around the mean by this factor before lifting
+TYPICAL_DISTRIBUTION_RATIO = 0.85
+
+
+@dataclass(frozen=True)
+class BellOptions:
+    adjust_avg: bool = False
+    target_avg: float = None
+    allow_over_100: bool = False
+    boost_low: bool = False
+    lowest_score: float = None
+
+    @classmethod
+    def from_request(cls, data):
+        target_avg = data.get('target_avg')
+        lowest_score = data.get('lowest_score')
+        return cls(
+            adjust_avg=bool(data.get('adjust_avg')),
+            target_avg=float(target_avg) if isinstance(target_avg, (int, float)) else None,
+            allow_over_100=bool(data.get('allow_over_100')),
+            boost_low=bool(data.get('boost_low')),
+            lowest_score=float(lowest_score) if isinstance(lowest_score, (int, float)) else None,
+        )
+
+
+@dataclass
+class ScenarioMatrix:
+    """Scenario percentages for a batch of tests; every array is shaped (tests, students)."""
+    class_avg: np.ndarray
+    original: np.ndarray
+    linear: np.ndarray
+    percentage: np.ndarray
+    sqrt: np.ndarray
+
+    def scenario(self, name):
+        return getattr(self, name)
+
+    def points(self, name, max_points):
+        """Scenario scores converted back to points, rounded to 2 decimals."""
+        max_points = np.asarray(max_points, dtype=float).reshape(-1, 1)
+        return np.round(self.scenario(name) / 100.0 * max_points, 2)
+
+
+def compute_scenarios(points, absent, max_points, options):
+    """Compute every scenario for a (tests x students) matrix in one vectorized pass.
+
+    points: float array, NaN where no grade was entered (also used as padding when
+    tests have different roster sizes). absent: bool array of the same shape.
+    max_points: one value per test. Scenarios that the options don't enable are
+    all-NaN.
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    absent = np.atleast_2d(np.asarray(absent, dtype=bool))
+    max_points = np.asarray(max_points, dtype=float).reshape(-1, 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        original = np.where(absent, np.nan, points / max_points * 100.0)
+    graded = ~np.isnan(original)
+    counts = graded.sum(axis=1)
+    sums = np.where(graded, original, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        class_avg = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    avg = class_avg.reshape(-1, 1)
+
+    nan = np.full_like(original, np.nan)
+
+    def cap100(values):
+        return values if options.allow_over_100 else np.minimum(values, 100.0)
+
+    linear = nan
+    percentage = nan
+    if options.adjust_avg and options.target_avg is not None:
+        target = options.target_avg
+        # Equal Adjustment: flat adjustment to all scores
+        linear = cap100(original + (target - avg))
+        # Typical Distribution: compress and lift
+        ratio = TYPICAL_DISTRIBUTION_RATIO
+        percentage = cap100(original * ratio + (target - avg * ratio))
+
+    sqrt = nan
+    if options.boost_low:
+        # Lower Boost: square root boost for lower scores, anchored so the class
+        # average lands on the target (or stays put when no target is given)
+        target = options.target_avg if options.target_avg is not None else avg
+        adjust = np.sqrt(np.maximum(avg, 0.0)) * 10.0 - target
+        sqrt = np.sqrt(np.maximum(original, 0.0)) * 10.0 - adjust
+        if options.lowest_score is not None:
+            sqrt = np.fmax(sqrt, options.lowest_score)
+        # Ensure scores never go down
+        sqrt = np.maximum(original + 2.0, sqrt)
+        sqrt = np.where(graded, sqrt, np.nan)
+
+    return ScenarioMatrix(
+        class_avg=class_avg,
+        original=original,
+        linear=linear,
+        percentage=percentage,
+        sqrt=sqrt,
+    )
+
+
+def to_optional(value):
+    """NaN -> None, numpy scalar -> float, for JSON responses."""
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+@dataclass
+class TestGrades:
+    """Grade rows for one test, aligned with the columns of a scenario matrix."""
+    test: object
+    grade_ids: list
+    student_ids: list
+    names: list
+    points: np.ndarray
+    absent: np.ndarray
+
+
+def load_test_grades(teacher_id, tests, class_name=''):
+    """Load the grade rows for several tests in one query.
+
+    Only students of the teacher's classrooms are included; class_name narrows to
+    classrooms whose name starts with it (e.g. '101' matches '101 (Grade 1)').
+    Returns one TestGrades per test, students sorted by last/first name.
+    """
+    test_ids = [t.id for t in tests]
+    query = (
+        db.session.query(
+            Grade.id, Grade.test_id, Grade.student_id, Grade.grade, Grade.absent,
+            Student.first_name, Student.last_name,
+        )
+        .join(Student, Grade.student_id == Student.id)
+        .join(Classroom, Student.classroom_id == Classroom.id)
+        .join(School, Classroom.school_id == School.id)
+        .filter(Grade.test_id.in_(test_ids), School.teacher_id == teacher_id)
+    )
+    if class_name:
+        query = query.filter(Classroom.name.like(f"{class_name}%"))
+    rows = query.order_by(Grade.test_id, Student.last_name, Student.first_name).all()
+
+    by_test = {test_id: [] for test_id in test_ids}
+    for row in rows:
+        by_test[row.test_id].append(row)
+
+    result = []
+    for test in tests:
+        test_rows = by_test[test.id]
+        result.append(TestGrades(
+            test=test,
+            grade_ids=[r.id for r in test_rows],
+            student_ids=[r.student_id for r in test_rows],
+            names=[f"{r.first_name} {r.last_name}" for r in test_rows],
+            points=np.array([np.nan if r.grade is None else r.grade for r in test_rows], dtype=float),
+            absent=np.array([bool(r.absent) for r in test_rows], dtype=bool),
+        ))
+    return result
+
+
+def stack_test_grades(test_grades):
+    """Pad per-test rows into (tests x students) points/absent matrices."""
+    width = max((len(tg.student_ids) for tg in test_grades), default=0)
+    points = np.full((len(test_grades), width), np.nan)
+    absent = np.zeros((len(test_grades), width), dtype=bool)
+    for i, tg in enumerate(test_grades):
+        points[i, :len(tg.points)] = tg.points
+        absent[i, :len(tg.absent)] = tg.absent
+    max_points = np.array([tg.test.max_points for tg in test_grades], dtype=float)
+    return points, absent, max_points
+
+
+def scenarios_for_tests(teacher_id, tests, options, class_name=''):
+    """Run every scenario for many tests (e.g. a whole semester) with one query and one pass."""
+    test_grades = load_test_grades(teacher_id, tests, class_name)
+    points, absent, max_points = stack_test_grades(test_grades)
+    return test_grades, compute_scenarios(points, absent, max_points, options)
+
+
+def modification_details(scenario, original_class_avg, options):
+    """Summary stored in Test.scores_modified_details after a bell grade is applied."""
+    return (
+        f"Type: {SCENARIO_DETAIL_TYPES.get(scenario, 'Original')}; "
+        f"Original average: {original_class_avg if original_class_avg is not None else 'N/A'}; "
+        f"New average: {options.target_avg if options.adjust_avg and options.target_avg is not None else 'N/A'}; "
+        f"Scores > 100% allowed: {'True' if options.allow_over_100 else 'False'}; "
+        f"Lowest score allowed: {options.lowest_score if options.lowest_score is not None else 'N/A'}"
+    )
+
+
+def _grade_points_update(rows, notes, modified_at, from_values):
+    """One UPDATE writing new points and bell-grade metadata for (grade id, points) rows."""
+    metadata = {
+        'modification_type': 'bell_grade',
+        'modification_notes': notes,
+        'modified_at': modified_at,
+        'updated_at': modified_at,
+    }
+    if from_values:
+        new_values = values(column('id', Integer), column('grade', Float), name='new_values').data(rows)
+        return (
+            update(Grade)
+            .where(Grade.id == new_values.c.id)
+            .values(grade=new_values.c.grade, **metadata)
+        )
+    # SQLite and others: same single statement, with the new points in a CASE
+    return (
+        update(Grade)
+        .where(Grade.id.in_([grade_id for grade_id, _points in rows]))
+        .values(grade=case(dict(rows), value=Grade.id), **metadata)
+    )
+
+
+def apply_scenario(teacher_id, tests, scenario, options, class_name=''):
+    """Apply a scenario to many tests and persist it without loading Grade objects.
+
+    Scores are computed for all tests in one vectorized pass. Changed grades are
+    written GRADE_UPDATE_CHUNK_SIZE at a time by UPDATEs that also write the
+    modification metadata: joined against a VALUES list of (grade id, new points) on
+    PostgreSQL, where the last chunk runs in a WITH clause of the UPDATE that marks
+    the tests modified, so a batch of up to one chunk is one statement. Elsewhere the
+    new points go in a CASE and the tests get their own UPDATE. Absent/ungraded
+    students and scenarios the options don't enable are skipped.
+    Returns {test_id: number of grades updated}. The caller commits.
+    """
+    if not tests:
+        return {}
+    test_grades, scenarios = scenarios_for_tests(teacher_id, tests, options, class_name)
+    new_points = scenarios.points(scenario, [t.max_points for t in tests])
+    notes = f"Bell Grade - {SCENARIO_NAMES.get(scenario, scenario)}, Target Avg: {options.target_avg}%"
+    modified_at = datetime.utcnow()
+
+    updated = {}
+    grade_rows = []
+    details = {}
+    for i, tg in enumerate(test_grades):
+        points = new_points[i, :len(tg.grade_ids)]
+        keep = ~np.isnan(points)
+        rows = [(grade_id, p) for grade_id, p, k in zip(tg.grade_ids, points.tolist(), keep) if k]
+        grade_rows.extend(rows)
+        updated[tg.test.id] = len(rows)
+        details[tg.test.id] = modification_details(scenario, to_optional(scenarios.class_avg[i]), options)
+
+    from_values = db.session.get_bind().dialect.name in _UPDATE_FROM_VALUES_DIALECTS
+    grade_stmts = [
+        _grade_points_update(grade_rows[start:start + GRADE_UPDATE_CHUNK_SIZE], notes, modified_at, from_values)
+        for start in range(0, len(grade_rows), GRADE_UPDATE_CHUNK_SIZE)
+    ]
+    tests_stmt = (
+        update(Test)
+        .where(Test.id.in_(details))
+        .values(scores_modified=True, scores_modified_details=case(details, value=Test.id))
+    )
+    if grade_stmts and from_values:
+        tests_stmt = tests_stmt.add_cte(grade_stmts.pop().returning(Grade.id).cte('bell_grades'))
+    for grades_stmt in grade_stmts:
+        db.session.execute(grades_stmt.execution_options(synchronize_session=False))
+    db.session.execute(tests_stmt.execution_options(synchronize_session=False))
+    return updated
+
+
+class BatchSelectionError(ValueError):
+    """The batch request selects no tests; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def select_batch_tests(teacher_id, data):
+    """Tests chosen by an apply_bell_selection_batch body: test_ids, or semester with filters.
+
+    Raises BatchSelectionError when the selection is missing, names tests the teacher
+    does not own, matches nothing or matches more than MAX_BATCH_TESTS tests.
+    """
+    test_query = Test.query.filter_by(teacher_id=teacher_id)
+    test_ids = data.get('test_ids')
+    if test_ids:
+        test_query = test_query.filter(Test.id.in_(test_ids))
+    else:
+        semester = (data.get('semester') or '').strip()
+        if not semester:
+            raise BatchSelectionError('test_ids or semester is required')
+        test_query = test_query.filter(Test.semester == semester)
+        for field in ('competency', 'class_name', 'subject'):
+            value = (data.get(field) or '').strip()
+            if value:
+                test_query = test_query.filter(getattr(Test, field) == value)
+    tests = test_query.order_by(Test.test_date, Test.id).limit(MAX_BATCH_TESTS + 1).all()
+
+    if len(tests) > MAX_BATCH_TESTS or (test_ids and len(set(test_ids)) > MAX_BATCH_TESTS):
+        raise BatchSelectionError(f'Too many tests (max {MAX_BATCH_TESTS})', 413)
+    if test_ids and len(tests) != len(set(test_ids)):
+        raise BatchSelectionError('Test not found', 404)
+    if not tests:
+        raise BatchSelectionError('No tests match the selection', 404)
+    return tests
@@ -0,0 +1,141 @@
+"""Classroom name parsing and test-to-classroom matching.
+
+Classrooms are stored as "102 (Grade 1)" while specialist tests only record a class
+name and grade label, so tests are matched to classrooms by name. The match is stored
+on Test.classroom_id and re-run whenever a teacher's classrooms are created or renamed.
+"""
+import re
+
+_HUNDREDS_PATTERN = re.compile(r'^([1-9])\d+$')
+_NUMBER_LETTER_PATTERN = re.compile(r'^([1-9])[A-Za-z]+$')
+_LEADING_DIGIT_PATTERN = re.compile(r'^([1-9])')
+
+
+def extract_grade_from_classroom_name(classroom_name):
+    """Extract grade from classroom name (e.g., '101' -> 'Grade 1', '201' -> 'Grade 2')"""
+    # Try to extract grade from classroom name patterns
+    # Pattern 1: "101", "102" -> Grade 1
+    # Pattern 2: "201", "202" -> Grade 2
+    # Pattern 3: "Grade 1", "Grade 2" -> Grade 1, Grade 2
+    # Pattern 4: "1A", "2B" -> Grade 1, Grade 2
+
+    if not classroom_name:
+        return 'Unknown Grade'
+
+    # Check if it already contains "Grade"
+    if 'grade' in classroom_name.lower():
+        return classroom_name
+
+    # Try to extract number patterns
+    # Look for patterns like 101, 201, 301 (first digit is grade)
+    match = _HUNDREDS_PATTERN.match(classroom_name)
+    if match:
+        grade_num = match.group(1)
+        return f'Grade {grade_num}'
+
+    # Look for patterns like 1A, 2B, 3C (first character is grade)
+    match = _NUMBER_LETTER_PATTERN.match(classroom_name)
+    if match:
+        grade_num = match.group(1)
+        return f'Grade {grade_num}'
+
+    # Look for any number at the beginning
+    match = _LEADING_DIGIT_PATTERN.match(classroom_name)
+    if match:
+        grade_num = match.group(1)
+        return f'Grade {grade_num}'
+
+    # If no pattern matches, return the classroom name as-is
+    return classroom_name
+
+
+def split_classroom_name(full_name):
+    """Split a stored classroom name into (class name, grade label).
+
+    Handles the "102 (Grade 1)" format written by the setup wizard and falls back
+    to guessing the grade from bare names like "102".
+    """
+    if '(' in full_name and ')' in full_name:
+        parts = full_name.split(' (')
+        return parts[0], parts[1].rstrip(')')
+    return full_name, extract_grade_from_classroom_name(full_name)
+
+
+def normalize_grade_label(value):
+    """Normalize teacher-defined grade labels so "Grade 5" and "5" compare equal."""
+    if value is None:
+        return ''
+    s = str(value).strip()
+    if not s:
+        return ''
+    lower = s.lower()
+    if lower.startswith('grade '):
+        s = s[6:].strip()
+    return s
+
+
+class ClassroomResolver:
+    """Find the classroom a specialist test belongs to, memoized per (class_name, grade).
+
+    Matching does NOT depend on the exact "Class (Grade X)" format, since grade labels
+    are teacher-defined (e.g., "5" vs "Grade 5"). Primary match is class name; the grade
+    label is only a tie-breaker.
+    """
+
+    def __init__(self, classrooms):
+        self._parsed = [(c, *split_classroom_name(c.name)) for c in classrooms]
+        self._cache = {}
+
+    def resolve(self, class_name, grade):
+        key = (class_name, grade)
+        if key not in self._cache:
+            self._cache[key] = self._match(class_name, grade)
+        return self._cache[key]
+
+    def _match(self, class_name, grade):
+        normalized_test_grade = normalize_grade_label(grade)
+        first_match = None
+        for classroom, classroom_name, classroom_grade in self._parsed:
+            if class_name != classroom_name and class_name != classroom.name:
+                continue
+            if not normalized_test_grade or normalized_test_grade == normalize_grade_label(classroom_grade):
+                return classroom
+            if first_match is None:
+                first_match = classroom
+        return first_match
+
+
+def assign_test_classroom(test, resolver):
+    """Store the resolved classroom and normalized grade key on a test.
+
+    Only specialist tests name a class; homeroom tests keep classroom_id empty.
+    """
+    test.grade_key = normalize_grade_label(test.grade) or None
+    classroom = resolver.resolve(test.class_name, test.grade) if test.class_name else None
+    test.classroom_id = classroom.id if classroom else None
+    return classroom
+
+
+def refresh_test_classrooms(teacher_id, unresolved_only=False):
+    """Re-match a teacher's tests to their current classrooms.
+
+    Call after creating or renaming classrooms, before committing, so tests follow
+    classroom names the same way name matching does. Returns (resolved, unresolved).
+    """
+    from . import db
+    from .models import Classroom, School, Test
+
+    db.session.flush()
+    query = Test.query.filter_by(teacher_id=teacher_id)
+    if unresolved_only:
+        query = query.filter(Test.classroom_id.is_(None))
+    tests = query.all()
+    if not tests:
+        return 0, 0
+
+    classrooms = Classroom.query.join(School).filter(
+        School.teacher_id == teacher_id
+    ).order_by(School.id, Classroom.id).all()
+    resolver = ClassroomResolver(classrooms)
+    resolved = sum(1 for test in tests if assign_test_classroom(test, resolver))
+    return resolved, len(tests) - resolved
@@ -0,0 +1,135 @@
+import click
+from flask.cli import with_appcontext
+
+from . import db
+from .classroom_names import refresh_test_classrooms
+from .models import Teacher
+
+
+@click.command('backfill-test-classrooms')
+@click.option('--all', 'refresh_all', is_flag=True, help='Re-resolve every test, not only tests without a classroom.')
+@with_appcontext
+def backfill_test_classrooms(refresh_all):
+    """Fill Test.classroom_id and Test.grade_key for existing tests."""
+    resolved = 0
+    unresolved = 0
+    for teacher_id, in db.session.query(Teacher.id).order_by(Teacher.id).all():
+        teacher_resolved, teacher_unresolved = refresh_test_classrooms(teacher_id, unresolved_only=not refresh_all)
+        resolved += teacher_resolved
+        unresolved += teacher_unresolved
+        db.session.commit()
+
+    click.echo(f'Resolved {resolved} tests, {unresolved} without a matching classroom.')
+
+
+@click.command('explain-queries')
+@click.option('--teacher-id', type=int, help='Teacher whose data to use (default: the one with the most tests).')
+@click.option('--verbose', '-v', is_flag=True, help='Print the SQL and full plan of every query.')
+@with_appcontext
+def explain_queries(teacher_id, verbose):
+    """EXPLAIN the main page queries and report whether they use their indexes."""
+    from .query_audit import audit_queries, busiest_teacher_id
+
+    teacher_id = teacher_id or busiest_teacher_id()
+    if teacher_id is None:
+        raise click.ClickException('No teachers in the database; seed it first.')
+
+    click.echo(f'Query plans for teacher {teacher_id} ({db.engine.dialect.name}):')
+    failures = 0
+    for report in audit_queries(teacher_id):
+        status = 'ok' if report.ok else 'MISSING INDEX'
+        click.echo(f'  [{status}] {report.name}')
+        for name in report.missing:
+            click.echo(f'      expected: {name}')
+        for line in report.full_scans:
+            click.echo(f'      full scan: {line.strip()}')
+        if verbose:
+            for statement in report.statements:
+                click.echo('      sql: ' + ' '.join(statement.split()))
+            for line in report.plan:
+                click.echo(f'      plan: {line}')
+        failures += 0 if report.ok else 1
+
+    if failures:
+        raise click.ClickException(f'{failures} queries do not use their intended indexes.')
+
+
+@click.command('delete-teacher')
+@click.argument('email')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+@with_appcontext
+def delete_teacher(email, yes):
+    """Delete a teacher account and all of its data."""
+    from .purge import purge_teacher
+
+    teacher = Teacher.query.filter_by(email=email).first()
+    if teacher is None:
+        raise click.ClickException(f'No teacher with email {email}.')
+    if not yes:
+        click.confirm(f'Delete {teacher.first_name} {teacher.last_name} <{email}> and all of their data?', abort=True)
+    counts = purge_teacher(teacher.id)
+    db.session.commit()
+    click.echo('Deleted ' + ', '.join(f'{count} {table}' for table, count in counts.items() if count) + '.')
+
+
+@click.command('run-worker')
+@click.option('--once', is_flag=True, help='Run the jobs that are due, then exit.')
+@with_appcontext
+def run_worker(once):
+    """Run queued background jobs until stopped (SIGTERM finishes the current job first)."""
+    import signal
+    import threading
+
+    from .jobs import run_worker as run_jobs
+
+    stop = threading.Event()
+
+    def request_stop(signum, _frame):
+        click.echo(f'Received signal {signum}; stopping after the current job.')
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    run_jobs(once=once, stop_event=stop, log=click.echo)
+
+
+@click.command('send-mail')
+@with_appcontext
+def send_mail():
+    """Send the queued mail that is due, then exit."""
+    from .outbox import deliver_outbox, mail_configured, requeue_stale_mail
+
+    if not mail_configured():
+        raise click.ClickException('MAIL_SERVER is not configured.')
+    requeue_stale_mail()
+    click.echo(f'Sent {deliver_outbox()} messages.')
+
+
+@click.command('debug-smtp')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=1025, show_default=True, type=int)
+def debug_smtp(host, port):
+    """Run a local SMTP server that prints the messages it receives instead of delivering them."""
+    from .debug_smtp import DebuggingSMTPServer
+
+    def echo(recipients, message):
+        click.echo(f"---------- To: {', '.join(recipients)}\nSubject: {message['Subject']}\n")
+        click.echo(message.get_body(('plain',)).get_content())
+
+    server = DebuggingSMTPServer(host, port, echo=echo)
+    click.echo(f'Debugging SMTP server on {host}:{server.port}; set MAIL_SERVER={host} MAIL_PORT={server.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def register_commands(app):
+    app.cli.add_command(backfill_test_classrooms)
+    app.cli.add_command(explain_queries)
+    app.cli.add_command(delete_teacher)
+    app.cli.add_command(run_worker)
+    app.cli.add_command(send_mail)
+    app.cli.add_command(debug_smtp)
@@ -0,0 +1,232 @@
+"""Dashboard aggregation.
+
+Builds everything the dashboard page shows from the request's TeacherContext
+(schools and classrooms with student counts, wizard config) plus a fixed number of
+grouped queries (tests with a has-grades flag, absences), independent of how many
+classrooms or tests a teacher has.
+"""
+from dataclasses import dataclass, field, fields
+from datetime import date, timedelta
+
+from flask import url_for
+from flask_babel import gettext as _
+from sqlalchemy import exists
+
+from . import db
+from .classroom_names import split_classroom_name
+from .models import Student, Test, Grade
+
+
+@dataclass
+class ClassroomSummary:
+    id: int
+    name: str
+    school_name: str
+    student_count: int
+
+    @property
+    def clean_name(self):
+        return split_classroom_name(self.name)[0]
+
+
+@dataclass
+class TestStatusEntry:
+    test_id: int
+    class_name: str
+    test_name: str
+    test_date: date
+    status: str
+
+
+@dataclass
+class MakeupEntry:
+    class_name: str
+    student_name: str
+    test_name: str
+    test_date: date
+
+
+@dataclass
+class DashboardSummary:
+    setup_completed: bool
+    schools: list
+    teacher_type: str = None
+    classrooms_by_school: dict = field(default_factory=dict)
+    all_classrooms: list = field(default_factory=list)
+    classrooms_by_grade: dict = field(default_factory=dict)
+    specialist_subject: str = None
+    subjects: list = field(default_factory=list)
+    grade: str = None
+    notifications: list = field(default_factory=list)
+    makeup_tests: list = field(default_factory=list)
+    ungraded_tests: list = field(default_factory=list)
+    upcoming_tests: list = field(default_factory=list)
+    overdue_tests: list = field(default_factory=list)
+
+    def as_template_context(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+def _classroom_summaries(context):
+    return [
+        ClassroomSummary(
+            id=classroom.id,
+            name=classroom.name,
+            school_name=classroom.school.name,
+            student_count=context.student_counts.get(classroom.id, 0),
+        )
+        for classroom in context.classrooms
+    ]
+
+
+def _load_tests(teacher_id):
+    """All of a teacher's tests with an EXISTS flag telling whether any grade was entered."""
+    has_grades = exists().where(Grade.test_id == Test.id).label('has_grades')
+    return (
+        db.session.query(
+            Test.id, Test.class_name, Test.subject, Test.test_name, Test.test_date, has_grades
+        )
+        .filter(Test.teacher_id == teacher_id)
+        .order_by(Test.test_date, Test.id)
+        .all()
+    )
+
+
+def load_makeup_tests(teacher_id):
+    """Students marked absent on any of the teacher's tests, by test date then last name."""
+    rows = (
+        db.session.query(
+            Test.class_name, Student.first_name, Student.last_name, Test.test_name, Test.test_date
+        )
+        .join(Grade, Grade.test_id == Test.id)
+        .join(Student, Grade.student_id == Student.id)
+        .filter(Test.teacher_id == teacher_id, Grade.absent == True)
+        .order_by(Test.test_date, Student.last_name)  # Sort by date first, then student name
+        .all()
+    )
+    return [
+        MakeupEntry(
+            class_name=row.class_name,
+            student_name=f"{row.first_name} {row.last_name}",
+            test_name=row.test_name,
+            test_date=row.test_date,
+        )
+        for row in rows
+    ]
+
+
+def build_dashboard_summary(context, today=None):
+    """Compute the dashboard for a teacher's TeacherContext.
+
+    Issues the same handful of queries regardless of data size.
+    """
+    today = today or date.today()
+    teacher_id = context.teacher_id
+
+    summary = DashboardSummary(setup_completed=len(context.schools) > 0, schools=context.schools)
+    if not summary.setup_completed:
+        return summary
+
+    classrooms = _classroom_summaries(context)
+    for classroom in classrooms:
+        summary.classrooms_by_school.setdefault(classroom.school_name, []).append(classroom)
+    summary.all_classrooms = classrooms
+
+    wizard = context.wizard
+    summary.teacher_type = context.teacher_type
+
+    if summary.teacher_type == 'specialist':
+        # Group classrooms by grade - extract grade and classroom name from stored format
+        summary.classrooms_by_grade = context.class_names_by_grade
+        summary.specialist_subject = wizard.subject_name if wizard and wizard.subject_name else None
+    elif classrooms:
+        if wizard:
+            summary.subjects = list(wizard.subjects)
+            summary.grade = wizard.grade_name if wizard.grade_name else classrooms[0].name
+        else:
+            # Fallback to default subjects if no Setup Wizard data
+            summary.subjects = ['Mathematics', 'English', 'Science', 'Social Studies']
+            summary.grade = classrooms[0].name
+
+    tests = _load_tests(teacher_id)
+    one_week_ago = today - timedelta(days=7)
+    for test in tests:
+        if not test.has_grades:
+            summary.ungraded_tests.append(TestStatusEntry(
+                test_id=test.id,
+                class_name=test.class_name or 'N/A',
+                test_name=test.test_name,
+                test_date=test.test_date,
+                status='Not graded',
+            ))
+            if test.test_date <= one_week_ago:
+                summary.overdue_tests.append(summary.ungraded_tests[-1])
+        if test.test_date >= today:
+            summary.upcoming_tests.append(TestStatusEntry(
+                test_id=test.id,
+                class_name=test.class_name or 'N/A',
+                test_name=test.test_name,
+                test_date=test.test_date,
+                status='Upcoming',
+            ))
+
+    summary.makeup_tests = load_makeup_tests(teacher_id)
+    summary.notifications = _build_notifications(summary, wizard, tests)
+    return summary
+
+
+def _build_notifications(summary, wizard, tests):
+    notifications = []
+
+    # Check if competencies were skipped in setup wizard
+    if wizard and wizard.competencies_skipped:
+        notifications.append({
+            'type': 'competencies',
+            'message': _('You have not filled out your competency information yet. You will need to do this for the grade calculations to work correctly'),
+            'button_text': _('Complete Setup'),
+            'button_url': url_for('main.setup_wizard')
+        })
+
+    # Check for classes without students
+    classes_without_students = [c.clean_name for c in summary.all_classrooms if c.student_count == 0]
+    if classes_without_students:
+        notifications.append({
+            'type': 'students',
+            'message': _('You have not inputted students for class %(class_names)s', class_names=', '.join(classes_without_students)),
+            'button_text': _("Let's go!"),
+            'button_url': url_for('main.student_wizard')
+        })
+
+    # Check for classes without tests (missing competency coverage)
+    if wizard:
+        if summary.teacher_type == 'homeroom':
+            # For homeroom, any test in one of the wizard subjects covers the class
+            subjects = set(wizard.subjects)
+            has_tests = any(t.subject in subjects for t in tests)
+            classes_without_tests = [] if has_tests else [c.clean_name for c in summary.all_classrooms]
+        else:
+            # For specialist, check tests by class
+            tested_classes = {t.class_name for t in tests}
+            classes_without_tests = [
+                c.clean_name for c in summary.all_classrooms if c.clean_name not in tested_classes
+            ]
+
+        if classes_without_tests:
+            notifications.append({
+                'type': 'tests',
+                'message': _('You have not created any tests for class %(class_names)s', class_names=', '.join(classes_without_tests)),
+                'button_text': _("Let's go!"),
+                'button_url': url_for('main.create_tests')
+            })
+
+    # Tests older than 1 week that have no grades entered
+    if summary.overdue_tests:
+        oldest_test = summary.overdue_tests[0]  # First in ascending order is oldest
+        notifications.append({
+            'type': 'overdue_grading',
+            'message': _('You have %(count)d tests that occurred over a week ago which need marking and grades inputted', count=len(summary.overdue_tests)),
+            'button_text': _("Grade Now"),
+            'button_url': url_for('main.input_grades', test_id=oldest_test.test_id)
+        })
+
+    return notifications
@@ -0,0 +1,53 @@
+"""Per-teacher data version and conditional GETs.
+
+Teacher.data_version increases with every write to the teacher's data: each
+write view and background job calls bump_data_version in the transaction it
+commits, so read-only POSTs (previews, job submissions, logins) leave the
+version and the teacher's cached responses alone. JSON views decorated
+with @etag_from_data_version send a strong ETag derived from it and answer a
+matching If-None-Match with 304 before running their own queries. The version
+is read from current_user, which Flask-Login already loaded, so an unchanged
+reload costs that single primary-key lookup.
+"""
+import hashlib
+from functools import wraps
+
+from flask import current_app, make_response, request
+from flask_login import current_user
+from sqlalchemy import update
+
+from . import db
+from .models import Teacher
+
+
+def bump_data_version(teacher_id):
+    """Increase the teacher's data version in the current transaction; the caller commits."""
+    db.session.execute(
+        update(Teacher).where(Teacher.id == teacher_id).values(data_version=Teacher.data_version + 1)
+    )
+
+
+def data_version_etag(teacher):
+    # The same version serves different URLs (filters), so the path and query are part of the tag;
+    # the language is too because it changes through GET /set_language without a bump
+    key = f'{teacher.id}:{teacher.data_version or 0}:{teacher.preferred_language}:{request.full_path}'
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def etag_from_data_version(view):
+    """Serve 304 Not Modified while the teacher's data is unchanged since the client's copy."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = data_version_etag(current_user)
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Browsers keep the copy but revalidate it on every fetch
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
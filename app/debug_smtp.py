@@ -0,0 +1,96 @@
+"""A stand-in SMTP server for development and tests.
+
+`flask debug-smtp` runs it on localhost:1025 and prints every message; set
+MAIL_SERVER=localhost and MAIL_PORT=1025 to send the app's mail there. Tests can
+start a DebuggingSMTPServer on port 0 and read its `messages`. It speaks only as
+much SMTP as smtplib needs (no authentication or TLS); recipients listed in
+`reject` are refused with a 550, to exercise permanent failures.
+"""
+import socketserver
+import threading
+from email import message_from_bytes, policy
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line.rstrip(b'\r\n') == b'.':
+                return b''.join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def handle(self):
+        self.reply('220 localhost debugging SMTP server')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('utf-8', 'replace').strip().partition(' ')
+            command = command.upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = argument.partition(':')[2].strip().strip('<>')
+                if address in self.server.reject:
+                    self.reply('550 No such user here')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                if not recipients:
+                    self.reply('503 Need RCPT command')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.server.deliver(recipients, message_from_bytes(self.read_data(), policy=policy.default))
+                recipients = []
+                self.reply('250 OK')
+            elif command in ('RSET', 'NOOP'):
+                recipients = [] if command == 'RSET' else recipients
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    """Accepts every message into `messages` (and passes it to `echo`, if given)."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=1025, reject=(), echo=None):
+        super().__init__((host, port), _SMTPHandler)
+        self.reject = set(reject)
+        self.echo = echo
+        self.messages = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def deliver(self, recipients, message):
+        with self._lock:
+            self.messages.append(message)
+        if self.echo:
+            self.echo(recipients, message)
+
+    def start(self):
+        """Serve from a daemon thread and return the server."""
+        threading.Thread(target=self.serve_forever, name='debug-smtp', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,324 @@
+"""Grade matrix exports.
+
+The XLSX export is written with an openpyxl write-only worksheet and shared named
+styles, fed in batches from a server-side cursor, and spooled to a temporary file,
+so memory stays bounded no matter how many students or tests are exported. The
+CSV export is generated a batch at a time from the same cursor and streamed
+straight into the response.
+"""
+import csv
+import io
+import tempfile
+import time
+from itertools import islice
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+from sqlalchemy import and_
+
+from . import db
+from .grade_matrix import ClassAverageAccumulator, MatrixLayout, points_row, student_totals
+from .metrics import observe_export
+from .models import Student, Test, Grade
+from .rosters import students_for_tests_query
+from .wizard_config import get_wizard_config
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv'
+
+# Exports smaller than this stay in memory; larger ones spill to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# Row layout:
+# 1: title
+# 2: max points (tests)
+# 3: test weights (tests)
+# 4: competency weights (competency total columns)
+# 5: headers (test names)
+# 6: student-name label row
+# 7+: students, then the class average row
+
+
+def sanitize_for_filename(s: str) -> str:
+    return ''.join([c if c.isalnum() else '_' for c in (s or '').strip()]).strip('_').lower()
+
+
+def grade_matrix_filename(class_name, semester, extension, prefix='grade_matrix'):
+    filename_parts = [prefix]
+    if class_name:
+        filename_parts.append(sanitize_for_filename(class_name))
+    if semester:
+        filename_parts.append(sanitize_for_filename(semester))
+    return '_'.join([p for p in filename_parts if p]) + '.' + extension
+
+
+def grade_matrix_title(class_name, semester):
+    title = 'Grade Matrix'
+    if class_name or semester:
+        parts = [p for p in [class_name, semester] if p]
+        title = f"Grade Matrix - {' - '.join(parts)}"
+    return title
+
+
+def grade_matrix_export_data(teacher_id, semester, class_name, subject):
+    """(tests, student_query, competency_weights) for the export filters, or None if there is nothing to export."""
+    test_query = Test.query.filter_by(teacher_id=teacher_id)
+    if semester:
+        test_query = test_query.filter(Test.semester == semester)
+    if class_name:
+        test_query = test_query.filter(Test.class_name == class_name)
+    if subject:
+        test_query = test_query.filter(Test.subject == subject)
+
+    tests = test_query.order_by(Test.test_date).all()
+    if not tests:
+        return None
+
+    student_query = students_for_tests_query(teacher_id, tests, class_name)
+    if not db.session.query(student_query.exists()).scalar():
+        return None
+
+    wizard_config = get_wizard_config(teacher_id)
+    competency_weights = wizard_config.weights_for_tests(tests) if wizard_config else {}
+    return tests, student_query, competency_weights
+
+
+def iter_student_grades(student_query, test_ids):
+    """Yield (student_id, first_name, last_name, {test_id: points}) in last/first name order.
+
+    Students and their grades come from one LEFT JOIN read through a server-side
+    cursor in batches, so students without grades still appear. Absent students get
+    None, like ungraded ones.
+    """
+    query = (
+        student_query
+        .outerjoin(Grade, and_(Grade.student_id == Student.id, Grade.test_id.in_(test_ids)))
+        .with_entities(Student.id, Student.first_name, Student.last_name, Grade.test_id, Grade.grade, Grade.absent)
+        .order_by(Student.last_name, Student.first_name, Student.id)
+        .execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    )
+
+    current = None
+    for student_id, first_name, last_name, test_id, points, absent in query:
+        if current is None or current[0] != student_id:
+            if current is not None:
+                yield current
+            current = (student_id, first_name, last_name, {})
+        if test_id is not None:
+            current[3][test_id] = None if absent else points
+    if current is not None:
+        yield current
+
+
+def iter_batches(iterable, size=STREAM_BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _named_styles():
+    align_center = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    align_left = Alignment(horizontal='left', vertical='center')
+    font_bold = Font(bold=True)
+    info_font = Font(color='7F7F7F')
+    header_fill = PatternFill('solid', fgColor='D9D9D9')
+    fill_total = PatternFill('solid', fgColor='E9ECEF')
+    fill_grand = PatternFill('solid', fgColor='E7F3FF')
+    return [
+        NamedStyle('gm_title', font=Font(bold=True, size=16)),
+        NamedStyle('gm_info_label', font=info_font, alignment=align_left),
+        NamedStyle('gm_info', font=info_font, alignment=align_center),
+        NamedStyle('gm_center', alignment=align_center),
+        NamedStyle('gm_header', font=font_bold, alignment=align_center, fill=header_fill),
+        NamedStyle('gm_header_total', font=font_bold, alignment=align_center, fill=fill_total),
+        NamedStyle('gm_header_grand', font=font_bold, alignment=align_center, fill=fill_grand),
+        NamedStyle('gm_label', font=font_bold, alignment=align_left),
+        NamedStyle('gm_name', alignment=align_left),
+        NamedStyle('gm_total', font=font_bold, alignment=align_center, fill=fill_total, number_format='0.0%'),
+        NamedStyle('gm_grand', font=font_bold, alignment=align_center, fill=fill_grand, number_format='0.0%'),
+        NamedStyle('gm_percent', alignment=align_center, number_format='0.0%'),
+    ]
+
+
+def _column_plan(layout):
+    """(kind, payload) per grade column: each competency's tests then its total, then the grand total."""
+    columns = []
+    for comp in layout.competencies:
+        columns.extend(('test', t) for t in layout.tests_in(comp))
+        columns.append(('total', comp))
+    if layout.show_grand_total:
+        columns.append(('grand', None))
+    return columns
+
+
+def write_grade_matrix_xlsx(fileobj, title, tests, competency_weights, student_rows):
+    """Write the grade matrix workbook to `fileobj`.
+
+    student_rows yields (student_id, first_name, last_name, {test_id: points}) and is
+    consumed once, in batches. Totals and class averages come from grade_matrix, so
+    the workbook shows the same numbers as the review grid; absent and ungraded
+    cells are left blank.
+    """
+    layout = MatrixLayout.build(tests, competency_weights)
+    wb = Workbook(write_only=True)
+    for style in _named_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet('Grade Matrix')
+
+    def cell(value=None, style=None):
+        c = WriteOnlyCell(ws, value=value)
+        if style:
+            c.style = style
+        return c
+
+    def fraction(value):
+        # Percentages are written as fractions with a percent number format
+        return None if np.isnan(value) else float(value) / 100.0
+
+    columns = _column_plan(layout)
+
+    ws.column_dimensions['A'].width = 22
+    for index, (kind, _payload) in enumerate(columns, start=2):
+        ws.column_dimensions[get_column_letter(index)].width = 12 if kind == 'test' else 14
+    ws.freeze_panes = 'B7'
+
+    # Header block
+    ws.append([cell(title, 'gm_title')])
+    ws.append([cell('Test - Max Points', 'gm_info_label')] + [
+        cell(payload.max_points, 'gm_info') if kind == 'test' else cell(style='gm_center')
+        for kind, payload in columns
+    ])
+    ws.append([cell('Test Weight', 'gm_info_label')] + [
+        cell(payload.test_weight or 0, 'gm_info') if kind == 'test' else cell(style='gm_center')
+        for kind, payload in columns
+    ])
+    ws.append([cell('Competency Weight', 'gm_info_label')] + [
+        cell(int(competency_weights.get(payload, 0)), 'gm_info') if kind == 'total' else cell(style='gm_center')
+        for kind, payload in columns
+    ])
+    header_styles = {'test': 'gm_header', 'total': 'gm_header_total', 'grand': 'gm_header_grand'}
+    header_values = {'test': lambda t: f"{t.test_name}", 'total': lambda c: f"Total {c}", 'grand': lambda _: 'Grand Total'}
+    ws.append([cell('Test Name', 'gm_header')] + [
+        cell(header_values[kind](payload), header_styles[kind]) for kind, payload in columns
+    ])
+    ws.append([cell('Student Name', 'gm_label')])
+
+    def append_row(label, label_style, points, percentages, comp_totals, grand, test_style):
+        values = [cell(label, label_style)]
+        j = 0
+        for k, comp in enumerate(layout.competencies):
+            for _t in layout.tests_in(comp):
+                if points is not None:
+                    value = None if np.isnan(points[j]) else float(points[j])
+                else:
+                    value = fraction(percentages[j])
+                values.append(cell(value, test_style))
+                j += 1
+            values.append(cell(fraction(comp_totals[k]), 'gm_total'))
+        if layout.show_grand_total:
+            values.append(cell(fraction(grand), 'gm_grand'))
+        ws.append(values)
+
+    # Student rows
+    averages = ClassAverageAccumulator(layout)
+    written = 0
+    for batch in iter_batches(student_rows):
+        points = np.array([points_row(grades, layout) for _sid, _first, _last, grades in batch], dtype=float)
+        totals = student_totals(points, layout)
+        averages.add(totals.percentages)
+        for i, (_student_id, first_name, last_name, _grades) in enumerate(batch):
+            append_row(
+                f"{first_name} {last_name}", 'gm_name', points[i], None,
+                totals.competencies[i], totals.grand[i], 'gm_center',
+            )
+        written += len(batch)
+
+    # Class average row
+    class_avg = averages.result()
+    append_row(
+        'Class Average', 'gm_label', None, class_avg.tests,
+        class_avg.competencies, class_avg.grand, 'gm_percent',
+    )
+
+    wb.save(fileobj)
+    return written
+
+
+def export_grade_matrix_xlsx_file(title, tests, competency_weights, student_query):
+    """Build the workbook into a spooled temporary file, rewound and ready for send_file."""
+    started = time.perf_counter()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    student_rows = iter_student_grades(student_query, [t.id for t in tests])
+    write_grade_matrix_xlsx(spool, title, tests, competency_weights, student_rows)
+    observe_export('xlsx', spool.tell(), time.perf_counter() - started)
+    spool.seek(0)
+    return spool
+
+
+def iter_grade_matrix_csv(tests, competency_weights, student_rows):
+    """Yield the grade matrix as UTF-8 CSV chunks, one per batch of students.
+
+    One header row, then one row per student: id, first and last name, points per
+    test (blank when absent or ungraded) and the competency and grand totals as
+    percentages rounded to one decimal, computed by grade_matrix like the review
+    grid. There is no class average row, so every row is a student.
+    """
+    layout = MatrixLayout.build(tests, competency_weights)
+    columns = _column_plan(layout)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def chunk():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    header_values = {
+        'test': lambda t: f"{t.test_name} ({t.max_points}pts)",
+        'total': lambda c: f"Total {c}",
+        'grand': lambda _: 'Grand Total',
+    }
+    writer.writerow(['Student ID', 'First Name', 'Last Name'] + [
+        header_values[kind](payload) for kind, payload in columns
+    ])
+    yield chunk()
+
+    def value(number):
+        return '' if np.isnan(number) else round(float(number), 1)
+
+    for batch in iter_batches(student_rows):
+        points = np.array([points_row(grades, layout) for _sid, _first, _last, grades in batch], dtype=float)
+        totals = student_totals(points, layout)
+        for i, (student_id, first_name, last_name, _grades) in enumerate(batch):
+            row = [student_id, first_name, last_name]
+            j = 0
+            for k, comp in enumerate(layout.competencies):
+                for _t in layout.tests_in(comp):
+                    row.append('' if np.isnan(points[i, j]) else float(points[i, j]))
+                    j += 1
+                row.append(value(totals.competencies[i, k]))
+            if layout.show_grand_total:
+                row.append(value(totals.grand[i]))
+            writer.writerow(row)
+        yield chunk()
+
+
+def stream_grade_matrix_csv(tests, competency_weights, student_query):
+    """Generator for a streaming response; records the export metrics once the last chunk is sent."""
+    started = time.perf_counter()
+    size = 0
+    student_rows = iter_student_grades(student_query, [t.id for t in tests])
+    for data in iter_grade_matrix_csv(tests, competency_weights, student_rows):
+        size += len(data)
+        yield data
+    observe_export('csv', size, time.perf_counter() - started)
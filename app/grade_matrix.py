@@ -0,0 +1,207 @@
+"""Grade matrix totals.
+
+Competency totals, grand totals and class averages for the review grid and every
+grade matrix export, computed with NumPy over a (students x tests) matrix of
+percentages. Percentages are 0-100.
+
+Absent or ungraded cells are NaN and are left out of every total and average, the
+same way the exported spreadsheet leaves out blank cells: a competency total is the
+test-weighted mean of the graded tests, the grand total is the competency-weighted
+mean of the competencies that have a total, and a total with no weight behind it is
+NaN.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import db
+from .models import Grade
+
+
+def group_tests_by_competency(tests):
+    """Return (sorted competency names, {competency: [tests in the given order]})."""
+    tests_by_comp = {}
+    for t in tests:
+        comp = t.competency or 'Unassigned'
+        tests_by_comp.setdefault(comp, []).append(t)
+    return sorted(tests_by_comp.keys()), tests_by_comp
+
+
+@dataclass
+class MatrixLayout:
+    """Column order and weights of a grade matrix.
+
+    `tests` is ordered competency by competency (the column order of the grid and
+    exports). `test_to_comp` is a (tests x competencies) 0/1 matrix.
+    """
+    tests: list
+    competencies: list
+    max_points: np.ndarray
+    test_weights: np.ndarray
+    competency_weights: np.ndarray
+    test_to_comp: np.ndarray
+
+    @classmethod
+    def build(cls, tests, competency_weights):
+        competencies, tests_by_comp = group_tests_by_competency(tests)
+        ordered = [t for comp in competencies for t in tests_by_comp[comp]]
+        test_to_comp = np.zeros((len(ordered), len(competencies)))
+        for j, t in enumerate(ordered):
+            test_to_comp[j, competencies.index(t.competency or 'Unassigned')] = 1.0
+        return cls(
+            tests=ordered,
+            competencies=competencies,
+            max_points=np.array([t.max_points for t in ordered], dtype=float),
+            test_weights=np.array([t.test_weight or 0 for t in ordered], dtype=float),
+            competency_weights=np.array([competency_weights.get(c, 0) for c in competencies], dtype=float),
+            test_to_comp=test_to_comp,
+        )
+
+    @property
+    def show_grand_total(self):
+        return len(self.competencies) > 1
+
+    def tests_in(self, competency):
+        return [t for t in self.tests if (t.competency or 'Unassigned') == competency]
+
+
+def _weighted_mean(values, weights):
+    """Row-wise weighted mean over the non-NaN entries of `values`.
+
+    weights is either a vector (one weight per column) or a (columns x groups)
+    matrix, in which case one mean per group is returned.
+    """
+    graded = ~np.isnan(values)
+    numerator = np.where(graded, values, 0.0) @ weights
+    denominator = graded.astype(float) @ weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def competency_totals(percentages, layout):
+    """(rows x tests) percentages -> (rows x competencies) test-weighted totals."""
+    return _weighted_mean(percentages, layout.test_weights[:, None] * layout.test_to_comp)
+
+
+def grand_totals(comp_totals, layout):
+    """(rows x competencies) totals -> (rows,) competency-weighted grand totals."""
+    return _weighted_mean(comp_totals, layout.competency_weights)
+
+
+@dataclass
+class StudentTotals:
+    """Totals for a block of students; rows follow the block's student order."""
+    percentages: np.ndarray
+    competencies: np.ndarray
+    grand: np.ndarray
+
+
+def student_totals(points, layout):
+    """Compute totals for a (students x tests) points matrix (NaN = absent/ungraded)."""
+    points = np.asarray(points, dtype=float).reshape(-1, len(layout.tests))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = points / layout.max_points * 100.0
+    comp = competency_totals(percentages, layout)
+    return StudentTotals(percentages=percentages, competencies=comp, grand=grand_totals(comp, layout))
+
+
+@dataclass
+class ClassAverages:
+    tests: np.ndarray
+    competencies: np.ndarray
+    grand: float
+
+
+class ClassAverageAccumulator:
+    """Per-test class averages accumulated over blocks of students.
+
+    Lets exports that stream students in batches produce the same class average
+    row as a computation over the whole matrix.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.sums = np.zeros(len(layout.tests))
+        self.counts = np.zeros(len(layout.tests))
+
+    def add(self, percentages):
+        graded = ~np.isnan(percentages)
+        self.sums += np.where(graded, percentages, 0.0).sum(axis=0)
+        self.counts += graded.sum(axis=0)
+
+    def result(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tests = np.where(self.counts > 0, self.sums / np.maximum(self.counts, 1), np.nan)
+        # Competency and grand averages weight the test averages, as for a student row
+        comp = competency_totals(tests[None, :], self.layout)
+        return ClassAverages(tests=tests, competencies=comp[0], grand=float(grand_totals(comp, self.layout)[0]))
+
+
+def class_averages(percentages, layout):
+    accumulator = ClassAverageAccumulator(layout)
+    accumulator.add(percentages)
+    return accumulator.result()
+
+
+def points_row(grades, layout):
+    """{test_id: points or None} -> one row of points in layout order."""
+    return [np.nan if grades.get(t.id) is None else grades[t.id] for t in layout.tests]
+
+
+def load_points(student_ids, test_ids):
+    """Map student_id -> {test_id: points} in one query; absent students get None."""
+    matrix = {}
+    if not student_ids or not test_ids:
+        return matrix
+    rows = (
+        db.session.query(Grade.student_id, Grade.test_id, Grade.grade, Grade.absent)
+        .filter(Grade.test_id.in_(test_ids), Grade.student_id.in_(student_ids))
+        .all()
+    )
+    for student_id, test_id, points, absent in rows:
+        matrix.setdefault(student_id, {})[test_id] = None if absent else points
+    return matrix
+
+
+def _optional(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+@dataclass
+class GradeMatrix:
+    layout: MatrixLayout
+    student_ids: list
+    totals: StudentTotals
+    averages: ClassAverages
+
+    def as_json(self):
+        """Totals and averages keyed for the review grid (ids as keys, None for '--')."""
+        comps = self.layout.competencies
+        return {
+            'totals': {
+                student_id: {
+                    'competencies': {c: _optional(self.totals.competencies[i, k]) for k, c in enumerate(comps)},
+                    'grand': _optional(self.totals.grand[i]) if self.layout.show_grand_total else None,
+                }
+                for i, student_id in enumerate(self.student_ids)
+            },
+            'averages': {
+                'tests': {t.id: _optional(self.averages.tests[j]) for j, t in enumerate(self.layout.tests)},
+                'competencies': {c: _optional(self.averages.competencies[k]) for k, c in enumerate(comps)},
+                'grand': _optional(self.averages.grand) if self.layout.show_grand_total else None,
+            },
+        }
+
+
+def compute_grade_matrix(tests, competency_weights, student_ids, grades):
+    """Compute every total for the given students from {student_id: {test_id: points}}."""
+    layout = MatrixLayout.build(tests, competency_weights)
+    points = np.array([points_row(grades.get(sid, {}), layout) for sid in student_ids], dtype=float)
+    totals = student_totals(points, layout)
+    return GradeMatrix(
+        layout=layout,
+        student_ids=list(student_ids),
+        totals=totals,
+        averages=class_averages(totals.percentages, layout),
+    )
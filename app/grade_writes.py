@@ -0,0 +1,215 @@
+"""Bulk grade writes.
+
+Grades for a test are written with one dialect-aware upsert
+(INSERT ... ON CONFLICT (test_id, student_id) DO UPDATE) on PostgreSQL and SQLite,
+plus one DELETE for cleared entries, instead of a SELECT and flush per student.
+"""
+import math
+from datetime import datetime
+
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import School, Classroom, Student, Test, Grade
+
+# Upper bound on cells accepted by one review-grid save, to keep request time bounded
+MAX_GRADE_UPDATES = 5000
+
+# Rows per multi-VALUES statement; keeps bind parameters under SQLite/PostgreSQL limits
+UPSERT_CHUNK_SIZE = 1000
+
+_UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def owned_student_ids(teacher_id, student_ids):
+    """Return the subset of student_ids that belong to one of the teacher's classrooms."""
+    if not student_ids:
+        return set()
+    rows = (
+        db.session.query(Student.id)
+        .join(Classroom, Student.classroom_id == Classroom.id)
+        .join(School, Classroom.school_id == School.id)
+        .filter(School.teacher_id == teacher_id, Student.id.in_(set(student_ids)))
+        .all()
+    )
+    return {row[0] for row in rows}
+
+
+def upsert_grades(rows, update_columns):
+    """Insert grade rows, updating `update_columns` on (test_id, student_id) conflicts.
+
+    Each row must carry test_id and student_id. Columns absent from update_columns
+    (e.g. original_grade/original_absent) are only written when the row is new.
+    Dialects without ON CONFLICT support fall back to the ORM.
+    """
+    if not rows:
+        return
+    insert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if insert is None:
+        _orm_upsert(rows, update_columns)
+        return
+
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(Grade).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Grade.test_id, Grade.student_id],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+        db.session.execute(stmt)
+
+
+def _orm_upsert(rows, update_columns):
+    pairs = {(row['test_id'], row['student_id']) for row in rows}
+    test_ids = {test_id for test_id, _ in pairs}
+    existing = {
+        (g.test_id, g.student_id): g
+        for g in Grade.query.filter(Grade.test_id.in_(test_ids)).all()
+        if (g.test_id, g.student_id) in pairs
+    }
+    for row in rows:
+        grade = existing.get((row['test_id'], row['student_id']))
+        if grade is None:
+            db.session.add(Grade(**row))
+        else:
+            for column in update_columns:
+                setattr(grade, column, row[column])
+
+
+def save_test_grades(test, grades_data):
+    """Apply a grade-entry payload for one test.
+
+    Entries with a grade or marked absent are inserted or updated; entries with
+    neither delete any existing record. New rows record original_grade and
+    original_absent, which are never changed afterwards. Returns counts.
+    """
+    # Last entry wins if a student appears twice
+    entries = {}
+    for grade_data in grades_data:
+        entries[grade_data['student_id']] = grade_data
+
+    existing_ids = {
+        row[0] for row in db.session.query(Grade.student_id).filter(Grade.test_id == test.id).all()
+    }
+
+    now = datetime.utcnow()
+    rows = []
+    to_delete = []
+    for student_id, grade_data in entries.items():
+        grade_value = grade_data['grade']
+        absent_value = bool(grade_data.get('absent', False))
+        # Only save if there's actual data (grade exists OR student is absent)
+        if grade_value is not None or absent_value:
+            rows.append({
+                'test_id': test.id,
+                'student_id': student_id,
+                'grade': grade_value,
+                'absent': absent_value,
+                'original_grade': grade_value,
+                'original_absent': absent_value,
+                'created_at': now,
+                'updated_at': now,
+            })
+        elif student_id in existing_ids:
+            to_delete.append(student_id)
+
+    upsert_grades(rows, update_columns=['grade', 'absent', 'updated_at'])
+    if to_delete:
+        db.session.execute(
+            delete(Grade).where(Grade.test_id == test.id, Grade.student_id.in_(to_delete))
+        )
+
+    inserted = sum(1 for row in rows if row['student_id'] not in existing_ids)
+    return {
+        'inserted': inserted,
+        'updated': len(rows) - inserted,
+        'deleted': len(to_delete),
+    }
+
+
+def apply_grade_updates(teacher_id, updates):
+    """Apply review-grid cell edits ({student_id, test_id, grade}) as one batch.
+
+    Test and student ownership are each checked with one query, existing rows are
+    loaded with one tuple-IN query, and writes go out as one upsert plus one DELETE
+    (for cells cleared to null). Cells that fail validation are skipped and
+    returned in 'rejected' with a reason.
+    """
+    rejected = []
+    cells = {}
+    for update in updates:
+        if not isinstance(update, dict):
+            rejected.append({'student_id': None, 'test_id': None, 'reason': 'invalid'})
+            continue
+        try:
+            student_id = int(update['student_id'])
+            test_id = int(update['test_id'])
+            grade_value = update.get('grade')
+            if grade_value is not None:
+                grade_value = float(grade_value)
+                if not math.isfinite(grade_value):
+                    raise ValueError(f'grade must be a finite number, got {grade_value}')
+        except (KeyError, TypeError, ValueError):
+            rejected.append({'student_id': update.get('student_id'), 'test_id': update.get('test_id'), 'reason': 'invalid'})
+            continue
+        # Last edit wins if a cell appears twice
+        cells[(test_id, student_id)] = grade_value
+
+    test_ids = {test_id for test_id, _ in cells}
+    owned_tests = {
+        row[0] for row in db.session.query(Test.id).filter(Test.teacher_id == teacher_id, Test.id.in_(test_ids)).all()
+    } if test_ids else set()
+    owned_students = owned_student_ids(teacher_id, {student_id for _, student_id in cells})
+
+    accepted = {}
+    for (test_id, student_id), grade_value in cells.items():
+        if test_id not in owned_tests:
+            rejected.append({'student_id': student_id, 'test_id': test_id, 'reason': 'test not found'})
+        elif student_id not in owned_students:
+            rejected.append({'student_id': student_id, 'test_id': test_id, 'reason': 'student not found'})
+        else:
+            accepted[(test_id, student_id)] = grade_value
+
+    existing = set()
+    if accepted:
+        existing = set(
+            db.session.query(Grade.test_id, Grade.student_id)
+            .filter(tuple_(Grade.test_id, Grade.student_id).in_(list(accepted)))
+            .all()
+        )
+
+    now = datetime.utcnow()
+    rows = []
+    to_delete = []
+    for (test_id, student_id), grade_value in accepted.items():
+        if grade_value is not None:
+            rows.append({
+                'test_id': test_id,
+                'student_id': student_id,
+                'grade': grade_value,
+                'absent': False,
+                'original_grade': grade_value,
+                'original_absent': False,
+                'created_at': now,
+                'updated_at': now,
+            })
+        elif (test_id, student_id) in existing:
+            # Delete grade if value is None/null
+            to_delete.append((test_id, student_id))
+
+    upsert_grades(rows, update_columns=['grade', 'updated_at'])
+    if to_delete:
+        db.session.execute(
+            delete(Grade).where(tuple_(Grade.test_id, Grade.student_id).in_(to_delete))
+        )
+
+    inserted = sum(1 for row in rows if (row['test_id'], row['student_id']) not in existing)
+    return {
+        'inserted': inserted,
+        'updated': len(rows) - inserted,
+        'deleted': len(to_delete),
+        'rejected': rejected,
+    }
@@ -0,0 +1,97 @@
+"""Grade-completion status for a teacher's tests.
+
+Counts graded and absent students for every test with one grouped query over
+(test, classroom) and combines it with per-classroom roster sizes, instead of
+querying students and grades test by test.
+"""
+from dataclasses import dataclass
+
+from sqlalchemy import case, func
+
+from . import db
+from .classroom_names import ClassroomResolver
+from .models import School, Classroom, Student, Test, Grade
+
+
+@dataclass
+class TestCompletion:
+    roster_size: int = 0
+    graded_count: int = 0
+    absent_count: int = 0
+
+    @property
+    def grades_complete(self):
+        # Grading is complete when ALL students have been graded (have grade OR absent)
+        return self.roster_size > 0 and self.graded_count == self.roster_size
+
+    @property
+    def has_absent_students(self):
+        return self.absent_count > 0
+
+
+def roster_sizes(teacher_id):
+    """Map classroom_id -> number of students for all of a teacher's classrooms."""
+    rows = (
+        db.session.query(Student.classroom_id, func.count(Student.id))
+        .join(Classroom, Student.classroom_id == Classroom.id)
+        .join(School, Classroom.school_id == School.id)
+        .filter(School.teacher_id == teacher_id)
+        .group_by(Student.classroom_id)
+        .all()
+    )
+    return dict(rows)
+
+
+def grade_counts(teacher_id):
+    """Map (test_id, classroom_id) -> (graded, absent) for a teacher's tests and students.
+
+    A student is "graded" if they have a grade record with either a numeric grade
+    or marked as absent.
+    """
+    graded = func.sum(case(((Grade.grade.isnot(None)) | (Grade.absent == True), 1), else_=0))
+    absent = func.sum(case((Grade.absent == True, 1), else_=0))
+    rows = (
+        db.session.query(Grade.test_id, Student.classroom_id, graded, absent)
+        .join(Test, Grade.test_id == Test.id)
+        .join(Student, Grade.student_id == Student.id)
+        .join(Classroom, Student.classroom_id == Classroom.id)
+        .join(School, Classroom.school_id == School.id)
+        .filter(Test.teacher_id == teacher_id, School.teacher_id == teacher_id)
+        .group_by(Grade.test_id, Student.classroom_id)
+        .all()
+    )
+    return {(test_id, classroom_id): (int(g or 0), int(a or 0)) for test_id, classroom_id, g, a in rows}
+
+
+def compute_completion(teacher_id, tests, teacher_type, classrooms, resolver=None, roster=None):
+    """Return {test_id: TestCompletion} for the given tests.
+
+    Specialist tests count only the students of the test's classroom; homeroom tests
+    count every student the teacher has. `roster` (classroom_id -> student count)
+    can be passed in when the caller already has it.
+    """
+    sizes = roster if roster is not None else roster_sizes(teacher_id)
+    counts = grade_counts(teacher_id)
+    resolver = resolver or ClassroomResolver(classrooms)
+    all_classroom_ids = [c.id for c in classrooms]
+
+    completion = {}
+    for test in tests:
+        if teacher_type == 'specialist':
+            if test.classroom_id:
+                classroom_ids = [test.classroom_id]
+            else:
+                # Tests created before classroom_id was stored
+                target = resolver.resolve(test.class_name, test.grade)
+                classroom_ids = [target.id] if target else []
+        else:
+            classroom_ids = all_classroom_ids
+
+        status = TestCompletion()
+        for classroom_id in classroom_ids:
+            status.roster_size += sizes.get(classroom_id, 0)
+            g, a = counts.get((test.id, classroom_id), (0, 0))
+            status.graded_count += g
+            status.absent_count += a
+        completion[test.id] = status
+    return completion
@@ -0,0 +1,484 @@
+"""Background jobs.
+
+Long exports and bulk writes are queued as Job rows and run by `flask run-worker`,
+a separate process (the Procfile's worker), so they are not cut off by gunicorn's
+request timeout. The web side submits a job and the browser polls its status and
+progress, then downloads the result file, which is stored on the Job row so web
+and worker processes need not share a disk. Uploaded input files (roster imports)
+are stored on the row the same way until the job finishes.
+
+Workers claim the oldest runnable job with a conditional UPDATE, so any number of
+them can share the table. A teacher has at most JOB_TEACHER_CONCURRENCY jobs
+running (checked by the claiming UPDATE itself) and JOB_MAX_QUEUED_PER_TEACHER
+waiting. A failed job is retried with
+exponential backoff up to its max_attempts unless the handler raised JobError;
+a job whose worker stops sending heartbeats is treated as failed.
+
+With JOBS_RUN_INLINE (the development default) submit_job runs the job in the
+request instead, so the app works without a worker process. Between jobs the
+worker also delivers queued mail (see outbox.py).
+
+Handlers are registered with @job_handler(kind). They get a JobContext and the
+job's params, do their work in the worker's session without committing, and
+return a JobResult (a file), a summary dict, or None. The handler's writes and
+the job's final state are committed together.
+"""
+import io
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, text, update
+from sqlalchemy.orm import aliased
+
+from . import db
+from .models import Job
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+# First key of the PostgreSQL advisory lock (namespace, teacher id) that serializes claims
+_CLAIM_LOCK_NAMESPACE = 22031
+
+_handlers = {}
+
+
+class JobError(Exception):
+    """A failure retrying cannot fix, such as bad parameters or nothing to export."""
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+@dataclass
+class JobResult:
+    filename: str
+    mimetype: str
+    data: bytes
+    summary: dict = None
+
+
+def job_handler(kind, max_attempts=None):
+    """Register the function that runs jobs of this kind."""
+    def decorator(func):
+        _handlers[kind] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def job_kinds():
+    return sorted(_handlers)
+
+
+class JobContext:
+    """What a handler knows about its job; progress is written by the worker's heartbeat."""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.teacher_id = job.teacher_id
+        self.attempt = job.attempts
+        self.input_name = job.input_name
+        self._progress = None
+        self._lock = threading.Lock()
+
+    def input_stream(self):
+        """The file uploaded with the job as a binary stream, or None."""
+        data = db.session.query(Job.input_data).filter(Job.id == self.job_id).scalar()
+        return io.BytesIO(data) if data is not None else None
+
+    def progress(self, done, total=None, message=None):
+        """Report progress as a percentage, or as `done` out of `total` steps."""
+        percent = done * 100 // total if total else done
+        with self._lock:
+            self._progress = (max(0, min(int(percent), 100)), message)
+
+    def take_progress(self):
+        with self._lock:
+            progress, self._progress = self._progress, None
+        return progress
+
+
+def job_as_json(job):
+    from flask import url_for
+
+    download_url = None
+    if job.status == 'succeeded' and job.result_name and job.result_size is not None:
+        download_url = url_for('main.download_job_result', job_id=job.id)
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'summary': json.loads(job.summary) if job.summary else None,
+        'input_name': job.input_name,
+        'result_name': job.result_name,
+        'result_size': job.result_size,
+        'download_url': download_url,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def submit_job(teacher_id, kind, params, input_file=None):
+    """Queue a job (or run it now with JOBS_RUN_INLINE) and return it.
+
+    input_file is an optional (filename, bytes) upload for the handler to read.
+    """
+    if kind not in _handlers:
+        raise JobError(f"Unknown job kind '{kind}'; expected one of {', '.join(job_kinds())}")
+    config = current_app.config
+    waiting = Job.query.filter(
+        Job.teacher_id == teacher_id, Job.status.in_(('queued', 'running'))
+    ).count()
+    if waiting >= config['JOB_MAX_QUEUED_PER_TEACHER']:
+        raise QueueFull(f'You already have {waiting} jobs waiting; try again when they finish')
+
+    _func, max_attempts = _handlers[kind]
+    job = Job(
+        teacher_id=teacher_id,
+        kind=kind,
+        params=json.dumps(params or {}),
+        status='queued',
+        max_attempts=max_attempts or config['JOB_MAX_ATTEMPTS'],
+        run_after=datetime.utcnow(),
+    )
+    if input_file is not None:
+        job.input_name, job.input_data = input_file
+    db.session.add(job)
+    db.session.commit()
+
+    if config['JOBS_RUN_INLINE']:
+        claimed = _claim(job.id, 'inline', teacher_id)
+        if claimed is not None:
+            run_job(claimed)
+        job = db.session.get(Job, job.id)
+    return job
+
+
+def _claim(job_id, worker_id, teacher_id):
+    """Mark a queued job running for this worker.
+
+    Returns None if another worker got it first or its teacher already has
+    JOB_TEACHER_CONCURRENCY jobs running: the running count is part of the UPDATE's
+    WHERE clause, so the limit is checked and the job claimed in one statement.
+    SQLite runs one write at a time; on PostgreSQL two such statements could each
+    count before the other commits, so claims for a teacher also take that
+    teacher's advisory lock until the claim commits.
+    """
+    now = datetime.utcnow()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(
+            text('SELECT pg_advisory_xact_lock(:namespace, :teacher_id)'),
+            {'namespace': _CLAIM_LOCK_NAMESPACE, 'teacher_id': teacher_id},
+        )
+    running = aliased(Job)
+    running_count = (
+        select(func.count(running.id))
+        .where(running.teacher_id == Job.teacher_id, running.status == 'running')
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == 'queued',
+               running_count < current_app.config['JOB_TEACHER_CONCURRENCY'])
+        .values(status='running', worker=worker_id, attempts=Job.attempts + 1,
+                started_at=now, heartbeat_at=now, progress=0, message=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.get(Job, job_id, populate_existing=True) if result.rowcount == 1 else None
+
+
+def claim_next_job(worker_id):
+    """Claim the oldest runnable job whose teacher is under the concurrency limit."""
+    busy_teachers = (
+        db.session.query(Job.teacher_id)
+        .filter(Job.status == 'running')
+        .group_by(Job.teacher_id)
+        .having(func.count(Job.id) >= current_app.config['JOB_TEACHER_CONCURRENCY'])
+    )
+    # Skips teachers already at their limit; _claim enforces it against concurrent workers
+    candidates = (
+        db.session.query(Job.id, Job.teacher_id)
+        .filter(Job.status == 'queued', Job.run_after <= datetime.utcnow(), Job.teacher_id.not_in(busy_teachers))
+        .order_by(Job.run_after, Job.id)
+        .limit(10)
+        .all()
+    )
+    for job_id, teacher_id in candidates:
+        job = _claim(job_id, worker_id, teacher_id)
+        if job is not None:
+            return job
+    return None
+
+
+def _record_failure(job, error, retry):
+    now = datetime.utcnow()
+    job.error = error
+    job.worker = None
+    if retry and job.attempts < job.max_attempts:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        job.status = 'queued'
+        job.run_after = now + timedelta(seconds=delay)
+        job.message = f'Attempt {job.attempts} failed; retrying in {delay}s'
+    else:
+        job.status = 'failed'
+        job.finished_at = now
+        job.message = None
+        job.input_data = None
+
+
+class _Heartbeat(threading.Thread):
+    """Writes heartbeat_at and reported progress on its own connection while a job runs.
+
+    Progress never goes through the handler's session, so it cannot commit the
+    handler's unfinished work. Writes that fail (e.g. SQLite busy with the job's
+    own transaction) are skipped until the next beat.
+    """
+
+    def __init__(self, app, context, interval):
+        super().__init__(name=f'job-{context.job_id}-heartbeat', daemon=True)
+        self.app = app
+        self.context = context
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stopped.wait(self.interval):
+                values = {'heartbeat_at': datetime.utcnow()}
+                progress = self.context.take_progress()
+                if progress is not None:
+                    values['progress'], values['message'] = progress
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            update(Job).where(Job.id == self.context.job_id, Job.status == 'running').values(**values)
+                        )
+                except Exception as e:
+                    self.app.logger.debug('Job %s heartbeat skipped: %s', self.context.job_id, e)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome."""
+    app = current_app._get_current_object()
+    func, _max_attempts = _handlers.get(job.kind, (None, None))
+    context = JobContext(job)
+    heartbeat = _Heartbeat(app, context, app.config['JOB_HEARTBEAT_INTERVAL'])
+    heartbeat.start()
+    started = time.perf_counter()
+    try:
+        if func is None:
+            raise JobError(f"No handler for job kind '{job.kind}'")
+        result = func(context, json.loads(job.params or '{}'))
+    except Exception as e:
+        db.session.rollback()
+        retry = not isinstance(e, JobError)
+        if retry:
+            app.logger.exception('Job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        else:
+            error = str(e)
+        job = db.session.get(Job, job.id, populate_existing=True)
+        _record_failure(job, error, retry)
+        db.session.commit()
+        return job
+    finally:
+        heartbeat.stop()
+
+    job.status = 'succeeded'
+    job.progress = 100
+    job.message = None
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    job.input_data = None
+    if isinstance(result, JobResult):
+        job.result_name = result.filename
+        job.result_mimetype = result.mimetype
+        job.result_size = len(result.data)
+        job.result_data = result.data
+        result = result.summary
+    job.summary = json.dumps(result) if result is not None else None
+    db.session.commit()
+    app.logger.info('Job %s (%s) succeeded in %.1fs', job.id, job.kind, time.perf_counter() - started)
+    return job
+
+
+def requeue_stale_jobs():
+    """Fail or retry running jobs whose worker stopped sending heartbeats."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_AFTER'])
+    stale = Job.query.filter(Job.status == 'running', Job.heartbeat_at < cutoff).all()
+    for job in stale:
+        _record_failure(job, f'Worker {job.worker} stopped responding', retry=True)
+    db.session.commit()
+    return len(stale)
+
+
+def expire_job_results():
+    """Drop result files older than JOB_RESULT_TTL; the job rows stay for history."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RESULT_TTL'])
+    result = db.session.execute(
+        update(Job)
+        .where(Job.finished_at < cutoff, Job.result_size.is_not(None))
+        .values(result_data=None, result_size=None, message='Result expired')
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def run_worker(once=False, stop_event=None, log=print):
+    """Claim and run jobs until stop_event is set (or, with once, until the queue is empty)."""
+    from .outbox import SMTPConnection, deliver_outbox, purge_old_mail, requeue_stale_mail
+
+    config = current_app.config
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    stop_event = stop_event or threading.Event()
+    mail = SMTPConnection(config)
+    log(f'Worker {worker_id} started (jobs: {", ".join(job_kinds())})')
+    next_maintenance = 0.0
+    processed = 0
+    while not stop_event.is_set():
+        if time.monotonic() >= next_maintenance:
+            requeued = requeue_stale_jobs()
+            expired = expire_job_results()
+            if requeued or expired:
+                log(f'Requeued {requeued} stale jobs, expired {expired} results')
+            requeue_stale_mail()
+            purge_old_mail()
+            next_maintenance = time.monotonic() + config['JOB_STALE_AFTER'] / 2
+
+        sent = deliver_outbox(mail)
+        if sent:
+            log(f'Sent {sent} emails')
+        mail.close_if_idle(config['MAIL_CONNECTION_IDLE'])
+
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                break
+            stop_event.wait(config['JOB_POLL_INTERVAL'])
+            continue
+
+        log(f'Job {job.id} ({job.kind}) for teacher {job.teacher_id}, attempt {job.attempts}')
+        job = run_job(job)
+        log(f'Job {job.id} {job.status}' + (f': {job.error}' if job.error else ''))
+        processed += 1
+        # Start every job with an empty identity map
+        db.session.remove()
+    mail.close()
+    log(f'Worker {worker_id} stopped after {processed} jobs')
+    return processed
+
+
+@job_handler('grade_matrix_xlsx')
+def grade_matrix_xlsx_job(context, params):
+    from .exports import (
+        XLSX_MIMETYPE, export_grade_matrix_xlsx_file, grade_matrix_export_data, grade_matrix_filename,
+        grade_matrix_title,
+    )
+
+    semester = params.get('semester', '')
+    class_name = params.get('class_name', '')
+    subject = params.get('subject', '')
+    export_data = grade_matrix_export_data(context.teacher_id, semester, class_name, subject)
+    if export_data is None:
+        raise JobError('No data to export')
+    tests, student_query, competency_weights = export_data
+
+    context.progress(10, message='Writing workbook')
+    spool = export_grade_matrix_xlsx_file(
+        grade_matrix_title(class_name, semester), tests, competency_weights, student_query
+    )
+    return JobResult(grade_matrix_filename(class_name, semester, 'xlsx'), XLSX_MIMETYPE, spool.read())
+
+
+@job_handler('grade_reports_zip')
+def grade_reports_zip_job(context, params):
+    from .exports import grade_matrix_filename
+    from .pdf_reports import REPORT_VARIANTS, ZIP_MIMETYPE, semester_reports, stream_reports_zip
+
+    semester = params.get('semester', '')
+    subject = params.get('subject', '')
+    variant = params.get('variant', 'summary')
+    if not semester:
+        raise JobError('semester is required')
+    if variant not in REPORT_VARIANTS:
+        raise JobError(f"variant must be one of {', '.join(REPORT_VARIANTS)}")
+
+    reports = semester_reports(context.teacher_id, semester, subject, variant)
+    if not reports:
+        raise JobError('No data to export')
+    chunks = []
+    # The first chunk is written with the first PDF, then one per PDF, then the directory
+    for done, chunk in enumerate(stream_reports_zip(reports, variant)):
+        chunks.append(chunk)
+        context.progress(min(done, len(reports)), len(reports), message=f'{min(done, len(reports))} of {len(reports)} classes')
+    filename = grade_matrix_filename('', semester, 'zip', prefix='grade_reports')
+    return JobResult(filename, ZIP_MIMETYPE, b''.join(chunks), summary={'reports': len(reports)})
+
+
+@job_handler('bell_batch')
+def bell_batch_job(context, params):
+    from .bell_curve import BatchSelectionError, BellOptions, SCENARIOS, apply_scenario, select_batch_tests
+    from .data_version import bump_data_version
+
+    scenario = params.get('scenario')
+    if scenario not in SCENARIOS:
+        raise JobError('Invalid scenario')
+    try:
+        tests = select_batch_tests(context.teacher_id, params)
+    except BatchSelectionError as e:
+        raise JobError(str(e))
+
+    context.progress(10, message=f'Curving {len(tests)} tests')
+    class_name = (params.get('class_name') or '').strip()
+    updated = apply_scenario(context.teacher_id, tests, scenario, BellOptions.from_request(params), class_name)
+    bump_data_version(context.teacher_id)
+    return {
+        'updated': sum(updated.values()),
+        'tests': [{'test_id': test_id, 'updated': count} for test_id, count in updated.items()]
+    }
+
+
+@job_handler('flush_database')
+def flush_database_job(context, params):
+    from .data_version import bump_data_version
+    from .purge import purge_teacher_data
+    from .wizard_config import invalidate_wizard_config
+
+    counts = purge_teacher_data(context.teacher_id)
+    bump_data_version(context.teacher_id)
+    invalidate_wizard_config(context.teacher_id)
+    return {'deleted': counts}
+
+
+@job_handler('roster_import')
+def roster_import_job(context, params):
+    from .data_version import bump_data_version
+    from .roster_import import RosterImportError, import_roster_file
+
+    stream = context.input_stream()
+    if stream is None:
+        raise JobError('No file uploaded')
+    context.progress(10, message=f'Importing {context.input_name}')
+    try:
+        result = import_roster_file(context.teacher_id, context.input_name, stream, params.get('classroom_id'))
+    except RosterImportError as e:
+        raise JobError(str(e))
+    bump_data_version(context.teacher_id)
+    return result.as_json()
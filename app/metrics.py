@@ -0,0 +1,157 @@
+"""Prometheus metrics.
+
+Route latency by endpoint and status, database pool checkout wait and saturation,
+grade matrix export size and duration, grade rows written by save_grades, and
+outbox mail delivery results, served at /metrics in the Prometheus text format.
+
+Under gunicorn each worker has its own counters. Set PROMETHEUS_MULTIPROC_DIR to
+an empty, writable directory (gunicorn.conf.py clears it on start and cleans up
+after exited workers) and /metrics aggregates every worker's values from there.
+
+/metrics answers requests from the local machine, or requests carrying
+`Authorization: Bearer <METRICS_TOKEN>` when that setting is configured.
+"""
+import hmac
+import os
+import time
+
+from flask import Response, abort, current_app, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+
+from . import db
+
+REQUEST_LATENCY = Histogram(
+    'grading_http_request_duration_seconds',
+    'Time to produce a response, by Flask endpoint, method and status.',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'grading_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the SQLAlchemy pool.',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_CHECKED_OUT = Gauge(
+    'grading_db_pool_checked_out_connections',
+    'Connections currently checked out of the pool.',
+    multiprocess_mode='livesum',
+)
+POOL_CAPACITY = Gauge(
+    'grading_db_pool_capacity_connections',
+    'Pool size plus allowed overflow.',
+    multiprocess_mode='livesum',
+)
+POOL_SATURATION = Gauge(
+    'grading_db_pool_saturation_ratio',
+    'Checked-out connections / capacity of the busiest worker pool.',
+    multiprocess_mode='livemax',
+)
+EXPORT_BYTES = Histogram(
+    'grading_export_size_bytes',
+    'Size of generated grade matrix exports.',
+    ['format'],
+    buckets=(10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 50e6),
+)
+EXPORT_DURATION = Histogram(
+    'grading_export_duration_seconds',
+    'Time to generate a grade matrix export.',
+    ['format'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+GRADE_ROWS_WRITTEN = Counter(
+    'grading_grade_rows_written_total',
+    'Grade rows written by save_grades, by operation.',
+    ['operation'],
+)
+MAIL_MESSAGES = Counter(
+    'grading_mail_messages_total',
+    'Outbox delivery attempts, by result (sent, retried, failed).',
+    ['status'],
+)
+
+_LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def observe_request(endpoint, method, status, seconds):
+    REQUEST_LATENCY.labels(endpoint=endpoint or 'unmatched', method=method, status=str(status)).observe(seconds)
+
+
+def observe_export(export_format, size_bytes, seconds):
+    EXPORT_BYTES.labels(format=export_format).observe(size_bytes)
+    EXPORT_DURATION.labels(format=export_format).observe(seconds)
+
+
+def count_grade_rows(counts):
+    """Record the {'inserted', 'updated', 'deleted'} counts returned by save_test_grades."""
+    for operation in ('inserted', 'updated', 'deleted'):
+        if counts.get(operation):
+            GRADE_ROWS_WRITTEN.labels(operation=operation).inc(counts[operation])
+
+
+def count_mail(status):
+    MAIL_MESSAGES.labels(status=status).inc()
+
+
+def _pool_capacity(pool):
+    # Only QueuePool has a fixed size; SQLite's default pools report 0
+    size = pool.size() if hasattr(pool, 'size') else 0
+    return size + max(getattr(pool, '_max_overflow', 0), 0)
+
+
+def _update_pool_gauges(pool, returning=0):
+    # On checkin the returning connection is still counted as checked out
+    checked_out = max(pool.checkedout() - returning, 0) if hasattr(pool, 'checkedout') else 0
+    capacity = _pool_capacity(pool)
+    POOL_CHECKED_OUT.set(checked_out)
+    POOL_CAPACITY.set(capacity)
+    POOL_SATURATION.set(checked_out / capacity if capacity else 0)
+
+
+def instrument_pool(engine):
+    """Time pool checkouts and track how many connections are in use."""
+    pool = engine.pool
+    if getattr(pool, '_grading_metrics', False):
+        return
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+    # The pool has no "checkout requested" event, so its connect() is wrapped
+    pool.connect = timed_connect
+    pool._grading_metrics = True
+    event.listen(pool, 'checkout', lambda *args: _update_pool_gauges(pool))
+    event.listen(pool, 'checkin', lambda *args: _update_pool_gauges(pool, returning=1))
+
+
+def _allowed():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return True
+    return request.remote_addr in _LOCAL_ADDRESSES
+
+
+def metrics_view():
+    if not _allowed():
+        abort(404)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    with app.app_context():
+        instrument_pool(db.engine)
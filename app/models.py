@@ -9,29 +9,32 @@ class Teacher(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     preferred_language = db.Column(db.String(5), default='en', nullable=False)
-    schools = db.relationship('School', backref='teacher', lazy=True)
+    # Increased after every write to the teacher's data; used for ETags (see data_version.py)
+    data_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Deletes go through purge.py; the database cascades to the children
+    schools = db.relationship('School', backref='teacher', lazy=True, passive_deletes=True)
 
 class School(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
-    classrooms = db.relationship('Classroom', backref='school', lazy=True, cascade="all, delete-orphan")
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='CASCADE'), nullable=False, index=True)
+    classrooms = db.relationship('Classroom', backref='school', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
 
 class Classroom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    school_id = db.Column(db.Integer, db.ForeignKey('school.id'), nullable=False)
-    students = db.relationship('Student', backref='classroom', lazy=True, cascade="all, delete-orphan")
+    school_id = db.Column(db.Integer, db.ForeignKey('school.id', ondelete='CASCADE'), nullable=False, index=True)
+    students = db.relationship('Student', backref='classroom', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
-    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), nullable=False)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id', ondelete='CASCADE'), nullable=False, index=True)
 
 class SetupWizardData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='CASCADE'), nullable=False, index=True)
     teacher_type = db.Column(db.String(20), nullable=False)  # 'homeroom' or 'specialist'
     school_name = db.Column(db.String(100), nullable=False)
     num_semesters = db.Column(db.Integer, nullable=False)
@@ -45,15 +48,22 @@ class SetupWizardData(db.Model):
     competencies_skipped = db.Column(db.Boolean, default=False, nullable=False)  # Track if Step 4 was skipped
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    # Increased by the ORM on every UPDATE; wizard_config revalidates its cache against it
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
     
-    teacher = db.relationship('Teacher', backref='setup_wizard_data', lazy=True)
+    __mapper_args__ = {'version_id_col': version}
+    
+    teacher = db.relationship('Teacher', backref=db.backref('setup_wizard_data', passive_deletes=True), lazy=True)
 
 class Test(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='CASCADE'), nullable=False)
     semester = db.Column(db.String(50), nullable=False)
     grade = db.Column(db.String(50))  # For specialist teachers
     class_name = db.Column(db.String(100))  # For specialist teachers
+    # Classroom the test was resolved to from class_name/grade (specialist teachers)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id', ondelete='SET NULL'), nullable=True, index=True)
+    grade_key = db.Column(db.String(50), index=True)  # Normalized grade label ("Grade 5" -> "5")
     subject = db.Column(db.String(100))  # For homeroom teachers
     competency = db.Column(db.String(200), nullable=False)
     test_name = db.Column(db.String(200), nullable=False)
@@ -66,17 +76,24 @@ class Test(db.Model):
     scores_modified_details = db.Column(db.Text, nullable=True)
     
     # Relationship to grades
-    grades = db.relationship('Grade', backref='test', lazy=True, cascade='all, delete-orphan')
+    grades = db.relationship('Grade', backref='test', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Test {self.test_name}>'
 
-    teacher = db.relationship('Teacher', backref='tests', lazy=True)
+    # Test lists filter by teacher and semester/class, or list all of a teacher's tests, by date
+    __table_args__ = (
+        db.Index('ix_test_teacher_semester_class', 'teacher_id', 'semester', 'class_name', 'test_date'),
+        db.Index('ix_test_teacher_test_date', 'teacher_id', 'test_date'),
+    )
+
+    teacher = db.relationship('Teacher', backref=db.backref('tests', passive_deletes=True), lazy=True)
+    classroom = db.relationship('Classroom', backref=db.backref('tests', lazy=True, passive_deletes=True), lazy=True)
 
 class Grade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=False)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id', ondelete='CASCADE'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), nullable=False, index=True)
     grade = db.Column(db.Float)  # Current/modified points earned (can be null if not graded yet)
     absent = db.Column(db.Boolean, default=False, nullable=False)  # Current absence status
     
@@ -92,16 +109,21 @@ class Grade(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # Ensure unique combination of test and student
-    __table_args__ = (db.UniqueConstraint('test_id', 'student_id', name='unique_test_student'),)
+    # Ensure unique combination of test and student (also the index for lookups by test)
+    __table_args__ = (
+        db.UniqueConstraint('test_id', 'student_id', name='unique_test_student'),
+        # Make-up lists only read absent rows, a small fraction of the table
+        db.Index('ix_grade_absent_test_id', 'test_id',
+                 postgresql_where=db.text('absent = true'), sqlite_where=db.text('absent = 1')),
+    )
     
     def __repr__(self):
         return f'<Grade test_id={self.test_id} student_id={self.student_id} grade={self.grade}>'
 
 class ClassroomLayout(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
-    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='CASCADE'), nullable=False)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id', ondelete='CASCADE'), nullable=False, index=True)
     layout_data = db.Column(db.Text, nullable=False)  # JSON string of desk positions
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -109,8 +131,68 @@ class ClassroomLayout(db.Model):
     # Ensure unique combination of teacher and classroom
     __table_args__ = (db.UniqueConstraint('teacher_id', 'classroom_id', name='unique_teacher_classroom_layout'),)
     
-    teacher = db.relationship('Teacher', backref='classroom_layouts', lazy=True)
-    classroom = db.relationship('Classroom', backref='layout', lazy=True)
+    teacher = db.relationship('Teacher', backref=db.backref('classroom_layouts', passive_deletes=True), lazy=True)
+    classroom = db.relationship('Classroom', backref=db.backref('layout', passive_deletes=True), lazy=True)
     
     def __repr__(self):
         return f'<ClassroomLayout teacher_id={self.teacher_id} classroom_id={self.classroom_id}>'
+
+class Job(db.Model):
+    """Background job run by `flask run-worker` (see jobs.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON string
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    message = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    error = db.Column(db.Text, nullable=True)
+    summary = db.Column(db.Text, nullable=True)  # JSON string returned by the handler
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Retry backoff
+    worker = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Result file, kept in the database so web and worker processes need not share a disk
+    result_name = db.Column(db.String(255), nullable=True)
+    result_mimetype = db.Column(db.String(100), nullable=True)
+    result_size = db.Column(db.Integer, nullable=True)
+    result_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    # Uploaded file the job reads (roster imports), dropped once the job has finished
+    input_name = db.Column(db.String(255), nullable=True)
+    input_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+
+    __table_args__ = (
+        # The worker's claim query: oldest runnable queued job
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+class OutboxMessage(db.Model):
+    """Outgoing email, sent in the background by outbox.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # e.g. 'password_reset'
+    to_address = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Retry backoff
+    claim_token = db.Column(db.String(36), nullable=True, index=True)  # Set by the sender that claimed it
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # The sender's claim query: oldest due pending message
+        db.Index('ix_outbox_message_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.kind} {self.status}>'
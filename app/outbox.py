@@ -0,0 +1,274 @@
+"""Outgoing email.
+
+Requests only queue mail: enqueue_mail adds an OutboxMessage to the caller's
+transaction and, once it commits, wakes this process's sender thread. The
+sender claims due messages in batches with a claim token, so any number of
+processes can deliver from the same table. It sends them over one SMTP
+connection, which stays open between batches until MAIL_CONNECTION_IDLE seconds
+pass without mail. Failures are retried with exponential backoff up to
+MAIL_MAX_ATTEMPTS; a 5xx answer (such as an unknown recipient) fails the message
+at once.
+
+The background worker (`flask run-worker`) and `flask send-mail` deliver too, so
+mail left pending by a restarted web process still goes out. Set
+MAIL_SENDER_THREAD = False to leave delivery to them. For local testing, point
+MAIL_SERVER at `flask debug-smtp`, which prints every message it receives.
+"""
+import os
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from flask import current_app
+from sqlalchemy import delete, event, select, update
+
+from . import db
+from .metrics import count_mail
+from .models import OutboxMessage
+
+CLAIM_BATCH_SIZE = 50
+
+
+def mail_configured(config=None):
+    return bool((config or current_app.config).get('MAIL_SERVER'))
+
+
+def enqueue_mail(to_address, subject, body, kind='notification'):
+    """Queue a message in the current transaction; it is sent after the caller commits."""
+    message = OutboxMessage(kind=kind, to_address=to_address, subject=subject, body=body, status='pending')
+    db.session.add(message)
+    app = current_app._get_current_object()
+    if app.config['MAIL_SENDER_THREAD']:
+        _after_commit(lambda: outbox_sender(app).wake())
+    return message
+
+
+def _after_commit(callback):
+    session = db.session()
+
+    def run(_session):
+        callback()
+
+    event.listen(session, 'after_commit', run, once=True)
+
+
+class SMTPConnection:
+    """One SMTP connection, opened on first use and reopened if the server dropped it."""
+
+    def __init__(self, config):
+        self.config = config
+        self._server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        config = self.config
+        timeout = config['MAIL_TIMEOUT']
+        if config['MAIL_USE_SSL']:
+            server = smtplib.SMTP_SSL(config['MAIL_SERVER'], config['MAIL_PORT'] or 465, timeout=timeout)
+        else:
+            server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'] or 587, timeout=timeout)
+            if config['MAIL_USE_TLS']:
+                server.starttls()
+        if config['MAIL_USERNAME'] and config['MAIL_PASSWORD']:
+            server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        return server
+
+    def send(self, message):
+        if self._server is None:
+            self._server = self._connect()
+        try:
+            self._server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Servers close idle connections; one reconnect per message
+            self._server = self._connect()
+            self._server.send_message(message)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def close_if_idle(self, idle_seconds):
+        if self._server is not None and time.monotonic() - self.last_used >= idle_seconds:
+            self.close()
+
+
+def _email_message(config, outbox_message):
+    message = EmailMessage()
+    message['Subject'] = outbox_message.subject
+    message['From'] = config['MAIL_DEFAULT_SENDER'] or config['MAIL_USERNAME'] or 'no-reply@example.com'
+    message['To'] = outbox_message.to_address
+    message.set_content(outbox_message.body)
+    return message
+
+
+def _is_permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _claim_batch(limit):
+    now = datetime.utcnow()
+    due = (
+        select(OutboxMessage.id)
+        .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(limit)
+    )
+    ids = db.session.execute(due).scalars().all()
+    if not ids:
+        return []
+    token = str(uuid.uuid4())
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids), OutboxMessage.status == 'pending')
+        .values(status='sending', claim_token=token, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return OutboxMessage.query.filter_by(claim_token=token).order_by(OutboxMessage.id).all()
+
+
+def _record_failure(message, error, permanent):
+    message.attempts += 1
+    message.last_error = f'{type(error).__name__}: {error}'
+    message.claim_token = None
+    max_attempts = current_app.config['MAIL_MAX_ATTEMPTS']
+    if permanent or message.attempts >= max_attempts:
+        message.status = 'failed'
+        count_mail('failed')
+        current_app.logger.error('Giving up on mail %s to %s: %s', message.id, message.to_address, message.last_error)
+    else:
+        delay = current_app.config['MAIL_RETRY_DELAY'] * 2 ** (message.attempts - 1)
+        message.status = 'pending'
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        count_mail('retried')
+        current_app.logger.warning('Mail %s to %s failed, retrying in %ss: %s',
+                                   message.id, message.to_address, delay, message.last_error)
+
+
+def deliver_outbox(connection=None, limit=None):
+    """Send due messages until none are left (or `limit` were tried); returns the number sent."""
+    config = current_app.config
+    if not mail_configured(config):
+        return 0
+    own_connection = connection is None
+    connection = connection or SMTPConnection(config)
+    sent = tried = 0
+    try:
+        while limit is None or tried < limit:
+            batch = _claim_batch(CLAIM_BATCH_SIZE if limit is None else min(CLAIM_BATCH_SIZE, limit - tried))
+            if not batch:
+                break
+            for message in batch:
+                tried += 1
+                try:
+                    connection.send(_email_message(config, message))
+                except Exception as e:
+                    if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                        # The connection may be unusable after a network error
+                        connection.close()
+                    _record_failure(message, e, _is_permanent(e))
+                else:
+                    message.status = 'sent'
+                    message.sent_at = datetime.utcnow()
+                    message.attempts += 1
+                    message.claim_token = None
+                    count_mail('sent')
+                    sent += 1
+                # Each result is committed so a crash never resends delivered mail
+                db.session.commit()
+    finally:
+        if own_connection:
+            connection.close()
+    return sent
+
+
+def requeue_stale_mail():
+    """Return messages claimed by a sender that stopped before finishing them."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['MAIL_STALE_AFTER'])
+    result = db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.status == 'sending', OutboxMessage.claimed_at < cutoff)
+        .values(status='pending', claim_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_old_mail():
+    """Delete sent and failed messages older than MAIL_OUTBOX_RETENTION seconds."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['MAIL_OUTBOX_RETENTION'])
+    result = db.session.execute(
+        delete(OutboxMessage)
+        .where(OutboxMessage.status.in_(('sent', 'failed')), OutboxMessage.created_at < cutoff)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+class OutboxSender(threading.Thread):
+    """Delivers the outbox from inside a web process, woken by enqueue_mail."""
+
+    def __init__(self, app):
+        super().__init__(name='outbox-sender', daemon=True)
+        self.app = app
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.connection = SMTPConnection(app.config)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        self.join()
+
+    def run(self):
+        config = self.app.config
+        next_maintenance = 0.0
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= next_maintenance:
+                        requeue_stale_mail()
+                        purge_old_mail()
+                        next_maintenance = time.monotonic() + config['MAIL_STALE_AFTER'] / 2
+                    deliver_outbox(self.connection)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Outbox delivery failed')
+                finally:
+                    db.session.remove()
+            self.connection.close_if_idle(config['MAIL_CONNECTION_IDLE'])
+            # Retries come due without a wake-up, so poll as well
+            self._wake.wait(config['MAIL_POLL_INTERVAL'])
+            self._wake.clear()
+        self.connection.close()
+
+
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+
+def outbox_sender(app):
+    """This process's sender thread, started on first use (gunicorn workers each get their own)."""
+    global _sender, _sender_pid
+    with _sender_lock:
+        if _sender is None or _sender_pid != os.getpid() or not _sender.is_alive():
+            _sender = OutboxSender(app)
+            _sender_pid = os.getpid()
+            _sender.start()
+        return _sender
@@ -0,0 +1,331 @@
+"""Server-side PDF grade reports.
+
+The request thread reads grades and computes totals (the same grade_matrix numbers
+as the review grid) into a picklable GradeReport. Laying the PDF out with
+reportlab is CPU-bound, so it runs in a process pool of PDF_WORKERS processes per
+app process; at most PDF_MAX_PENDING renders wait for a process, beyond that the
+request gets RenderQueueFull. With PDF_WORKERS = 0 reports render in the request
+thread.
+
+Two variants: 'full' is the whole grid (every test, competency totals and the
+grand total, landscape) and 'summary' only the competency and grand totals
+(portrait). stream_reports_zip renders several reports in parallel and streams
+them as one ZIP, writing each PDF as soon as it is ready.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from flask import current_app
+
+from . import db
+from .exports import (
+    grade_matrix_export_data, grade_matrix_filename, grade_matrix_title, iter_batches, iter_student_grades,
+)
+from .grade_matrix import ClassAverageAccumulator, MatrixLayout, points_row, student_totals
+from .metrics import observe_export
+from .models import Test
+
+REPORT_VARIANTS = ('full', 'summary')
+
+PDF_MIMETYPE = 'application/pdf'
+ZIP_MIMETYPE = 'application/zip'
+
+
+class RenderQueueFull(RuntimeError):
+    pass
+
+
+@dataclass
+class GradeReport:
+    """Everything a report shows, as plain values so it can be sent to a render process.
+
+    tests are (competency, test_name, max_points) in layout order; each student is
+    (name, points per test, competency totals, grand total) with NaN for blanks.
+    """
+    title: str
+    competencies: list
+    tests: list
+    show_grand_total: bool
+    students: list
+    average_tests: list
+    average_competencies: list
+    average_grand: float
+
+
+def build_grade_report(title, tests, competency_weights, student_query):
+    layout = MatrixLayout.build(tests, competency_weights)
+    averages = ClassAverageAccumulator(layout)
+    students = []
+    for batch in iter_batches(iter_student_grades(student_query, [t.id for t in tests])):
+        points = np.array([points_row(grades, layout) for _sid, _first, _last, grades in batch], dtype=float)
+        totals = student_totals(points, layout)
+        averages.add(totals.percentages)
+        for i, (_student_id, first_name, last_name, _grades) in enumerate(batch):
+            students.append((
+                f"{first_name} {last_name}", points[i].tolist(),
+                totals.competencies[i].tolist(), float(totals.grand[i]),
+            ))
+    class_avg = averages.result()
+    return GradeReport(
+        title=title,
+        competencies=list(layout.competencies),
+        tests=[(t.competency or 'Unassigned', t.test_name, t.max_points) for t in layout.tests],
+        show_grand_total=layout.show_grand_total,
+        students=students,
+        average_tests=class_avg.tests.tolist(),
+        average_competencies=class_avg.competencies.tolist(),
+        average_grand=class_avg.grand,
+    )
+
+
+def semester_reports(teacher_id, semester, subject, variant):
+    """[(filename, GradeReport)] for every class with tests in the semester."""
+    class_query = db.session.query(Test.class_name).filter(
+        Test.teacher_id == teacher_id, Test.semester == semester
+    )
+    if subject:
+        class_query = class_query.filter(Test.subject == subject)
+    # Tests without a class name only get their own report when no test has one
+    class_names = sorted({name for (name,) in class_query.distinct() if name}) or ['']
+
+    prefix = 'grade_matrix' if variant == 'full' else 'grade_summary'
+    reports = []
+    for class_name in class_names:
+        export_data = grade_matrix_export_data(teacher_id, semester, class_name, subject)
+        if export_data is None:
+            continue
+        tests, student_query, competency_weights = export_data
+        reports.append((
+            grade_matrix_filename(class_name, semester, 'pdf', prefix=prefix),
+            build_grade_report(grade_matrix_title(class_name, semester), tests, competency_weights, student_query),
+        ))
+    return reports
+
+
+def render_report_pdf(report, variant):
+    """Lay the report out as a letter-size PDF and return its bytes (runs in a render process)."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import landscape, letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+
+    full = variant == 'full'
+    page_size = landscape(letter) if full else letter
+    margin = 0.5 * inch
+    output = BytesIO()
+    doc = SimpleDocTemplate(
+        output, pagesize=page_size, title=report.title,
+        leftMargin=margin, rightMargin=margin, topMargin=margin, bottomMargin=margin,
+    )
+
+    def pct(value):
+        return '--' if np.isnan(value) else f'{value:.1f}%'
+
+    def pts(value):
+        return '' if np.isnan(value) else f'{value:g}'
+
+    # Column plan, as in the XLSX export: each competency's tests then its total
+    columns = []
+    j = 0
+    for k, comp in enumerate(report.competencies):
+        if full:
+            while j < len(report.tests) and report.tests[j][0] == comp:
+                columns.append(('test', j))
+                j += 1
+        columns.append(('total', k))
+    if report.show_grand_total:
+        columns.append(('grand', None))
+
+    font_size = 7 if full and len(columns) > 12 else 9
+    header_style = ParagraphStyle(
+        'report_header', parent=getSampleStyleSheet()['Normal'],
+        fontName='Helvetica-Bold', fontSize=font_size, leading=font_size + 2, alignment=1,
+    )
+
+    def header(kind, index):
+        if kind == 'test':
+            _comp, name, max_points = report.tests[index]
+            return Paragraph(f'{_escape(name)}<br/>/{max_points:g}', header_style)
+        if kind == 'total':
+            return Paragraph(f'Total {_escape(report.competencies[index])}', header_style)
+        return Paragraph('Grand Total', header_style)
+
+    def cells(points, percentages, comp_totals, grand):
+        row = []
+        for kind, index in columns:
+            if kind == 'test':
+                row.append(pts(points[index]) if points is not None else pct(percentages[index]))
+            elif kind == 'total':
+                row.append(pct(comp_totals[index]))
+            else:
+                row.append(pct(grand))
+        return row
+
+    data = [[Paragraph('Student Name', header_style)] + [header(kind, index) for kind, index in columns]]
+    for name, points, comp_totals, grand in report.students:
+        data.append([name] + cells(points, None, comp_totals, grand))
+    data.append(['Class Average'] + cells(
+        None, report.average_tests, report.average_competencies, report.average_grand,
+    ))
+
+    available = page_size[0] - 2 * margin
+    name_width = min(1.8 * inch, available * 0.3)
+    column_width = (available - name_width) / max(len(columns), 1)
+    table = Table(data, colWidths=[name_width] + [column_width] * len(columns), repeatRows=1)
+
+    style = [
+        ('FONT', (0, 0), (-1, -1), 'Helvetica', font_size),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#CCCCCC')),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F2F2F2')),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
+        ('FONT', (0, 1), (0, -1), 'Helvetica-Bold', font_size),
+        ('FONT', (0, -1), (-1, -1), 'Helvetica-Bold', font_size),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#F8F9FA')),
+    ]
+    for col, (kind, _index) in enumerate(columns, start=1):
+        if kind in ('total', 'grand'):
+            fill = '#E9ECEF' if kind == 'total' else '#E7F3FF'
+            style.append(('BACKGROUND', (col, 1), (col, -1), colors.HexColor(fill)))
+            style.append(('FONT', (col, 1), (col, -1), 'Helvetica-Bold', font_size))
+    table.setStyle(TableStyle(style))
+
+    title_style = getSampleStyleSheet()['Title']
+    doc.build([Paragraph(_escape(report.title), title_style), table])
+    return output.getvalue()
+
+
+def _escape(text):
+    return str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def _render_pool():
+    """This process's (executor, pending-render semaphore), created on first use.
+
+    gunicorn forks workers after import, so each worker gets its own pool; render
+    processes are spawned rather than forked so they never inherit database
+    connections or request threads.
+    """
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            config = current_app.config
+            _pool = ProcessPoolExecutor(
+                max_workers=config['PDF_WORKERS'], mp_context=multiprocessing.get_context('spawn'),
+            )
+            _pool_slots = threading.BoundedSemaphore(config['PDF_WORKERS'] + config['PDF_MAX_PENDING'])
+            _pool_pid = os.getpid()
+        return _pool, _pool_slots
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_render(report, variant, block=False):
+    """Queue a render; returns a Future for the PDF bytes, or the bytes when PDF_WORKERS is 0."""
+    if current_app.config['PDF_WORKERS'] <= 0:
+        return render_report_pdf(report, variant)
+    pool, slots = _render_pool()
+    if not slots.acquire(blocking=block, timeout=current_app.config['PDF_RENDER_TIMEOUT'] if block else None):
+        raise RenderQueueFull('Too many PDF reports are being generated, try again shortly')
+    try:
+        future = pool.submit(render_report_pdf, report, variant)
+    except BrokenProcessPool:
+        # A render process died (e.g. killed for memory); start a new pool next time
+        slots.release()
+        _discard_pool(pool)
+        raise
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _future: slots.release())
+    return future
+
+
+def _result(pending):
+    if isinstance(pending, bytes):
+        return pending
+    return pending.result(timeout=current_app.config['PDF_RENDER_TIMEOUT'])
+
+
+def render_report(report, variant):
+    """Render one report in the pool and wait for it."""
+    started = time.perf_counter()
+    pdf = _result(submit_render(report, variant))
+    observe_export('pdf', len(pdf), time.perf_counter() - started)
+    return pdf
+
+
+class _ZipStream:
+    """Write-only file object that hands out what zipfile wrote since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_reports_zip(reports, variant):
+    """Yield a ZIP of (filename, GradeReport) rendered in parallel, in order.
+
+    Up to PDF_WORKERS renders are kept in flight, so later reports render while
+    earlier ones are being sent and the pending-render limit is shared fairly with
+    single-report requests.
+    """
+    started = time.perf_counter()
+    size = 0
+    window = max(current_app.config['PDF_WORKERS'], 1)
+    reports = iter(reports)
+    in_flight = deque()
+    stream = _ZipStream()
+    # Without seek/tell zipfile writes data descriptors, so the archive streams
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        while True:
+            while len(in_flight) < window:
+                item = next(reports, None)
+                if item is None:
+                    break
+                filename, report = item
+                in_flight.append((filename, submit_render(report, variant, block=True)))
+            if not in_flight:
+                break
+            filename, pending = in_flight.popleft()
+            archive.writestr(filename, _result(pending))
+            data = stream.drain()
+            size += len(data)
+            yield data
+    data = stream.drain()
+    size += len(data)
+    yield data
+    observe_export('zip', size, time.perf_counter() - started)
@@ -0,0 +1,90 @@
+"""Set-based deletes of teachers' data.
+
+Every purge deletes by subquery, one DELETE per table with children before
+parents, so no rows are loaded into Python however many grades are involved,
+and returns the deleted row counts per table. The foreign keys also cascade in
+the database (ON DELETE CASCADE, with passive_deletes on the relationships);
+the explicit DELETEs keep SQLite, which does not enforce foreign keys here, free
+of orphans and provide the counts. Callers commit.
+"""
+from sqlalchemy import delete, select, update
+
+from . import db
+from .models import Classroom, ClassroomLayout, Grade, Job, School, SetupWizardData, Student, Teacher, Test
+
+
+def _delete(counts, model, *criteria):
+    result = db.session.execute(
+        delete(model).where(*criteria).execution_options(synchronize_session=False)
+    )
+    table = model.__tablename__
+    counts[table] = counts.get(table, 0) + result.rowcount
+
+
+def _purge_classrooms(counts, classroom_ids):
+    students = select(Student.id).where(Student.classroom_id.in_(classroom_ids))
+    _delete(counts, Grade, Grade.student_id.in_(students))
+    _delete(counts, Student, Student.classroom_id.in_(classroom_ids))
+    _delete(counts, ClassroomLayout, ClassroomLayout.classroom_id.in_(classroom_ids))
+    # Tests are kept and lose their resolved classroom (ON DELETE SET NULL)
+    db.session.execute(
+        update(Test).where(Test.classroom_id.in_(classroom_ids)).values(classroom_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    _delete(counts, Classroom, Classroom.id.in_(classroom_ids))
+
+
+def purge_tests(test_ids):
+    """Delete tests (ids or a select of ids) and their grades."""
+    counts = {}
+    _delete(counts, Grade, Grade.test_id.in_(test_ids))
+    _delete(counts, Test, Test.id.in_(test_ids))
+    return counts
+
+
+def purge_students(student_ids):
+    """Delete students and their grades."""
+    counts = {}
+    _delete(counts, Grade, Grade.student_id.in_(student_ids))
+    _delete(counts, Student, Student.id.in_(student_ids))
+    return counts
+
+
+def purge_classrooms(classroom_ids):
+    """Delete classrooms with their students, grades and seating layouts."""
+    counts = {}
+    _purge_classrooms(counts, classroom_ids)
+    return counts
+
+
+def purge_school(school_id):
+    """Delete a school and everything in its classrooms."""
+    counts = {}
+    _purge_classrooms(counts, select(Classroom.id).where(Classroom.school_id == school_id))
+    _delete(counts, School, School.id == school_id)
+    return counts
+
+
+def purge_teacher_data(teacher_id):
+    """Delete the teacher's schools, classrooms, students, wizard data, tests and grades.
+
+    The teacher account and its job history are kept.
+    """
+    counts = {}
+    tests = select(Test.id).where(Test.teacher_id == teacher_id)
+    _delete(counts, Grade, Grade.test_id.in_(tests))
+    _delete(counts, Test, Test.teacher_id == teacher_id)
+    schools = select(School.id).where(School.teacher_id == teacher_id)
+    _purge_classrooms(counts, select(Classroom.id).where(Classroom.school_id.in_(schools)))
+    _delete(counts, ClassroomLayout, ClassroomLayout.teacher_id == teacher_id)
+    _delete(counts, School, School.teacher_id == teacher_id)
+    _delete(counts, SetupWizardData, SetupWizardData.teacher_id == teacher_id)
+    return counts
+
+
+def purge_teacher(teacher_id):
+    """Delete a teacher account with all of its data and jobs."""
+    counts = purge_teacher_data(teacher_id)
+    _delete(counts, Job, Job.teacher_id == teacher_id)
+    _delete(counts, Teacher, Teacher.id == teacher_id)
+    return counts
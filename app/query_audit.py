@@ -0,0 +1,156 @@
+"""Query-plan audit for the queries behind the main pages.
+
+Runs the same code the routes use for one teacher, records the SQL it sends, and
+asks the database to EXPLAIN each statement with the same parameters. Each check
+lists the indexes it is meant to use, so a missing migration or a query change that
+falls back to a full table scan shows up in `flask explain-queries`.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from sqlalchemy import event, func
+
+from . import db
+from .dashboard import load_makeup_tests
+from .grade_matrix import load_points
+from .grading_status import grade_counts
+from .models import Teacher, Student, Test
+from .teacher_context import TeacherContext
+from .wizard_config import get_wizard_config, invalidate_wizard_config
+
+
+@dataclass
+class PlanReport:
+    name: str
+    # Each entry is an index name, or a tuple of names any of which will do
+    expected: list
+    statements: list = field(default_factory=list)
+    plan: list = field(default_factory=list)
+
+    @property
+    def missing(self):
+        text = '\n'.join(self.plan)
+        missing = []
+        for wanted in self.expected:
+            alternatives = wanted if isinstance(wanted, tuple) else (wanted,)
+            if not any(name in text for name in alternatives):
+                missing.append(' or '.join(alternatives))
+        return missing
+
+    @property
+    def full_scans(self):
+        return [line for line in self.plan if _is_full_scan(line)]
+
+    @property
+    def ok(self):
+        return not self.missing
+
+
+def _is_full_scan(line):
+    # SQLite: "SCAN student" (an index scan reads "SCAN student USING INDEX ...")
+    # PostgreSQL: "Seq Scan on student"
+    stripped = line.strip()
+    if stripped.startswith('SCAN ') and ' USING ' not in stripped:
+        return True
+    return 'Seq Scan on' in stripped
+
+
+@contextmanager
+def _recorded_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def explain(statement, parameters=None):
+    """Return the database's plan for a raw SQL statement, one line per row."""
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters or ())
+        return [str(row[-1]) for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters or ())
+    return [' '.join(str(value) for value in row if value is not None) for row in rows]
+
+
+def busiest_teacher_id():
+    """The teacher with the most tests, whose data gives the most realistic plans."""
+    row = (
+        db.session.query(Teacher.id)
+        .outerjoin(Test, Test.teacher_id == Teacher.id)
+        .group_by(Teacher.id)
+        .order_by(func.count(Test.id).desc(), Teacher.id)
+        .first()
+    )
+    return row[0] if row else None
+
+
+def audit_queries(teacher_id):
+    """Run the key page queries for `teacher_id` and return a PlanReport per query."""
+    context = TeacherContext(teacher_id)
+    sample_test = Test.query.filter_by(teacher_id=teacher_id).order_by(Test.id).first()
+    semester = sample_test.semester if sample_test else 'Semester 1'
+    class_name = sample_test.class_name if sample_test else None
+
+    def teacher_tests():
+        # input_grades / create_tests
+        return Test.query.filter_by(teacher_id=teacher_id).order_by(Test.test_date.desc()).all()
+
+    def grade_matrix_tests():
+        # get_grade_matrix / grade matrix exports with a semester and class filter
+        return Test.query.filter_by(teacher_id=teacher_id, semester=semester, class_name=class_name).order_by(
+            Test.test_date
+        ).all()
+
+    def wizard_config():
+        invalidate_wizard_config(teacher_id)
+        return get_wizard_config(teacher_id)
+
+    def classroom_roster():
+        # get_classroom_students
+        classroom_id = context.classrooms[0].id if context.classrooms else 0
+        return Student.query.filter_by(classroom_id=classroom_id).order_by(
+            Student.last_name.asc(), Student.first_name.asc()
+        ).all()
+
+    # Ids for load_points, looked up before recording starts
+    classroom_ids = [c.id for c in context.classrooms]
+    student_ids = [sid for sid, in db.session.query(Student.id).filter(
+        Student.classroom_id.in_(classroom_ids)
+    ).limit(50)] or [0]
+    test_ids = [t.id for t in grade_matrix_tests()] or [0]
+
+    checks = [
+        ('teacher schools and classrooms', lambda: TeacherContext(teacher_id)._rows,
+         ['ix_school_teacher_id', 'ix_classroom_school_id', 'ix_student_classroom_id']),
+        ('setup wizard config', wizard_config, ['ix_setup_wizard_data_teacher_id']),
+        ('tests by date', teacher_tests, ['ix_test_teacher_test_date']),
+        ('tests by semester and class', grade_matrix_tests, ['ix_test_teacher_semester_class']),
+        ('grading completion counts', lambda: grade_counts(teacher_id),
+         [('ix_test_teacher_semester_class', 'ix_test_teacher_test_date')]),
+        ('make-up tests', lambda: load_makeup_tests(teacher_id), ['ix_grade_absent_test_id']),
+        ('classroom roster', classroom_roster, ['ix_student_classroom_id']),
+        ('grade matrix points', lambda: load_points(student_ids, test_ids),
+         [('unique_test_student', 'sqlite_autoindex_grade', 'ix_grade_student_id')]),
+    ]
+
+    reports = []
+    for name, run, expected in checks:
+        report = PlanReport(name=name, expected=expected)
+        with _recorded_statements() as statements:
+            run()
+        report.statements = [statement for statement, _params in statements]
+        for statement, parameters in statements:
+            report.plan.extend(explain(statement, parameters))
+        reports.append(report)
+
+    db.session.rollback()
+    return reports
@@ -0,0 +1,114 @@
+"""Per-request SQL instrumentation.
+
+SQLAlchemy cursor events count the statements each request runs and the time spent
+in them. Every response gets a Server-Timing header (`db` and `app` durations,
+visible in the browser's network panel) and a JSON log line.
+
+Views can declare how many statements they are expected to need with
+@query_budget(n), next to @login_required. Going over budget logs a warning, or
+raises QueryBudgetExceeded when QUERY_BUDGET_RAISE is set (the default under
+TESTING), so an N+1 regression fails the tests that exercise the view.
+"""
+import json
+import time
+from dataclasses import dataclass
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import observe_request
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+@dataclass
+class RequestStats:
+    started: float
+    queries: int = 0
+    db_seconds: float = 0.0
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+
+def query_budget(max_queries):
+    """Declare the most SQL statements a view should run per request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def current_request_stats():
+    """Stats for the request being handled, or None outside a request."""
+    return g.get('request_stats') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request_stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats()
+    started = conn.info.get('query_started')
+    if stats is None or not started:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started.pop()
+
+
+def _start_request():
+    g.request_stats = RequestStats(started=time.perf_counter())
+
+
+def _finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    total_seconds = stats.total_seconds
+    total_ms = total_seconds * 1000.0
+    db_ms = stats.db_seconds * 1000.0
+    observe_request(request.endpoint, request.method, response.status_code, total_seconds)
+
+    if current_app.config.get('SERVER_TIMING', True):
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.1f};desc="{stats.queries} queries", app;dur={total_ms:.1f}',
+        )
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    current_app.logger.info('request_metrics %s', json.dumps({
+        'method': request.method,
+        'endpoint': request.endpoint,
+        'path': request.path,
+        'status': response.status_code,
+        'queries': stats.queries,
+        'query_budget': budget,
+        'db_ms': round(db_ms, 1),
+        'total_ms': round(total_ms, 1),
+    }))
+
+    if budget is not None and stats.queries > budget:
+        message = f'{request.endpoint} ran {stats.queries} SQL statements, over its budget of {budget}'
+        should_raise = current_app.config.get('QUERY_BUDGET_RAISE')
+        if should_raise is None:
+            should_raise = current_app.testing
+        if should_raise:
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def init_request_metrics(app):
+    # Engine-class listeners cover the engine Flask-SQLAlchemy creates lazily
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,286 @@
+"""Bulk student roster import.
+
+Uploads are read row by row (the csv module over the upload stream, openpyxl in
+read-only mode for XLSX) and imported in batches of IMPORT_BATCH_SIZE rows. The
+teacher's classrooms are loaded once and matched by name in memory. Each batch
+loads the names already on the rosters of classrooms it is the first to mention,
+in one query, and inserts its new students with one executemany INSERT. Names
+are compared after normalize_name, so "anne  MARIE" is a duplicate of
+"Anne Marie". Rows that cannot be imported are reported with their row number;
+the rest are imported.
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+from itertools import chain, islice
+
+from sqlalchemy import insert
+
+from . import db
+from .classroom_names import split_classroom_name
+from .models import Classroom, School, Student
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 200
+NAME_MAX_LENGTH = Student.__table__.c.first_name.type.length
+
+CSV_EXTENSIONS = ('.csv', '.txt')
+XLSX_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Normalized header text -> field; French headers are accepted too
+HEADER_ALIASES = {
+    'first_name': ('first name', 'firstname', 'first', 'given name', 'prénom', 'prenom'),
+    'last_name': ('last name', 'lastname', 'last', 'surname', 'family name', 'nom', 'nom de famille'),
+    'classroom': ('classroom', 'class', 'class name', 'classname', 'homeroom', 'room', 'classe', 'groupe'),
+    'school': ('school', 'school name', 'école', 'ecole'),
+}
+
+
+class RosterImportError(ValueError):
+    """The file as a whole cannot be imported (unknown format, missing columns)."""
+
+
+def clean_name(value):
+    return ' '.join(str(value).split()) if value is not None else ''
+
+
+def normalize_name(value):
+    return clean_name(value).casefold()
+
+
+def _header_key(value):
+    return ' '.join(str(value or '').replace('_', ' ').replace('-', ' ').split()).casefold()
+
+
+@dataclass
+class StudentRecord:
+    row: int
+    first_name: str
+    last_name: str
+    classroom: str = ''
+    school: str = ''
+
+
+@dataclass
+class RosterImportResult:
+    rows: int = 0
+    inserted: int = 0
+    existing: int = 0
+    duplicates: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    classrooms: dict = field(default_factory=dict)
+
+    def add_error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def as_json(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'existing': self.existing,
+            'duplicates': self.duplicates,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'classrooms': sorted(self.classrooms.values(), key=lambda c: (c['school_name'], c['name'])),
+        }
+
+
+def iter_csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        # Decoding starts with the header line's chunk, so it is inside the try too
+        first_line = text.readline()
+        # Spreadsheet programs in French locales separate CSV fields with semicolons
+        delimiter = max(',;\t', key=first_line.count)
+        yield from csv.reader(chain([first_line], text), delimiter=delimiter)
+    except UnicodeDecodeError:
+        raise RosterImportError('The CSV file is not UTF-8 encoded; save it as "CSV UTF-8" and try again')
+    finally:
+        text.detach()
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Class names like 101 are stored as numbers
+        return str(int(value))
+    return str(value)
+
+
+def iter_xlsx_rows(stream):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    from zipfile import BadZipFile
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError):
+        raise RosterImportError('The file is not a valid Excel workbook')
+    try:
+        for values in workbook.active.iter_rows(values_only=True):
+            yield [_cell_text(value) for value in values]
+    finally:
+        workbook.close()
+
+
+def iter_file_rows(filename, stream):
+    extension = '.' + filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in CSV_EXTENSIONS:
+        return iter_csv_rows(stream)
+    if extension in XLSX_EXTENSIONS:
+        return iter_xlsx_rows(stream)
+    raise RosterImportError('Upload a .csv or .xlsx file')
+
+
+def iter_student_records(rows, require_classroom):
+    """StudentRecords from spreadsheet rows whose first non-empty row is the header."""
+    rows = iter(enumerate(rows, start=1))
+    for _number, header in rows:
+        if any(cell.strip() for cell in header):
+            break
+    else:
+        raise RosterImportError('The file is empty')
+
+    columns = {}
+    for index, cell in enumerate(header):
+        key = _header_key(cell)
+        for name, aliases in HEADER_ALIASES.items():
+            if key in aliases:
+                columns.setdefault(name, index)
+    required = ['first_name', 'last_name'] + (['classroom'] if require_classroom else [])
+    missing = [name for name in required if name not in columns]
+    if missing:
+        expected = ', '.join(HEADER_ALIASES[name][0].title() for name in missing)
+        raise RosterImportError(f'Missing column(s): {expected}')
+
+    def cell(values, name):
+        index = columns.get(name)
+        return values[index] if index is not None and index < len(values) else ''
+
+    for number, values in rows:
+        if not any(value.strip() for value in values):
+            continue
+        yield StudentRecord(
+            row=number,
+            first_name=clean_name(cell(values, 'first_name')),
+            last_name=clean_name(cell(values, 'last_name')),
+            classroom=clean_name(cell(values, 'classroom')),
+            school=clean_name(cell(values, 'school')),
+        )
+
+
+class _ClassroomNames:
+    """The teacher's classrooms by normalized full name ("101 (Grade 1)") and class name ("101")."""
+
+    def __init__(self, teacher_id):
+        classrooms = (
+            db.session.query(Classroom.id, Classroom.name, School.name.label('school_name'))
+            .join(School, Classroom.school_id == School.id)
+            .filter(School.teacher_id == teacher_id)
+            .all()
+        )
+        self.by_id = {c.id: c for c in classrooms}
+        self._by_name = {}
+        for classroom in classrooms:
+            for name in {classroom.name, split_classroom_name(classroom.name)[0]}:
+                self._by_name.setdefault(normalize_name(name), []).append(classroom)
+
+    def resolve(self, name, school):
+        """(classroom, None) or (None, error message)."""
+        candidates = self._by_name.get(normalize_name(name), [])
+        if school:
+            candidates = [c for c in candidates if normalize_name(c.school_name) == normalize_name(school)]
+        if len(candidates) == 1:
+            return candidates[0], None
+        if not candidates:
+            where = f' at {school}' if school else ''
+            return None, f'Unknown classroom "{name}"{where}'
+        return None, f'Classroom "{name}" exists in several schools; add a School column'
+
+
+def import_students(teacher_id, records, classroom_id=None):
+    """Insert the records' students that are not on their classroom's roster yet; the caller commits.
+
+    Records without a classroom go to classroom_id, which must be one of the
+    teacher's classrooms.
+    """
+    classrooms = _ClassroomNames(teacher_id)
+    default = classrooms.by_id.get(classroom_id) if classroom_id is not None else None
+    if classroom_id is not None and default is None:
+        raise RosterImportError('Classroom not found')
+
+    result = RosterImportResult()
+    rosters = {}
+    added = set()
+    records = iter(records)
+    while True:
+        batch = list(islice(records, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        result.rows += len(batch)
+
+        placed = []
+        for record in batch:
+            error = None
+            if not record.first_name or not record.last_name:
+                error = 'First and last name are required'
+            elif max(len(record.first_name), len(record.last_name)) > NAME_MAX_LENGTH:
+                error = f'Names can be at most {NAME_MAX_LENGTH} characters'
+            if record.classroom:
+                classroom, classroom_error = classrooms.resolve(record.classroom, record.school)
+            elif default is not None:
+                classroom, classroom_error = default, None
+            else:
+                classroom, classroom_error = None, 'Classroom is required'
+            error = error or classroom_error
+            if error:
+                result.add_error(record.row, error)
+            else:
+                placed.append((record, classroom))
+
+        new_ids = {classroom.id for _record, classroom in placed} - rosters.keys()
+        if new_ids:
+            for new_id in new_ids:
+                rosters[new_id] = set()
+            existing = db.session.query(Student.classroom_id, Student.first_name, Student.last_name).filter(
+                Student.classroom_id.in_(new_ids)
+            )
+            for student in existing:
+                rosters[student.classroom_id].add(
+                    (normalize_name(student.first_name), normalize_name(student.last_name))
+                )
+
+        new_students = []
+        for record, classroom in placed:
+            key = (normalize_name(record.first_name), normalize_name(record.last_name))
+            if key in rosters[classroom.id]:
+                if (classroom.id, key) in added:
+                    result.duplicates += 1
+                else:
+                    result.existing += 1
+                continue
+            rosters[classroom.id].add(key)
+            added.add((classroom.id, key))
+            new_students.append({
+                'first_name': record.first_name, 'last_name': record.last_name, 'classroom_id': classroom.id,
+            })
+            summary = result.classrooms.setdefault(classroom.id, {
+                'id': classroom.id, 'name': classroom.name, 'school_name': classroom.school_name, 'inserted': 0,
+            })
+            summary['inserted'] += 1
+
+        if new_students:
+            db.session.execute(insert(Student), new_students)
+            result.inserted += len(new_students)
+    return result
+
+
+def import_roster_file(teacher_id, filename, stream, classroom_id=None):
+    """Import a CSV or XLSX roster upload; the caller commits."""
+    rows = iter_file_rows(filename or '', stream)
+    records = iter_student_records(rows, require_classroom=classroom_id is None)
+    return import_students(teacher_id, records, classroom_id)
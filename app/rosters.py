@@ -0,0 +1,70 @@
+from sqlalchemy import or_
+
+from . import db
+from .models import School, Classroom, Student
+
+
+def students_for_tests_query(teacher_id, tests, class_name=''):
+    """Query for the students whose grades belong in a matrix of `tests`.
+
+    With a class filter, students come from the classrooms the tests were resolved to
+    (Test.classroom_id). Tests created before that column existed fall back to matching
+    the class part of "ClassName (Grade X)". Without a filter, every student the teacher
+    has is returned.
+    """
+    query = Student.query.join(Classroom).join(School).filter(School.teacher_id == teacher_id)
+    if class_name:
+        classroom_ids = {t.classroom_id for t in tests if t.classroom_id}
+        conditions = [Classroom.id.in_(classroom_ids)] if classroom_ids else []
+        if not classroom_ids or any(t.classroom_id is None for t in tests):
+            conditions.append(Classroom.name == class_name)
+            conditions.append(Classroom.name.startswith(f'{class_name} (', autoescape=True))
+        query = query.filter(or_(*conditions))
+    return query
+
+
+def students_for_tests(teacher_id, tests, class_name=''):
+    return students_for_tests_query(teacher_id, tests, class_name).order_by(
+        School.id, Classroom.id, Student.id
+    ).all()
+
+
+def classroom_rosters(context, classroom_ids=None):
+    """Every classroom in the teacher's context with its sorted student list.
+
+    Classroom metadata and student counts come from the context's joined query;
+    students for all the requested classrooms are fetched in one more query.
+    `classroom_ids` limits the result to those classrooms (ids the teacher does
+    not own are ignored).
+    """
+    classrooms = context.classrooms
+    if classroom_ids is not None:
+        wanted = set(classroom_ids)
+        classrooms = [c for c in classrooms if c.id in wanted]
+
+    students_by_classroom = {c.id: [] for c in classrooms}
+    if students_by_classroom:
+        rows = (
+            db.session.query(Student.id, Student.first_name, Student.last_name, Student.classroom_id)
+            .filter(Student.classroom_id.in_(students_by_classroom))
+            .order_by(Student.classroom_id, Student.last_name.asc(), Student.first_name.asc())
+            .all()
+        )
+        for student_id, first_name, last_name, classroom_id in rows:
+            students_by_classroom[classroom_id].append({
+                'id': student_id,
+                'firstName': first_name,
+                'lastName': last_name,
+                'fullName': f"{first_name} {last_name}"
+            })
+
+    return [
+        {
+            'id': classroom.id,
+            'name': classroom.name,
+            'school_name': classroom.school.name,
+            'student_count': context.student_counts.get(classroom.id, 0),
+            'students': students_by_classroom[classroom.id],
+        }
+        for classroom in classrooms
+    ]
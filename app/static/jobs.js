@@ -0,0 +1,51 @@
+(function () {
+  'use strict';
+
+  const POLL_INTERVAL_MS = 1500;
+
+  function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  async function readJob(response) {
+    const data = await response.json().catch(function () { return {}; });
+    if (!response.ok || !data.success) {
+      throw new Error(data.error || ('HTTP ' + response.status));
+    }
+    return data.job;
+  }
+
+  function jobRequest(kind, params, file) {
+    if (!file) {
+      return {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ kind: kind, params: params || {} })
+      };
+    }
+    const formData = new FormData();
+    formData.append('kind', kind);
+    formData.append('params', JSON.stringify(params || {}));
+    formData.append('file', file);
+    return { method: 'POST', body: formData };
+  }
+
+  // Submit a background job and poll it until it finishes. Resolves with the
+  // finished job (download_url is set when it produced a file), rejects with
+  // the job's error when it failed. onProgress(job) is called on every poll.
+  // file is uploaded with the job for handlers that read one (roster_import).
+  async function runBackgroundJob(kind, params, onProgress, file) {
+    let job = await readJob(await fetch('/api/jobs', jobRequest(kind, params, file)));
+    while (job.status === 'queued' || job.status === 'running') {
+      if (onProgress) onProgress(job);
+      await sleep(POLL_INTERVAL_MS);
+      job = await readJob(await fetch('/api/jobs/' + job.id, { cache: 'no-store' }));
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Job failed');
+    }
+    return job;
+  }
+
+  window.runBackgroundJob = runBackgroundJob;
+})();
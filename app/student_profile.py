@@ -0,0 +1,156 @@
+"""Student profile data for the Student tab.
+
+One query checks the student belongs to the teacher and fetches their classroom;
+a second, projected query fetches every grade with only the test columns the
+profile shows. Percentages, low-grade counts, competency averages and the trend
+are computed with NumPy over those rows, so a full year of grades costs two
+queries and no lazy loads.
+"""
+from dataclasses import dataclass
+from urllib.parse import quote
+
+import numpy as np
+
+from . import db
+from .grade_matrix import MatrixLayout, student_totals
+from .models import School, Classroom, Student, Test, Grade
+
+# Completed tests below this percentage count as low grades
+LOW_GRADE_THRESHOLD = 80
+
+AVATAR_URL = 'https://api.dicebear.com/7.x/avataaars/svg?seed={seed}'
+
+# Shown until teacher notes are stored
+PLACEHOLDER_NOTES = (
+    "{first_name} shows excellent participation in class discussions.",
+    "Strong analytical skills demonstrated in recent assignments.",
+    "Would benefit from additional practice with problem-solving techniques.",
+)
+
+
+def _optional(value, digits=1):
+    value = float(value)
+    # + 0.0 turns a rounded -0.0 into 0.0
+    return None if np.isnan(value) else round(value, digits) + 0.0
+
+
+@dataclass
+class StudentProfile:
+    student: object
+    rows: list
+    percentages: np.ndarray
+
+    def grades(self):
+        grades = []
+        for row, percentage in zip(self.rows, self.percentages):
+            if row.absent:
+                status = 'Absent'
+            elif row.grade is not None:
+                status = 'Completed'
+            else:
+                status = 'Not Graded'
+            grades.append({
+                'test_name': row.test_name,
+                'subject': row.subject,
+                'competency': row.competency,
+                'test_date': row.test_date.strftime('%Y-%m-%d'),
+                'semester': row.semester,
+                'grade': row.grade,
+                'max_points': row.max_points,
+                'percentage': _optional(percentage),
+                'status': status,
+                'absent': row.absent,
+            })
+        return grades
+
+    def stats(self):
+        graded = ~np.isnan(self.percentages)
+        low = graded & (np.round(np.where(graded, self.percentages, 0.0), 1) < LOW_GRADE_THRESHOLD)
+        competencies = np.array([row.competency or 'Unassigned' for row in self.rows], dtype=object)
+        low_grades_count = int(low.sum())
+        return {
+            'total_tests': len(self.rows),
+            'completed_tests': int(graded.sum()),
+            'low_grades_count': low_grades_count,
+            'has_low_grades': low_grades_count > 0,
+            'low_grades_by_competency': {
+                comp: int(low[competencies == comp].sum()) for comp in sorted(set(competencies))
+            },
+            'average': _optional(self.percentages[graded].mean()) if graded.any() else None,
+            'competency_averages': self.competency_averages(),
+            'trend': self.trend(),
+        }
+
+    def competency_averages(self):
+        """Test-weighted average per competency, the same formula as the grade matrix totals."""
+        if not self.rows:
+            return {}
+        layout = MatrixLayout.build(self.rows, {})
+        points = [np.nan if row.absent or row.grade is None else row.grade for row in layout.tests]
+        totals = student_totals(points, layout)
+        return {comp: _optional(totals.competencies[0, k]) for k, comp in enumerate(layout.competencies)}
+
+    def trend(self):
+        """Graded results in date order with a running average, and the slope in points per 30 days."""
+        graded = ~np.isnan(self.percentages)
+        values = self.percentages[graded]
+        dates = [row.test_date for row, g in zip(self.rows, graded) if g]
+        running = np.cumsum(values) / np.arange(1, len(values) + 1)
+        slope = None
+        if len(values) >= 2:
+            days = np.array([(d - dates[0]).days for d in dates], dtype=float)
+            if np.ptp(days) > 0:
+                slope = _optional(np.polyfit(days, values, 1)[0] * 30)
+        return {
+            'points': [
+                {'test_date': d.strftime('%Y-%m-%d'), 'percentage': _optional(v), 'running_average': _optional(r)}
+                for d, v, r in zip(dates, values, running)
+            ],
+            'slope_per_30_days': slope,
+        }
+
+    def as_json(self):
+        student = self.student
+        return {
+            'success': True,
+            'student': {
+                'id': student.id,
+                'first_name': student.first_name,
+                'last_name': student.last_name,
+                'full_name': f"{student.first_name} {student.last_name}",
+                'classroom': student.classroom_name,
+                'avatar_url': AVATAR_URL.format(seed=quote(student.first_name + student.last_name)),
+            },
+            'grades': self.grades(),
+            'stats': self.stats(),
+            'teacher_notes': [note.format(first_name=student.first_name) for note in PLACEHOLDER_NOTES],
+        }
+
+
+def load_student_profile(teacher_id, student_id):
+    """Return the StudentProfile for one of the teacher's students, or None."""
+    student = (
+        db.session.query(Student.id, Student.first_name, Student.last_name, Classroom.name.label('classroom_name'))
+        .join(Classroom, Student.classroom_id == Classroom.id)
+        .join(School, Classroom.school_id == School.id)
+        .filter(Student.id == student_id, School.teacher_id == teacher_id)
+        .first()
+    )
+    if student is None:
+        return None
+
+    rows = (
+        db.session.query(
+            Test.test_name, Test.subject, Test.competency, Test.test_date, Test.semester,
+            Test.max_points, Test.test_weight, Grade.grade, Grade.absent,
+        )
+        .join(Test, Grade.test_id == Test.id)
+        .filter(Grade.student_id == student_id, Test.teacher_id == teacher_id)
+        .order_by(Test.test_date.asc(), Test.id.asc())
+        .all()
+    )
+    points = np.array([np.nan if r.absent or r.grade is None else r.grade for r in rows], dtype=float)
+    max_points = np.array([r.max_points for r in rows], dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = points / max_points * 100.0
+    return StudentProfile(student=student, rows=rows, percentages=percentages)
@@ -0,0 +1,172 @@
+"""Request-scoped teacher context.
+
+Pages need the same things about the logged-in teacher: schools, classrooms, the
+Setup Wizard configuration, the teacher type and classrooms grouped by grade.
+TeacherContext loads schools and classrooms (with student counts) in one joined
+query, takes the wizard config from wizard_config's cache, and is built once per
+request on flask.g; everything derived from it is computed on first use.
+"""
+from functools import cached_property
+
+from flask import g
+from flask_login import current_user
+from sqlalchemy import func
+
+from . import db
+from .classroom_names import ClassroomResolver, split_classroom_name
+from .models import School, Classroom, Student
+from .wizard_config import get_wizard_config
+
+
+class TeacherContext:
+    def __init__(self, teacher_id):
+        self.teacher_id = teacher_id
+
+    @cached_property
+    def _rows(self):
+        # Schools without classrooms are kept (outer join) so setup state is visible
+        return (
+            db.session.query(School, Classroom, func.count(Student.id))
+            .outerjoin(Classroom, Classroom.school_id == School.id)
+            .outerjoin(Student, Student.classroom_id == Classroom.id)
+            .filter(School.teacher_id == self.teacher_id)
+            .group_by(School.id, Classroom.id)
+            .order_by(School.id, Classroom.id)
+            .all()
+        )
+
+    @cached_property
+    def schools(self):
+        schools = []
+        for school, _classroom, _count in self._rows:
+            if not schools or schools[-1].id != school.id:
+                schools.append(school)
+        return schools
+
+    @cached_property
+    def classrooms(self):
+        """All of the teacher's classrooms, ordered by school then creation."""
+        return [classroom for _school, classroom, _count in self._rows if classroom is not None]
+
+    @cached_property
+    def student_counts(self):
+        """Map classroom_id -> number of students."""
+        return {classroom.id: count for _school, classroom, count in self._rows if classroom is not None}
+
+    @cached_property
+    def classrooms_by_school(self):
+        by_school = {}
+        for school, classroom, _count in self._rows:
+            classrooms = by_school.setdefault(school.name, [])
+            if classroom is not None:
+                classrooms.append(classroom)
+        return by_school
+
+    @cached_property
+    def wizard(self):
+        """Parsed Setup Wizard configuration, or None if the wizard was never completed."""
+        return get_wizard_config(self.teacher_id)
+
+    @cached_property
+    def teacher_type(self):
+        if self.wizard and self.wizard.teacher_type:
+            return self.wizard.teacher_type
+        # No Setup Wizard data: if more than 1 classroom, assume Specialist
+        return 'specialist' if len(self.classrooms) > 1 else 'homeroom'
+
+    @property
+    def is_specialist(self):
+        return self.teacher_type == 'specialist'
+
+    @cached_property
+    def resolver(self):
+        return ClassroomResolver(self.classrooms)
+
+    def classroom(self, classroom_id):
+        return next((c for c in self.classrooms if c.id == classroom_id), None)
+
+    @cached_property
+    def classrooms_by_grade(self):
+        """{grade: [{'id', 'name', 'full_name'}]} parsed from "ClassName (Grade X)" names."""
+        by_grade = {}
+        for classroom in self.classrooms:
+            class_name, grade = split_classroom_name(classroom.name)
+            by_grade.setdefault(grade, []).append({
+                'id': classroom.id,
+                'name': class_name,
+                'full_name': classroom.name
+            })
+        return by_grade
+
+    @cached_property
+    def class_names_by_grade(self):
+        """{grade: sorted class names}, grades as they appear in classroom names."""
+        return {
+            grade: sorted(entry['name'] for entry in entries)
+            for grade, entries in self.classrooms_by_grade.items()
+        }
+
+    @cached_property
+    def wizard_class_names_by_grade(self):
+        """{grade: sorted class names} using the grade labels the teacher typed in the wizard.
+
+        Falls back to parsing classroom names for data created before the wizard
+        stored its classrooms.
+        """
+        by_grade = {}
+        for classroom in (self.wizard.classrooms if self.wizard else ()):
+            classroom_name = str(classroom.get('name') or '').strip()
+            grade = str(classroom.get('grade') or '').strip()
+            if classroom_name and grade:
+                by_grade.setdefault(grade, []).append(classroom_name)
+        if not by_grade:
+            return self.class_names_by_grade
+        return {grade: sorted(names) for grade, names in by_grade.items()}
+
+    @property
+    def competencies(self):
+        return list(self.wizard.competencies) if self.wizard else []
+
+    @property
+    def semesters(self):
+        return self.wizard.semesters if self.wizard else []
+
+    @property
+    def subjects(self):
+        """Specialists teach the wizard's single subject; homeroom teachers its subject list."""
+        if not self.wizard:
+            return []
+        if self.is_specialist:
+            return [self.wizard.subject_name] if self.wizard.subject_name else []
+        return list(self.wizard.subjects)
+
+    def filter_options(self, wizard_grade_labels=False):
+        """Template variables shared by the pages with global filters."""
+        if self.is_specialist:
+            classrooms_by_grade = self.wizard_class_names_by_grade if wizard_grade_labels else self.class_names_by_grade
+            grades = sorted(classrooms_by_grade.keys())
+        else:
+            classrooms_by_grade = {}
+            grades = []
+        return {
+            'competencies': self.competencies,
+            'semesters': self.semesters,
+            'subjects': self.subjects,
+            'grades': grades,
+            'classrooms_by_grade': classrooms_by_grade,
+            'teacher_type': self.teacher_type,
+        }
+
+
+def get_teacher_context():
+    """The current user's TeacherContext, created on first use in this request."""
+    context = g.get('teacher_context')
+    if context is None or context.teacher_id != current_user.id:
+        context = TeacherContext(current_user.id)
+        g.teacher_context = context
+    return context
+
+
+def drop_teacher_context(exc=None):
+    """Teardown hook: g can outlive a request when an app context is already pushed."""
+    g.pop('teacher_context', None)
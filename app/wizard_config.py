@@ -0,0 +1,180 @@
+"""Parsed Setup Wizard configuration.
+
+SetupWizardData stores its lists and the competency weights as JSON text. This
+module parses a teacher's row once into a WizardConfig and keeps it in a
+per-process cache keyed by teacher, revalidated against the row's id and version
+counter (so other worker processes pick up changes, however close together they
+are) and dropped explicitly when the wizard is submitted.
+
+Weights are stored by the wizard as {semester: {row_index: {competency_index: weight}}},
+where rows are the wizard's grades (specialist) or subjects (homeroom).
+"""
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+
+from . import db
+from .classroom_names import normalize_grade_label
+from .models import SetupWizardData
+
+_SEMESTER_NUMBER_PATTERN = re.compile(r'(\d+)\s*$')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _load_json(value, default):
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def semester_number(semester):
+    """'Semester 2' -> 2 (also accepts 2 or '2'); None if it has no number."""
+    if semester is None:
+        return None
+    match = _SEMESTER_NUMBER_PATTERN.search(str(semester).strip())
+    return int(match.group(1)) if match else None
+
+
+def _to_weight(value):
+    # Step 4 inputs are saved as typed, so weights may be strings or blank
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass(frozen=True)
+class WizardConfig:
+    teacher_id: int
+    teacher_type: str
+    school_name: str
+    num_semesters: int
+    competencies: tuple = ()
+    subjects: tuple = ()
+    grades: tuple = ()
+    classrooms: tuple = ()
+    grade_name: str = None
+    subject_name: str = None
+    competencies_skipped: bool = False
+    # (row id, row version) the config was parsed from
+    revision: tuple = None
+    # (row key, semester number) -> {competency: weight}
+    weights: dict = field(default_factory=dict)
+    # First (row, semester) entry in the stored weights, used when the context is unknown
+    default_weights: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_model(cls, wizard_data):
+        competencies = tuple(_load_json(wizard_data.competencies, []))
+        subjects = tuple(_load_json(wizard_data.subjects, []))
+        grades = tuple(_load_json(wizard_data.grades, []))
+        rows = subjects if wizard_data.teacher_type == 'homeroom' else grades
+        row_keys = [cls._row_key_for(wizard_data.teacher_type, row) for row in rows]
+
+        weights = {}
+        default_weights = None
+        raw_weights = _load_json(wizard_data.weights, {})
+        if isinstance(raw_weights, dict):
+            for semester_key, semester_rows in raw_weights.items():
+                number = semester_number(semester_key)
+                if number is None or not isinstance(semester_rows, dict):
+                    continue
+                for row_index, comp_weights in semester_rows.items():
+                    if not isinstance(comp_weights, dict):
+                        continue
+                    by_competency = {}
+                    for comp_index, weight in comp_weights.items():
+                        try:
+                            idx = int(comp_index)
+                        except (TypeError, ValueError):
+                            continue
+                        if 0 <= idx < len(competencies):
+                            by_competency[competencies[idx]] = _to_weight(weight)
+                    if default_weights is None:
+                        default_weights = by_competency
+                    try:
+                        row_key = row_keys[int(row_index)]
+                    except (TypeError, ValueError, IndexError):
+                        continue
+                    weights[(row_key, number)] = by_competency
+
+        return cls(
+            teacher_id=wizard_data.teacher_id,
+            teacher_type=wizard_data.teacher_type,
+            school_name=wizard_data.school_name,
+            num_semesters=wizard_data.num_semesters,
+            competencies=competencies,
+            subjects=subjects,
+            grades=grades,
+            classrooms=tuple(_load_json(wizard_data.classrooms, [])),
+            grade_name=wizard_data.grade_name,
+            subject_name=wizard_data.subject_name,
+            competencies_skipped=bool(wizard_data.competencies_skipped),
+            revision=(wizard_data.id, wizard_data.version),
+            weights=weights,
+            default_weights=default_weights or {},
+        )
+
+    @staticmethod
+    def _row_key_for(teacher_type, value):
+        if teacher_type == 'homeroom':
+            return (value or '').strip()
+        return normalize_grade_label(value)
+
+    def row_key(self, test):
+        """The weights row a test belongs to: its subject (homeroom) or grade (specialist)."""
+        if self.teacher_type == 'homeroom':
+            return self._row_key_for('homeroom', test.subject)
+        return test.grade_key or normalize_grade_label(test.grade)
+
+    @property
+    def semesters(self):
+        return [f"Semester {i}" for i in range(1, self.num_semesters + 1)] if self.num_semesters else []
+
+    def competency_weights(self, row, semester):
+        """{competency: weight} for a grade/subject and semester, or None if not configured."""
+        return self.weights.get((self._row_key_for(self.teacher_type, row), semester_number(semester)))
+
+    def competency_weight(self, row, semester, competency):
+        return (self.competency_weights(row, semester) or {}).get(competency, 0)
+
+    def weights_for_tests(self, tests):
+        """Competency weights for a grade matrix of `tests`.
+
+        Uses the weights configured for the tests' grade/subject and semester when
+        they all share one; otherwise falls back to the first configured entry.
+        """
+        contexts = {(self.row_key(t), semester_number(t.semester)) for t in tests}
+        if len(contexts) == 1:
+            weights = self.weights.get(contexts.pop())
+            if weights is not None:
+                return dict(weights)
+        return dict(self.default_weights)
+
+
+def get_wizard_config(teacher_id):
+    """Return the teacher's WizardConfig, or None if the wizard was never completed."""
+    revision = db.session.query(SetupWizardData.id, SetupWizardData.version).filter_by(teacher_id=teacher_id).first()
+    cached = _cache.get(teacher_id)
+    if cached is not None and revision is not None and cached.revision == tuple(revision):
+        return cached
+
+    wizard_data = SetupWizardData.query.filter_by(teacher_id=teacher_id).first()
+    if wizard_data is None:
+        invalidate_wizard_config(teacher_id)
+        return None
+    config = WizardConfig.from_model(wizard_data)
+    with _cache_lock:
+        _cache[teacher_id] = config
+    return config
+
+
+def invalidate_wizard_config(teacher_id):
+    with _cache_lock:
+        _cache.pop(teacher_id, None)
@@ -0,0 +1,230 @@
+"""Synthetic district dataset for the benchmarks.
+
+Seeds schools, specialist and homeroom teachers (each with a completed Setup
+Wizard), classrooms, students, tests and grades at a configurable scale, with bulk
+inserts so a district-sized database takes seconds rather than minutes. Every
+benchmark teacher has an @benchmark.example.com address and the password `benchmark`.
+"""
+import json
+import random
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.classroom_names import normalize_grade_label
+from app.models import Teacher, School, Classroom, Student, SetupWizardData, Test, Grade
+
+EMAIL_DOMAIN = 'benchmark.example.com'
+PASSWORD = 'benchmark'
+
+COMPETENCIES = ['Reading', 'Writing', 'Oral Communication', 'Problem Solving']
+HOMEROOM_SUBJECTS = ['Mathematics', 'French', 'English', 'Science', 'Social Studies']
+SPECIALIST_SUBJECTS = ['Music', 'Physical Education', 'Visual Arts', 'Drama']
+
+INSERT_BATCH_SIZE = 5000
+
+
+@dataclass
+class DatasetScale:
+    schools: int = 2
+    specialist_teachers: int = 2
+    homeroom_teachers: int = 2
+    grade_levels: int = 3  # grades taught by each specialist
+    classrooms_per_grade: int = 2  # per specialist and grade level
+    students_per_classroom: int = 25
+    semesters: int = 2
+    tests_per_semester: int = 6  # per classroom (specialist) or subject (homeroom)
+    competencies: int = 3
+    subjects: int = 3  # homeroom subjects
+    grade_density: float = 0.9  # share of (student, test) pairs with a grade record
+    absent_rate: float = 0.03  # share of grade records marked absent
+    seed: int = 1
+
+    def as_dict(self):
+        return asdict(self)
+
+
+SCALES = {
+    'small': DatasetScale(),
+    'medium': DatasetScale(
+        schools=5, specialist_teachers=8, homeroom_teachers=20, grade_levels=4,
+        classrooms_per_grade=3, students_per_classroom=28, tests_per_semester=10,
+    ),
+    'district': DatasetScale(
+        schools=20, specialist_teachers=40, homeroom_teachers=120, grade_levels=6,
+        classrooms_per_grade=3, students_per_classroom=30, semesters=3,
+        tests_per_semester=12, competencies=4, subjects=5,
+    ),
+}
+
+
+def _bulk_insert(model, rows, returning=False):
+    """Insert rows in batches; with returning=True, return the new ids in order."""
+    ids = []
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        if returning:
+            ids.extend(db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), batch))
+        else:
+            db.session.execute(insert(model), batch)
+    return ids
+
+
+def _weights(rows, scale, competencies):
+    """Wizard weights {semester: {row_index: {competency_index: weight}}}, summing to 100."""
+    share = 100 // len(competencies)
+    per_row = {str(k): share + (100 - share * len(competencies) if k == 0 else 0) for k in range(len(competencies))}
+    return {
+        str(semester): {str(row): dict(per_row) for row in range(len(rows))}
+        for semester in range(1, scale.semesters + 1)
+    }
+
+
+def _test_rows(rng, teacher_id, scale, competencies, contexts, today):
+    """Test rows for each (grade, class_name, classroom_id, subject) context and semester."""
+    rows = []
+    for semester in range(1, scale.semesters + 1):
+        semester_start = today - timedelta(days=120 * (scale.semesters - semester + 1))
+        for grade, class_name, classroom_id, subject in contexts:
+            for n in range(scale.tests_per_semester):
+                rows.append({
+                    'teacher_id': teacher_id,
+                    'semester': f'Semester {semester}',
+                    'grade': grade,
+                    'class_name': class_name,
+                    'classroom_id': classroom_id,
+                    'grade_key': normalize_grade_label(grade) if grade else None,
+                    'subject': subject,
+                    'competency': competencies[n % len(competencies)],
+                    'test_name': f'{subject} test {n + 1}',
+                    'max_points': rng.choice([10, 20, 25, 50, 100]),
+                    'test_date': semester_start + timedelta(days=n * 7),
+                    'test_weight': float(rng.choice([1, 1, 2, 3])),
+                    'created_at': datetime.utcnow(),
+                    'scores_modified': False,
+                })
+    return rows
+
+
+def _grade_rows(rng, scale, tests, roster_for):
+    rows = []
+    now = datetime.utcnow()
+    for test_id, max_points, classroom_key in tests:
+        for student_id in roster_for[classroom_key]:
+            if rng.random() >= scale.grade_density:
+                continue
+            absent = rng.random() < scale.absent_rate
+            points = None if absent else round(min(max_points, max(0.0, rng.gauss(0.75, 0.15) * max_points)), 1)
+            rows.append({
+                'test_id': test_id,
+                'student_id': student_id,
+                'grade': points,
+                'absent': absent,
+                'original_grade': points,
+                'original_absent': absent,
+                'created_at': now,
+                'updated_at': now,
+            })
+    return rows
+
+
+def seed_dataset(scale):
+    """Seed the configured database with `scale` worth of data and commit.
+
+    Returns a summary of the row counts. The schema must already exist.
+    """
+    rng = random.Random(scale.seed)
+    password_hash = generate_password_hash(PASSWORD)
+    competencies = COMPETENCIES[:scale.competencies]
+    today = date.today()
+    counts = {'teachers': 0, 'classrooms': 0, 'students': 0, 'tests': 0, 'grades': 0}
+
+    teachers = (
+        [('specialist', i) for i in range(scale.specialist_teachers)]
+        + [('homeroom', i) for i in range(scale.homeroom_teachers)]
+    )
+    for index, (teacher_type, n) in enumerate(teachers):
+        teacher = Teacher(
+            first_name=teacher_type.title(), last_name=str(n + 1),
+            email=f'{teacher_type}{n + 1}@{EMAIL_DOMAIN}', password_hash=password_hash,
+        )
+        db.session.add(teacher)
+        db.session.flush()
+        school = School(name=f'School {index % scale.schools + 1}', teacher_id=teacher.id)
+        db.session.add(school)
+        db.session.flush()
+
+        subject, subjects, grades, wizard_classrooms = None, [], [], []
+        if teacher_type == 'specialist':
+            subject = SPECIALIST_SUBJECTS[n % len(SPECIALIST_SUBJECTS)]
+            grades = [str(g) for g in range(1, scale.grade_levels + 1)]
+            wizard_classrooms = [
+                {'name': f'{g}{k:02d}', 'grade': g}
+                for g in grades for k in range(1, scale.classrooms_per_grade + 1)
+            ]
+            classroom_names = [f"{c['name']} (Grade {c['grade']})" for c in wizard_classrooms]
+            wizard_rows = grades
+        else:
+            subjects = HOMEROOM_SUBJECTS[:scale.subjects]
+            grade = str(n % 6 + 1)
+            classroom_names = [f'{grade}{chr(65 + n // 6 % 26)}']
+            wizard_rows = subjects
+
+        classroom_ids = _bulk_insert(
+            Classroom, [{'name': name, 'school_id': school.id} for name in classroom_names], returning=True
+        )
+        roster_for = {}
+        for classroom_id in classroom_ids:
+            roster_for[classroom_id] = _bulk_insert(Student, [
+                {
+                    'first_name': f'Student{s + 1}',
+                    'last_name': f'Family{rng.randrange(1000):03d}',
+                    'classroom_id': classroom_id,
+                }
+                for s in range(scale.students_per_classroom)
+            ], returning=True)
+
+        db.session.add(SetupWizardData(
+            teacher_id=teacher.id,
+            teacher_type=teacher_type,
+            school_name=school.name,
+            num_semesters=scale.semesters,
+            competencies=json.dumps(competencies),
+            subjects=json.dumps(subjects),
+            grades=json.dumps(grades),
+            weights=json.dumps(_weights(wizard_rows, scale, competencies)),
+            classrooms=json.dumps(wizard_classrooms),
+            grade_name=classroom_names[0] if teacher_type == 'homeroom' else None,
+            subject_name=subject,
+            competencies_skipped=False,
+        ))
+
+        if teacher_type == 'specialist':
+            contexts = [
+                (c['grade'], c['name'], classroom_id, subject)
+                for c, classroom_id in zip(wizard_classrooms, classroom_ids)
+            ]
+        else:
+            contexts = [(None, None, None, s) for s in subjects]
+        test_rows = _test_rows(rng, teacher.id, scale, competencies, contexts, today)
+        test_ids = _bulk_insert(Test, test_rows, returning=True)
+
+        # Homeroom tests cover the teacher's whole (single) classroom
+        tests = [
+            (test_id, row['max_points'], row['classroom_id'] or classroom_ids[0])
+            for test_id, row in zip(test_ids, test_rows)
+        ]
+        grade_rows = _grade_rows(rng, scale, tests, roster_for)
+        _bulk_insert(Grade, grade_rows)
+        db.session.commit()
+
+        counts['teachers'] += 1
+        counts['classrooms'] += len(classroom_ids)
+        counts['students'] += sum(len(r) for r in roster_for.values())
+        counts['tests'] += len(test_ids)
+        counts['grades'] += len(grade_rows)
+
+    return counts
@@ -0,0 +1,443 @@
+"""End-to-end HTTP benchmarks.
+
+Seeds a synthetic district (see dataset.py) into the benchmark database and drives
+the main pages and APIs, either in-process through the Flask test client or over
+HTTP against a running server, then writes p50/p95/p99 latency, throughput, SQL
+query counts and peak RSS per endpoint as JSON so releases can be compared.
+
+    BENCHMARK_DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.http_bench --scale medium
+    python -m benchmarks.http_bench --set students_per_classroom=40 --iterations 200
+
+Against gunicorn (start it on the same database first; query counts come from the
+Server-Timing header, peak RSS is read from /proc for --server-pid and its worker
+processes):
+
+    FLASK_ENV=benchmark gunicorn -w 4 run:app
+    python -m benchmarks.http_bench --url http://127.0.0.1:8000 --concurrency 8 --server-pid <pid>
+"""
+import argparse
+import http.cookiejar
+import json
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Teacher, Test
+from app.rosters import students_for_tests
+
+from .dataset import EMAIL_DOMAIN, PASSWORD, SCALES, seed_dataset
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+ENDPOINTS = [
+    'dashboard',
+    'input_grades',
+    'get_grade_matrix',
+    'save_grades',
+    'bell_grade_scenarios',
+    'export_grade_matrix_xlsx',
+]
+
+
+@dataclass
+class Target:
+    """One benchmark teacher and the test/class their requests are about."""
+    teacher_id: int
+    email: str
+    teacher_type: str
+    semester: str
+    class_name: str
+    subject: str
+    test_id: int
+    max_points: int
+    student_ids: list
+
+
+@dataclass
+class EndpointSamples:
+    latencies: list = field(default_factory=list)
+    queries: list = field(default_factory=list)
+    errors: int = 0
+    wall_seconds: float = 0.0
+    peak_rss_before_kb: int = None
+    peak_rss_after_kb: int = None
+
+    def summary(self):
+        latencies_ms = np.array(self.latencies) * 1000.0
+        requests = len(self.latencies)
+        result = {
+            'requests': requests,
+            'errors': self.errors,
+            'throughput_rps': round(requests / self.wall_seconds, 2) if self.wall_seconds else None,
+            'latency_ms': None,
+            'queries_per_request': None,
+            'peak_rss_mb': _mb(self.peak_rss_after_kb),
+            'peak_rss_growth_mb': (
+                _mb(self.peak_rss_after_kb - self.peak_rss_before_kb)
+                if self.peak_rss_after_kb is not None and self.peak_rss_before_kb is not None else None
+            ),
+        }
+        if requests:
+            p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+            result['latency_ms'] = {
+                'min': round(float(latencies_ms.min()), 2),
+                'mean': round(float(latencies_ms.mean()), 2),
+                'p50': round(float(p50), 2),
+                'p95': round(float(p95), 2),
+                'p99': round(float(p99), 2),
+                'max': round(float(latencies_ms.max()), 2),
+            }
+        if self.queries:
+            result['queries_per_request'] = {
+                'mean': round(float(np.mean(self.queries)), 2),
+                'max': int(max(self.queries)),
+            }
+        return result
+
+
+def _mb(kb):
+    return None if kb is None else round(kb / 1024.0, 1)
+
+
+def _own_peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _with_children(pids):
+    """The given processes and their descendants (gunicorn workers under the master)."""
+    found = []
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        found.append(pid)
+        try:
+            with open(f'/proc/{pid}/task/{pid}/children') as children:
+                pending.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+    return found
+
+
+def _process_peak_rss_kb(pids):
+    """Sum of VmHWM (peak resident set) over the given processes and their children."""
+    total = 0
+    for pid in _with_children(pids):
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            return None
+    return total
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_scale(name, overrides):
+    """A preset from SCALES with `field=value` overrides applied."""
+    scale = SCALES[name]
+    changes = {}
+    for override in overrides:
+        key, _, value = override.partition('=')
+        if not hasattr(scale, key):
+            raise SystemExit(f'Unknown scale field: {key}')
+        changes[key] = type(getattr(scale, key))(value)
+    return replace(scale, **changes)
+
+
+def prepare_database(scale, reseed=False):
+    """Create the schema and seed it unless benchmark teachers already exist."""
+    if reseed:
+        db.drop_all()
+    db.create_all()
+    if Teacher.query.filter(Teacher.email.endswith(f'@{EMAIL_DOMAIN}')).first() is not None:
+        return None
+    return seed_dataset(scale)
+
+
+def load_targets(limit=None):
+    """Build a Target per benchmark teacher from the seeded data."""
+    query = Teacher.query.filter(Teacher.email.endswith(f'@{EMAIL_DOMAIN}')).order_by(Teacher.id)
+    if limit:
+        query = query.limit(limit)
+
+    targets = []
+    for teacher in query:
+        first_test = Test.query.filter_by(teacher_id=teacher.id, semester='Semester 1').order_by(Test.id).first()
+        if first_test is None:
+            continue
+        teacher_type = 'specialist' if first_test.class_name else 'homeroom'
+        if teacher_type == 'specialist':
+            tests = Test.query.filter_by(
+                teacher_id=teacher.id, semester=first_test.semester, class_name=first_test.class_name
+            ).all()
+        else:
+            tests = Test.query.filter_by(
+                teacher_id=teacher.id, semester=first_test.semester, subject=first_test.subject
+            ).all()
+        students = students_for_tests(teacher.id, tests, first_test.class_name or '')
+        targets.append(Target(
+            teacher_id=teacher.id,
+            email=teacher.email,
+            teacher_type=teacher_type,
+            semester=first_test.semester,
+            class_name=first_test.class_name or '',
+            subject=first_test.subject if teacher_type == 'homeroom' else '',
+            test_id=first_test.id,
+            max_points=first_test.max_points,
+            student_ids=[s.id for s in students],
+        ))
+    return targets
+
+
+def build_request(endpoint, target, iteration):
+    """(method, path, json body or None) for one request."""
+    filters = {'semester': target.semester}
+    if target.class_name:
+        filters['class_name'] = target.class_name
+    if target.subject:
+        filters['subject'] = target.subject
+    query = urllib.parse.urlencode(filters)
+
+    if endpoint == 'dashboard':
+        return 'GET', '/dashboard', None
+    if endpoint == 'input_grades':
+        return 'GET', '/input_grades', None
+    if endpoint == 'get_grade_matrix':
+        return 'GET', f'/api/get_grade_matrix?{query}', None
+    if endpoint == 'export_grade_matrix_xlsx':
+        return 'GET', f'/export/grade_matrix.xlsx?{query}', None
+    if endpoint == 'save_grades':
+        # Vary the points every iteration so each save really writes
+        grades = [
+            {'student_id': student_id, 'grade': (iteration + i) % (target.max_points + 1), 'absent': False}
+            for i, student_id in enumerate(target.student_ids)
+        ]
+        return 'POST', f'/api/save_grades/{target.test_id}', {'grades': grades}
+    if endpoint == 'bell_grade_scenarios':
+        return 'POST', '/api/bell_grade_scenarios', {
+            'test_id': target.test_id,
+            'class_name': target.class_name,
+            'adjust_avg': True,
+            'target_avg': 80,
+            'allow_over_100': False,
+            'boost_low': True,
+            'lowest_score': 50,
+        }
+    raise ValueError(f'Unknown endpoint: {endpoint}')
+
+
+def _failed(status, body):
+    if status >= 400:
+        return True
+    # save_grades reports errors in the body with a 200
+    if body[:1] != b'{':
+        return False
+    try:
+        return json.loads(body).get('success') is False
+    except ValueError:
+        return False
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def run_in_process(app, targets, endpoints, iterations, warmup):
+    """Drive the app through the Flask test client, one logged-in client per teacher."""
+    clients = []
+    for target in targets:
+        client = app.test_client()
+        response = client.post('/login', data={'email': target.email, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise SystemExit(f'Login failed for {target.email}')
+        clients.append(client)
+
+    counter = QueryCounter()
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', counter)
+
+    results = {}
+    for endpoint in endpoints:
+        samples = EndpointSamples()
+        for i in range(warmup):
+            method, path, body = build_request(endpoint, targets[i % len(targets)], i)
+            clients[i % len(clients)].open(path, method=method, json=body)
+
+        samples.peak_rss_before_kb = _own_peak_rss_kb()
+        started = time.perf_counter()
+        for i in range(iterations):
+            index = i % len(targets)
+            method, path, body = build_request(endpoint, targets[index], warmup + i)
+            counter.count = 0
+            request_started = time.perf_counter()
+            response = clients[index].open(path, method=method, json=body)
+            data = response.get_data()
+            samples.latencies.append(time.perf_counter() - request_started)
+            samples.queries.append(counter.count)
+            if _failed(response.status_code, data):
+                samples.errors += 1
+        samples.wall_seconds = time.perf_counter() - started
+        samples.peak_rss_after_kb = _own_peak_rss_kb()
+        results[endpoint] = samples
+    return results
+
+
+def _http_session(base_url, target):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    login = urllib.parse.urlencode({'email': target.email, 'password': PASSWORD}).encode()
+    opener.open(f'{base_url}/login', data=login).read()
+    return opener
+
+
+def _http_call(opener, base_url, method, path, body):
+    data = None
+    headers = {}
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    request = urllib.request.Request(f'{base_url}{path}', data=data, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with opener.open(request) as response:
+            status, content, headers = response.status, response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        status, content, headers = e.code, e.read(), e.headers
+    return time.perf_counter() - started, status, content, _server_timing_queries(headers)
+
+
+def _server_timing_queries(headers):
+    """Statement count from the app's `Server-Timing: db;dur=..;desc="N queries"` header."""
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing') or '')
+    return int(match.group(1)) if match else None
+
+
+def run_over_http(base_url, targets, endpoints, iterations, warmup, concurrency, server_pids):
+    """Drive a running server over HTTP with `concurrency` requests in flight."""
+    base_url = base_url.rstrip('/')
+    openers = [_http_session(base_url, target) for target in targets]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for endpoint in endpoints:
+            samples = EndpointSamples()
+
+            def call(i):
+                index = i % len(targets)
+                method, path, body = build_request(endpoint, targets[index], i)
+                return _http_call(openers[index], base_url, method, path, body)
+
+            list(pool.map(call, range(warmup)))
+            samples.peak_rss_before_kb = _process_peak_rss_kb(server_pids) if server_pids else None
+            started = time.perf_counter()
+            for elapsed, status, content, queries in pool.map(call, range(warmup, warmup + iterations)):
+                samples.latencies.append(elapsed)
+                if queries is not None:
+                    samples.queries.append(queries)
+                if _failed(status, content):
+                    samples.errors += 1
+            samples.wall_seconds = time.perf_counter() - started
+            samples.peak_rss_after_kb = _process_peak_rss_kb(server_pids) if server_pids else None
+            results[endpoint] = samples
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='FIELD=VALUE',
+                        help='Override a DatasetScale field, e.g. --set students_per_classroom=40')
+    parser.add_argument('--reseed', action='store_true', help='Drop and re-seed the benchmark database.')
+    parser.add_argument('--iterations', type=int, default=100, help='Measured requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per endpoint.')
+    parser.add_argument('--teachers', type=int, default=None, help='Only use the first N benchmark teachers.')
+    parser.add_argument('--endpoint', dest='endpoints', action='append', choices=ENDPOINTS,
+                        help='Endpoint to run (repeatable; default: all).')
+    parser.add_argument('--url', help='Benchmark a running server at this base URL instead of in-process.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Requests in flight (--url only).')
+    parser.add_argument('--server-pid', dest='server_pids', action='append', type=int, default=[],
+                        help='Server (e.g. gunicorn master) process to read peak RSS from (--url only, repeatable).')
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write, or '-' for stdout.")
+    args = parser.parse_args(argv)
+
+    scale = parse_scale(args.scale, args.overrides)
+    endpoints = args.endpoints or ENDPOINTS
+    app = create_app('benchmark')
+
+    with app.app_context():
+        seeded = prepare_database(scale, reseed=args.reseed)
+        targets = load_targets(args.teachers)
+        dialect = db.engine.dialect.name
+    if not targets:
+        raise SystemExit('No benchmark teachers with tests; run with --reseed.')
+    print(f'{len(targets)} teachers, {"seeded " + json.dumps(seeded) if seeded else "existing data"}',
+          file=sys.stderr)
+
+    # Routes print debug output; keep stdout for the JSON report
+    with redirect_stdout(sys.stderr):
+        if args.url:
+            results = run_over_http(
+                args.url, targets, endpoints, args.iterations, args.warmup, args.concurrency, args.server_pids
+            )
+        else:
+            results = run_in_process(app, targets, endpoints, args.iterations, args.warmup)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': dialect,
+            'mode': 'http' if args.url else 'in_process',
+            'concurrency': args.concurrency if args.url else 1,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'teachers': len(targets),
+            'scale': scale.as_dict(),
+        },
+        'endpoints': {endpoint: samples.summary() for endpoint, samples in results.items()},
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    for endpoint, summary in report['endpoints'].items():
+        latency = summary['latency_ms'] or {}
+        print(f"{endpoint:28s} p50={latency.get('p50')}ms p95={latency.get('p95')}ms "
+              f"p99={latency.get('p99')}ms errors={summary['errors']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Micro-benchmarks for the compute kernels behind the grade pages.
+
+Times the pure functions the routes call, on synthetic data and without a
+database:
+
+- bell_scenarios: bell_grade_scenarios' stack + scenario math + per-student rows
+- bell_apply: apply_bell_selection's scenario math and points conversion
+- grade_matrix: get_grade_matrix's totals/averages pivot and its JSON shape
+- xlsx_export: export_grade_matrix_xlsx's workbook construction
+- classroom_names: grade/class parsing of classroom names
+
+Each kernel runs for every (students, tests) combination and reports the best
+and median time per call. Save a run with --json and pass it to --compare on a
+later run to get a speedup column.
+
+    python -m benchmarks.kernels
+    python -m benchmarks.kernels --students 30,3000 --tests 10 --kernel grade_matrix
+    python -m benchmarks.kernels --json before.json
+    python -m benchmarks.kernels --compare before.json
+"""
+import argparse
+import io
+import json
+import random
+import statistics
+import sys
+import timeit
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.bell_curve import BellOptions, TestGrades, compute_scenarios, stack_test_grades, to_optional
+from app.classroom_names import extract_grade_from_classroom_name, split_classroom_name
+from app.exports import write_grade_matrix_xlsx
+from app.grade_matrix import compute_grade_matrix
+
+DEFAULT_STUDENTS = [30, 300, 3000]
+DEFAULT_TESTS = [5, 20]
+
+COMPETENCIES = ['Reading', 'Writing', 'Oral Communication']
+COMPETENCY_WEIGHTS = {'Reading': 40, 'Writing': 35, 'Oral Communication': 25}
+
+BELL_OPTIONS = BellOptions(adjust_avg=True, target_avg=80.0, allow_over_100=False, boost_low=True, lowest_score=50.0)
+
+CLASSROOM_NAME_PATTERNS = ['{g}0{k}', '{g}{letter}', 'Grade {g}', '{g}0{k} (Grade {g})', 'Room {k}']
+
+
+class Fixture:
+    """Synthetic tests and grades for one (students, tests) size, built once per size."""
+
+    def __init__(self, n_students, n_tests, seed=1):
+        rng = random.Random(seed)
+        self.tests = [
+            SimpleNamespace(
+                id=j + 1,
+                test_name=f'Test {j + 1}',
+                competency=COMPETENCIES[j % len(COMPETENCIES)],
+                max_points=rng.choice([10, 20, 25, 50, 100]),
+                test_weight=float(rng.choice([1, 2, 3])),
+            )
+            for j in range(n_tests)
+        ]
+        self.student_ids = list(range(1, n_students + 1))
+        self.names = {sid: (f'Student{sid}', f'Family{rng.randrange(1000):03d}') for sid in self.student_ids}
+
+        # {student_id: {test_id: points or None}}, ~90% graded and ~3% absent
+        self.grades = {}
+        for sid in self.student_ids:
+            row = {}
+            for t in self.tests:
+                roll = rng.random()
+                if roll < 0.03:
+                    row[t.id] = None
+                elif roll < 0.9:
+                    row[t.id] = round(min(t.max_points, max(0.0, rng.gauss(0.75, 0.15) * t.max_points)), 1)
+            self.grades[sid] = row
+
+        self.test_grades = []
+        for t in self.tests:
+            graded = [(sid, self.grades[sid][t.id]) for sid in self.student_ids if t.id in self.grades[sid]]
+            self.test_grades.append(TestGrades(
+                test=t,
+                grade_ids=[sid for sid, _points in graded],
+                student_ids=[sid for sid, _points in graded],
+                names=[' '.join(self.names[sid]) for sid, _points in graded],
+                points=np.array([np.nan if p is None else p for _sid, p in graded], dtype=float),
+                absent=np.array([p is None for _sid, p in graded], dtype=bool),
+            ))
+
+        self.classroom_names = [
+            rng.choice(CLASSROOM_NAME_PATTERNS).format(g=rng.randint(1, 8), k=rng.randint(1, 9), letter='ABC'[i % 3])
+            for i in range(n_students)
+        ]
+
+
+def bell_scenarios(fixture):
+    points, absent, max_points = stack_test_grades(fixture.test_grades[:1])
+    scenarios = compute_scenarios(points, absent, max_points, BELL_OPTIONS)
+    return [
+        {
+            'name': name,
+            'original': to_optional(scenarios.original[0, i]),
+            'linear': to_optional(scenarios.linear[0, i]),
+            'percentage': to_optional(scenarios.percentage[0, i]),
+            'sqrt': to_optional(scenarios.sqrt[0, i]),
+        }
+        for i, name in enumerate(fixture.test_grades[0].names)
+    ]
+
+
+def bell_apply(fixture):
+    points, absent, max_points = stack_test_grades(fixture.test_grades)
+    scenarios = compute_scenarios(points, absent, max_points, BELL_OPTIONS)
+    new_points = scenarios.points('sqrt', max_points)
+    updates = []
+    for i, tg in enumerate(fixture.test_grades):
+        row = new_points[i, :len(tg.grade_ids)]
+        keep = ~np.isnan(row)
+        updates.append(([grade_id for grade_id, k in zip(tg.grade_ids, keep) if k], row[keep].tolist()))
+    return updates
+
+
+def grade_matrix(fixture):
+    matrix = compute_grade_matrix(fixture.tests, COMPETENCY_WEIGHTS, fixture.student_ids, fixture.grades)
+    return matrix.as_json()
+
+
+def xlsx_export(fixture):
+    rows = ((sid, *fixture.names[sid], fixture.grades[sid]) for sid in fixture.student_ids)
+    output = io.BytesIO()
+    write_grade_matrix_xlsx(output, 'Grade Matrix', fixture.tests, COMPETENCY_WEIGHTS, rows)
+    return output
+
+
+def classroom_names(fixture):
+    return [
+        (extract_grade_from_classroom_name(name), split_classroom_name(name))
+        for name in fixture.classroom_names
+    ]
+
+
+KERNELS = {
+    'bell_scenarios': bell_scenarios,
+    'bell_apply': bell_apply,
+    'grade_matrix': grade_matrix,
+    'xlsx_export': xlsx_export,
+    'classroom_names': classroom_names,
+}
+
+
+def time_kernel(kernel, fixture, repeat, min_seconds):
+    """(best, median) seconds per call over `repeat` rounds of at least min_seconds each."""
+    timer = timeit.Timer(lambda: kernel(fixture))
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_seconds:
+            break
+        number *= 2
+    per_call = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return min(per_call), statistics.median(per_call)
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _key(result):
+    return (result['kernel'], result['students'], result['tests'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=_int_list, default=DEFAULT_STUDENTS, help='Comma-separated class sizes.')
+    parser.add_argument('--tests', type=_int_list, default=DEFAULT_TESTS, help='Comma-separated test counts.')
+    parser.add_argument('--kernel', dest='kernels', action='append', choices=sorted(KERNELS),
+                        help='Kernel to run (repeatable; default: all).')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed rounds per measurement.')
+    parser.add_argument('--min-time', type=float, default=0.1, help='Minimum seconds per round.')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON file from an earlier run to compare against.')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_key(r): r for r in json.load(f)['results']}
+
+    kernels = args.kernels or list(KERNELS)
+    results = []
+    header = f"{'kernel':16s} {'students':>8s} {'tests':>5s} {'best ms':>10s} {'median ms':>10s}"
+    if baseline:
+        header += f" {'baseline ms':>11s} {'speedup':>8s}"
+    print(header)
+    print('-' * len(header))
+    for n_students in args.students:
+        for n_tests in args.tests:
+            fixture = Fixture(n_students, n_tests)
+            for name in kernels:
+                best, median = time_kernel(KERNELS[name], fixture, args.repeat, args.min_time)
+                result = {
+                    'kernel': name,
+                    'students': n_students,
+                    'tests': n_tests,
+                    'best_ms': round(best * 1000, 4),
+                    'median_ms': round(median * 1000, 4),
+                }
+                results.append(result)
+                line = (f"{name:16s} {n_students:8d} {n_tests:5d} "
+                        f"{result['best_ms']:10.3f} {result['median_ms']:10.3f}")
+                previous = baseline.get(_key(result))
+                if previous:
+                    line += f" {previous['best_ms']:11.3f} {previous['best_ms'] / result['best_ms']:7.2f}x"
+                print(line)
+                sys.stdout.flush()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'repeat': args.repeat, 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,8 +13,59 @@ class Config:
     BABEL_DEFAULT_LOCALE = 'en'
     BABEL_DEFAULT_TIMEZONE = 'UTC'
 
+    # Request metrics: Server-Timing header with SQL time/count on every response
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+    # Raise instead of logging a warning when a view exceeds its @query_budget
+    # (None: raise only when TESTING)
+    QUERY_BUDGET_RAISE = None
+    # /metrics is served to local scrapers, or to remote ones sending this bearer token
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Server-side PDF reports: render processes per app process (0 renders in the
+    # request thread), renders allowed to wait for a process, and per-render timeout
+    PDF_WORKERS = int(os.environ.get('PDF_WORKERS', min(2, os.cpu_count() or 1)))
+    PDF_MAX_PENDING = int(os.environ.get('PDF_MAX_PENDING', 8))
+    PDF_RENDER_TIMEOUT = int(os.environ.get('PDF_RENDER_TIMEOUT', 120))
+    # Background jobs (flask run-worker): jobs running and waiting per teacher,
+    # attempts before a job fails (retries wait JOB_RETRY_DELAY seconds, doubling),
+    # worker poll and heartbeat intervals, seconds without a heartbeat before a
+    # running job is retried, seconds result files are kept, and the largest
+    # upload a job accepts
+    JOB_TEACHER_CONCURRENCY = int(os.environ.get('JOB_TEACHER_CONCURRENCY', 1))
+    JOB_MAX_QUEUED_PER_TEACHER = int(os.environ.get('JOB_MAX_QUEUED_PER_TEACHER', 5))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 5))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 300))
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 24 * 3600))
+    JOB_MAX_INPUT_BYTES = int(os.environ.get('JOB_MAX_INPUT_BYTES', 10 * 1024 * 1024))
+    # Run jobs in the submitting request instead of waiting for a worker
+    JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', 'false').lower() == 'true'
+    # Outgoing mail (outbox.py); without MAIL_SERVER password reset links are flashed instead
+    MAIL_SERVER = os.environ.get('MAIL_SERVER')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 0)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_USE_TLS = (os.environ.get('MAIL_USE_TLS') or 'false').lower() == 'true'
+    MAIL_USE_SSL = (os.environ.get('MAIL_USE_SSL') or 'false').lower() == 'true'
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_TIMEOUT = int(os.environ.get('MAIL_TIMEOUT', 10))
+    # Deliver from a thread in each web process (the worker and `flask send-mail` deliver too)
+    MAIL_SENDER_THREAD = os.environ.get('MAIL_SENDER_THREAD', 'true').lower() == 'true'
+    # Attempts per message (retries wait MAIL_RETRY_DELAY seconds, doubling), sender poll
+    # interval, idle seconds before the SMTP connection is closed, seconds before a claimed
+    # message is retried by another sender, and seconds sent/failed messages are kept
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+    MAIL_RETRY_DELAY = int(os.environ.get('MAIL_RETRY_DELAY', 60))
+    MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', 30))
+    MAIL_CONNECTION_IDLE = int(os.environ.get('MAIL_CONNECTION_IDLE', 60))
+    MAIL_STALE_AFTER = int(os.environ.get('MAIL_STALE_AFTER', 300))
+    MAIL_OUTBOX_RETENTION = int(os.environ.get('MAIL_OUTBOX_RETENTION', 7 * 24 * 3600))
+
 class DevelopmentConfig(Config):
     DEBUG = True
+    # `python run.py` starts no worker process
+    JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', 'true').lower() == 'true'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'grading_app.db')
 
 class ProductionConfig(Config):
@@ -52,9 +103,25 @@ class ProductionConfig(Config):
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
+class BenchmarkConfig(Config):
+    # Used by benchmarks/; point BENCHMARK_DATABASE_URL at a throwaway database
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URL') or 'sqlite:///' + os.path.join(BASE_DIR, 'benchmark.db')
+    # The benchmark client logs in with plain form posts
+    WTF_CSRF_ENABLED = False
+
+class TestingConfig(Config):
+    # Used by tests/; each test gets a fresh in-memory database
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    MAIL_SERVER = None
+    MAIL_SENDER_THREAD = False
+
 # Configuration dictionary
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
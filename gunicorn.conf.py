@@ -0,0 +1,22 @@
+"""Gunicorn settings shared by the Procfile and nixpacks start commands.
+
+Only multiprocess metrics housekeeping lives here; bind, timeouts and workers
+stay on the command line.
+"""
+import glob
+import os
+
+
+def on_starting(server):
+    # Metric files left by a previous run would be counted again
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
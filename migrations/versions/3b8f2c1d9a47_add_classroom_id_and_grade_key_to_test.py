@@ -0,0 +1,35 @@
+"""Add resolved classroom_id and grade_key to Test
+
+Revision ID: 3b8f2c1d9a47
+Revises: c6193f525e19
+Create Date: 2026-10-17 09:12:44.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f2c1d9a47'
+down_revision = 'c6193f525e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled by `flask backfill-test-classrooms`
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('classroom_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('grade_key', sa.String(length=50), nullable=True))
+        batch_op.create_index(batch_op.f('ix_test_classroom_id'), ['classroom_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_test_grade_key'), ['grade_key'], unique=False)
+        batch_op.create_foreign_key('fk_test_classroom_id_classroom', 'classroom', ['classroom_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_test_classroom_id_classroom', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_test_grade_key'))
+        batch_op.drop_index(batch_op.f('ix_test_classroom_id'))
+        batch_op.drop_column('grade_key')
+        batch_op.drop_column('classroom_id')
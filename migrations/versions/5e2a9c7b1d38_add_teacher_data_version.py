@@ -0,0 +1,26 @@
+"""Add data_version to Teacher
+
+Revision ID: 5e2a9c7b1d38
+Revises: 8d4e6a2f7c15
+Create Date: 2026-10-17 15:02:11.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a9c7b1d38'
+down_revision = '8d4e6a2f7c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('teacher', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('teacher', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
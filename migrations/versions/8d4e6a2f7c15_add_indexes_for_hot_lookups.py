@@ -0,0 +1,74 @@
+"""Add indexes for foreign keys and common test/grade filters
+
+Revision ID: 8d4e6a2f7c15
+Revises: 3b8f2c1d9a47
+Create Date: 2026-10-17 14:03:27.551904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e6a2f7c15'
+down_revision = '3b8f2c1d9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('school', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_school_teacher_id'), ['teacher_id'], unique=False)
+
+    with op.batch_alter_table('classroom', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_classroom_school_id'), ['school_id'], unique=False)
+
+    with op.batch_alter_table('student', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_student_classroom_id'), ['classroom_id'], unique=False)
+
+    with op.batch_alter_table('setup_wizard_data', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_setup_wizard_data_teacher_id'), ['teacher_id'], unique=False)
+
+    # Both lead with teacher_id, so a separate teacher_id index is not needed; test_date
+    # last lets the filtered lists come back in date order without a sort
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_test_teacher_semester_class', ['teacher_id', 'semester', 'class_name', 'test_date'], unique=False
+        )
+        batch_op.create_index('ix_test_teacher_test_date', ['teacher_id', 'test_date'], unique=False)
+
+    # Lookups by test already use the unique_test_student (test_id, student_id) index
+    with op.batch_alter_table('grade', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_grade_student_id'), ['student_id'], unique=False)
+        batch_op.create_index(
+            'ix_grade_absent_test_id', ['test_id'], unique=False,
+            postgresql_where=sa.text('absent = true'), sqlite_where=sa.text('absent = 1'),
+        )
+
+    with op.batch_alter_table('classroom_layout', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_classroom_layout_classroom_id'), ['classroom_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('classroom_layout', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_classroom_layout_classroom_id'))
+
+    with op.batch_alter_table('grade', schema=None) as batch_op:
+        batch_op.drop_index('ix_grade_absent_test_id')
+        batch_op.drop_index(batch_op.f('ix_grade_student_id'))
+
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.drop_index('ix_test_teacher_test_date')
+        batch_op.drop_index('ix_test_teacher_semester_class')
+
+    with op.batch_alter_table('setup_wizard_data', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_setup_wizard_data_teacher_id'))
+
+    with op.batch_alter_table('student', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_student_classroom_id'))
+
+    with op.batch_alter_table('classroom', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_classroom_school_id'))
+
+    with op.batch_alter_table('school', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_school_teacher_id'))
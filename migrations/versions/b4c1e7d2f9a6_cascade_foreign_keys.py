@@ -0,0 +1,58 @@
+"""Cascade deletes on foreign keys to teachers, schools, classrooms, students and tests
+
+Revision ID: b4c1e7d2f9a6
+Revises: 9f3c6d2e8a41
+Create Date: 2026-10-17 16:21:08.734512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4c1e7d2f9a6'
+down_revision = '9f3c6d2e8a41'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table); the initial migration created these unnamed
+FOREIGN_KEYS = [
+    ('school', 'teacher_id', 'teacher'),
+    ('classroom', 'school_id', 'school'),
+    ('student', 'classroom_id', 'classroom'),
+    ('setup_wizard_data', 'teacher_id', 'teacher'),
+    ('test', 'teacher_id', 'teacher'),
+    ('grade', 'test_id', 'test'),
+    ('grade', 'student_id', 'student'),
+    ('classroom_layout', 'teacher_id', 'teacher'),
+    ('classroom_layout', 'classroom_id', 'classroom'),
+]
+
+# Gives SQLite's reflected, unnamed foreign keys a name batch mode can drop
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def _replace_foreign_keys(ondelete):
+    inspector = sa.inspect(op.get_bind())
+    tables = {}
+    for table, column, referred in FOREIGN_KEYS:
+        tables.setdefault(table, []).append((column, referred))
+
+    for table, keys in tables.items():
+        # Postgres named them <table>_<column>_fkey; SQLite reports no name
+        existing = {
+            tuple(fk['constrained_columns']): fk['name'] for fk in inspector.get_foreign_keys(table)
+        }
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referred in keys:
+                name = f'fk_{table}_{column}_{referred}'
+                batch_op.drop_constraint(existing.get((column,)) or name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
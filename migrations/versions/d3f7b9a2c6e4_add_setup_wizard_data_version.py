@@ -0,0 +1,26 @@
+"""Add version counter to SetupWizardData
+
+Revision ID: d3f7b9a2c6e4
+Revises: c8e2a5f1b7d3
+Create Date: 2026-10-17 20:14:37.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f7b9a2c6e4'
+down_revision = 'c8e2a5f1b7d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('setup_wizard_data', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('setup_wizard_data', schema=None) as batch_op:
+        batch_op.drop_column('version')
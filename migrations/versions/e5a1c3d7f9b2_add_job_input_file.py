@@ -0,0 +1,28 @@
+"""Add uploaded input file to Job
+
+Revision ID: e5a1c3d7f9b2
+Revises: d3f7b9a2c6e4
+Create Date: 2026-10-17 20:41:05.238716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c3d7f9b2'
+down_revision = 'd3f7b9a2c6e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('input_name', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('input_data', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_column('input_data')
+        batch_op.drop_column('input_name')
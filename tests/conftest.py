@@ -0,0 +1,81 @@
+import json
+from datetime import date
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import Classroom, School, SetupWizardData, Student, Teacher, Test
+from app.wizard_config import invalidate_wizard_config
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def teacher(app):
+    teacher = Teacher(first_name='Ada', last_name='Byron', email='ada@example.com',
+                      password_hash=generate_password_hash('password'))
+    db.session.add(teacher)
+    db.session.commit()
+    # Ids repeat across the tests' databases; don't serve another test's wizard config
+    invalidate_wizard_config(teacher.id)
+    return teacher
+
+
+def add_classroom(teacher, name, school_name='Riverside', students=()):
+    school = School.query.filter_by(teacher_id=teacher.id, name=school_name).first()
+    if school is None:
+        school = School(name=school_name, teacher_id=teacher.id)
+        db.session.add(school)
+        db.session.flush()
+    classroom = Classroom(name=name, school_id=school.id)
+    db.session.add(classroom)
+    db.session.flush()
+    for first_name, last_name in students:
+        db.session.add(Student(first_name=first_name, last_name=last_name, classroom_id=classroom.id))
+    db.session.commit()
+    return classroom
+
+
+def add_test(teacher, classroom=None, **fields):
+    values = dict(semester='Semester 1', grade='1', class_name='101', subject='Music', competency='C1',
+                  test_name='Quiz', max_points=20, test_date=date(2026, 9, 15), test_weight=1.0)
+    values.update(fields)
+    test = Test(teacher_id=teacher.id, classroom_id=classroom.id if classroom else None, **values)
+    db.session.add(test)
+    db.session.commit()
+    return test
+
+
+@pytest.fixture
+def classroom(teacher):
+    return add_classroom(teacher, '101 (Grade 1)', students=[('Ann', 'Lee'), ('Ben', 'Moss'), ('Cy', 'Nash')])
+
+
+@pytest.fixture
+def wizard(teacher):
+    wizard = SetupWizardData(
+        teacher_id=teacher.id, teacher_type='specialist', school_name='Riverside', num_semesters=2,
+        competencies=json.dumps(['C1', 'C2']), subjects=json.dumps(['Music']), grades=json.dumps(['1']),
+        weights=json.dumps({'1': {'0': {'0': 60, '1': 40}}}), classrooms=json.dumps([{'name': '101', 'grade': '1'}]),
+        subject_name='Music',
+    )
+    db.session.add(wizard)
+    db.session.commit()
+    return wizard
+
+
+@pytest.fixture
+def client(app, teacher):
+    client = app.test_client()
+    response = client.post('/login', data={'email': 'ada@example.com', 'password': 'password'})
+    assert response.status_code == 302
+    return client
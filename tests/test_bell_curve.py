@@ -0,0 +1,212 @@
+import math
+
+import numpy as np
+import pytest
+from sqlalchemy import Update, event
+from sqlalchemy.dialects import postgresql
+
+from app import bell_curve, db, models
+from app.bell_curve import BellOptions, apply_scenario, compute_scenarios
+from app.models import Grade, Student
+
+from .conftest import add_test
+
+
+def reference_scenarios(points, absent, max_points, options):
+    """The per-student loop bell_grade_scenarios used before the vectorized engine."""
+    originals = [None if a or p is None else p / max_points * 100.0 for p, a in zip(points, absent)]
+    graded = [o for o in originals if o is not None]
+    avg = sum(graded) / len(graded) if graded else None
+    target = options.target_avg
+    result = {'original': originals, 'linear': [], 'percentage': [], 'sqrt': []}
+    for original in originals:
+        linear = percentage = sqrt = None
+        if original is not None and avg is not None:
+            if options.adjust_avg:
+                linear = original + (target - avg)
+                percentage = original * 0.85 + (target - avg * 0.85)
+                if not options.allow_over_100:
+                    linear, percentage = min(linear, 100.0), min(percentage, 100.0)
+            if options.boost_low:
+                adjust = math.sqrt(max(avg, 0.0)) * 10.0 - target
+                sqrt = math.sqrt(max(original, 0.0)) * 10.0 - adjust
+                if options.lowest_score is not None:
+                    sqrt = max(sqrt, options.lowest_score)
+                sqrt = max(original + 2.0, sqrt)
+        result['linear'].append(linear)
+        result['percentage'].append(percentage)
+        result['sqrt'].append(sqrt)
+    return avg, result
+
+
+def as_list(row):
+    return [None if np.isnan(value) else pytest.approx(value) for value in row.tolist()]
+
+
+@pytest.mark.parametrize('options', [
+    BellOptions(adjust_avg=True, target_avg=75.0),
+    BellOptions(adjust_avg=True, target_avg=90.0, allow_over_100=True),
+    BellOptions(adjust_avg=True, target_avg=70.0, boost_low=True, lowest_score=55.0),
+    BellOptions(boost_low=True, target_avg=80.0),
+])
+def test_matches_the_per_student_formulas_for_every_test(options):
+    rng = np.random.default_rng(7)
+    tests = []
+    for max_points, size in [(20, 5), (50, 8), (10, 3)]:
+        points = [None if rng.random() < 0.2 else float(rng.integers(0, max_points + 1)) for _ in range(size)]
+        absent = [p is None and rng.random() < 0.5 for p in points]
+        tests.append((points, absent, max_points))
+    width = max(len(points) for points, _absent, _max in tests)
+    matrix = np.full((len(tests), width), np.nan)
+    absent_matrix = np.zeros((len(tests), width), dtype=bool)
+    for i, (points, absent, _max) in enumerate(tests):
+        matrix[i, :len(points)] = [np.nan if p is None else p for p in points]
+        absent_matrix[i, :len(absent)] = absent
+
+    scenarios = compute_scenarios(matrix, absent_matrix, [t[2] for t in tests], options)
+
+    for i, (points, absent, max_points) in enumerate(tests):
+        avg, expected = reference_scenarios(points, absent, max_points, options)
+        assert scenarios.class_avg[i] == pytest.approx(avg)
+        for name in ('original', 'linear', 'percentage', 'sqrt'):
+            assert as_list(scenarios.scenario(name)[i, :len(points)]) == expected[name], name
+        # Padding columns stay empty
+        assert np.isnan(scenarios.original[i, len(points):]).all()
+
+
+def test_absent_students_stay_empty_even_with_points():
+    scenarios = compute_scenarios([[10.0, 20.0]], [[True, False]], [20], BellOptions(adjust_avg=True, target_avg=50.0))
+
+    assert as_list(scenarios.original[0]) == [None, 100.0]
+    assert scenarios.class_avg[0] == 100.0
+    assert as_list(scenarios.linear[0]) == [None, 50.0]
+
+
+def test_tests_without_grades_have_no_average():
+    scenarios = compute_scenarios([[np.nan, np.nan]], [[False, True]], [20], BellOptions(adjust_avg=True, target_avg=70.0))
+
+    assert np.isnan(scenarios.class_avg[0])
+    assert np.isnan(scenarios.linear).all()
+
+
+def test_disabled_scenarios_are_empty():
+    scenarios = compute_scenarios([[10.0]], [[False]], [20], BellOptions())
+
+    for name in ('linear', 'percentage', 'sqrt'):
+        assert np.isnan(scenarios.scenario(name)).all()
+
+
+def test_points_round_to_two_decimals_per_test():
+    scenarios = compute_scenarios([[7.0], [1.0]], [[False], [False]], [30, 3],
+                                  BellOptions(adjust_avg=True, target_avg=50.0))
+
+    assert scenarios.points('linear', [30, 3]).tolist() == [[15.0], [1.5]]
+    assert scenarios.points('original', [30, 3]).tolist() == [[7.0], [1.0]]
+
+
+@pytest.fixture
+def graded_tests(teacher, classroom):
+    """Two tests for the classroom's three students: Ann 10, Ben 14, Cy absent."""
+    ann, ben, cy = Student.query.order_by(Student.id).all()
+    tests = [add_test(teacher, classroom, test_name=name) for name in ('Quiz 1', 'Quiz 2')]
+    for test in tests:
+        db.session.add_all([
+            Grade(test_id=test.id, student_id=ann.id, grade=10, original_grade=10, absent=False),
+            Grade(test_id=test.id, student_id=ben.id, grade=14, original_grade=14, absent=False),
+            Grade(test_id=test.id, student_id=cy.id, grade=None, absent=True),
+        ])
+    db.session.commit()
+    return tests
+
+
+def grade_values(test):
+    db.session.expire_all()
+    return [g.grade for g in Grade.query.filter_by(test_id=test.id).order_by(Grade.student_id)]
+
+
+def test_apply_scenario_updates_grades_and_tests(teacher, graded_tests):
+    options = BellOptions(adjust_avg=True, target_avg=70.0)
+
+    updated = apply_scenario(teacher.id, graded_tests, 'linear', options)
+    db.session.commit()
+
+    assert updated == {test.id: 2 for test in graded_tests}
+    for test in graded_tests:
+        # Average 60% -> 70%: +10 points of 20 is +2
+        assert grade_values(test) == [12.0, 16.0, None]
+        grades = Grade.query.filter_by(test_id=test.id).order_by(Grade.student_id).all()
+        assert [g.original_grade for g in grades] == [10, 14, None]
+        assert grades[0].modification_type == 'bell_grade'
+        assert grades[0].modification_notes == 'Bell Grade - Equal Adjustment, Target Avg: 70.0%'
+        assert grades[2].modification_type is None
+        test = db.session.get(models.Test, test.id)
+        assert test.scores_modified
+        assert test.scores_modified_details.startswith('Type: Linear scaling; Original average: 60.0;')
+
+
+def test_apply_scenario_chunks_the_grade_update(teacher, graded_tests, monkeypatch):
+    monkeypatch.setattr(bell_curve, 'GRADE_UPDATE_CHUNK_SIZE', 3)
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        apply_scenario(teacher.id, graded_tests, 'linear', BellOptions(adjust_avg=True, target_avg=70.0))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    db.session.commit()
+
+    updates = [s for s in statements if s.startswith('UPDATE')]
+    assert [s.split()[1] for s in updates] == ['grade', 'grade', 'test']
+    assert all(grade_values(test) == [12.0, 16.0, None] for test in graded_tests)
+
+
+@pytest.fixture
+def postgresql_updates(monkeypatch):
+    """Build apply_scenario's PostgreSQL statements and capture its UPDATEs instead of running them."""
+    monkeypatch.setattr(bell_curve, '_UPDATE_FROM_VALUES_DIALECTS', ('sqlite',))
+    updates = []
+    execute = db.session.execute
+
+    def capture(statement, *args, **kwargs):
+        if isinstance(statement, Update):
+            updates.append(statement.compile(dialect=postgresql.dialect()))
+            return None
+        return execute(statement, *args, **kwargs)
+    monkeypatch.setattr(db.session, 'execute', capture)
+    return updates
+
+
+def test_apply_scenario_is_one_statement_on_postgresql(teacher, graded_tests, postgresql_updates):
+    apply_scenario(teacher.id, graded_tests, 'linear', BellOptions(adjust_avg=True, target_avg=70.0))
+
+    [statement] = postgresql_updates
+    sql = str(statement)
+    assert sql.startswith('WITH bell_grades AS \n(UPDATE grade SET grade=new_values.grade')
+    assert 'FROM (VALUES' in sql and 'RETURNING grade.id' in sql
+    assert 'UPDATE test SET scores_modified' in sql
+    assert sorted(v for k, v in statement.params.items() if k.startswith('param_') and isinstance(v, float)) == [
+        12.0, 12.0, 16.0, 16.0,
+    ]
+
+
+def test_apply_scenario_chunks_the_values_list_on_postgresql(teacher, graded_tests, postgresql_updates, monkeypatch):
+    monkeypatch.setattr(bell_curve, 'GRADE_UPDATE_CHUNK_SIZE', 3)
+
+    apply_scenario(teacher.id, graded_tests, 'linear', BellOptions(adjust_avg=True, target_avg=70.0))
+
+    chunk, batch = postgresql_updates
+    assert str(chunk).startswith('UPDATE grade SET grade=new_values.grade')
+    assert 'CASE' not in str(chunk)
+    # Two bind parameters per grade plus the metadata
+    assert len(chunk.params) == 3 * 2 + 4
+    assert str(batch).startswith('WITH bell_grades AS')
+
+
+def test_batch_endpoint_curves_every_selected_test(client, teacher, graded_tests):
+    response = client.post('/api/apply_bell_selection_batch', json={
+        'scenario': 'linear', 'adjust_avg': True, 'target_avg': 70, 'semester': 'Semester 1',
+    })
+
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 4
+    assert all(grade_values(test) == [12.0, 16.0, None] for test in graded_tests)
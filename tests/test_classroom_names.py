@@ -0,0 +1,55 @@
+from app import db, models
+from app.classroom_names import refresh_test_classrooms, split_classroom_name
+
+from .conftest import add_classroom, add_test
+
+
+def classroom_of(test):
+    db.session.expire_all()
+    return db.session.get(models.Test, test.id).classroom_id
+
+
+def test_split_classroom_name():
+    assert split_classroom_name('102 (Grade 1)') == ('102', 'Grade 1')
+    assert split_classroom_name('2B') == ('2B', 'Grade 2')
+
+
+def test_new_classrooms_resolve_tests_created_before_them(teacher, classroom):
+    test = add_test(teacher, class_name='201', grade='2')
+    other = add_classroom(teacher, '201 (Grade 2)')
+
+    assert refresh_test_classrooms(teacher.id, unresolved_only=True) == (1, 0)
+    db.session.commit()
+    assert classroom_of(test) == other.id
+
+
+def test_grade_labels_break_ties_between_same_named_classrooms(teacher, classroom):
+    add_classroom(teacher, '101 (Grade 2)', school_name='Hillside')
+    test = add_test(teacher, class_name='101', grade='Grade 1')
+
+    refresh_test_classrooms(teacher.id)
+    db.session.commit()
+
+    assert classroom_of(test) == classroom.id
+
+
+def test_renaming_a_classroom_moves_its_tests(client, teacher, classroom):
+    old_name_test = add_test(teacher, classroom)
+    new_name_test = add_test(teacher, class_name='102')
+
+    response = client.post(f'/classrooms/edit/{classroom.id}', data={
+        'name': '102 (Grade 1)', 'school': classroom.school_id,
+    })
+
+    assert response.status_code == 302
+    assert classroom_of(old_name_test) is None
+    assert classroom_of(new_name_test) == classroom.id
+
+
+def test_adding_a_classroom_resolves_waiting_tests(client, teacher, classroom):
+    test = add_test(teacher, class_name='103')
+
+    response = client.post(f'/classrooms?school_id={classroom.school_id}', data={'name': '103 (Grade 1)'})
+
+    assert response.status_code == 302
+    assert classroom_of(test) == models.Classroom.query.filter_by(name='103 (Grade 1)').one().id
@@ -0,0 +1,67 @@
+import re
+
+from app import db
+from app.models import Student, Teacher
+
+from .conftest import add_test
+
+URL = '/api/get_setup_wizard_data'
+
+
+def data_version(teacher):
+    db.session.expire_all()
+    return db.session.get(Teacher, teacher.id).data_version
+
+
+def test_unchanged_data_answers_304_without_running_the_view(client, wizard):
+    first = client.get(URL)
+    etag = first.headers['ETag']
+
+    response = client.get(URL, headers={'If-None-Match': etag})
+
+    assert first.status_code == 200 and first.get_json()['has_previous_data']
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    # At most Flask-Login's teacher lookup ran
+    assert int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1)) <= 1
+
+
+def test_etags_differ_between_urls(client, wizard):
+    assert client.get(URL).headers['ETag'] != client.get('/api/get_teacher_classrooms').headers['ETag']
+
+
+def test_writes_bump_the_version_and_invalidate_etags(client, teacher, classroom, wizard):
+    etag = client.get(URL).headers['ETag']
+    student = Student.query.first()
+    test = add_test(teacher, classroom)
+
+    response = client.post(f'/api/save_grades/{test.id}', json={'grades': [
+        {'student_id': student.id, 'grade': 12, 'absent': False},
+    ]})
+
+    assert response.status_code == 200
+    assert data_version(teacher) == 1
+    assert client.get(URL, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_read_only_posts_keep_the_version(client, teacher, classroom, wizard):
+    test = add_test(teacher, classroom)
+    etag = client.get(URL).headers['ETag']
+
+    response = client.post('/api/bell_grade_scenarios', json={'test_id': test.id})
+
+    assert response.status_code == 200
+    assert data_version(teacher) == 0
+    assert client.get(URL, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_failed_writes_keep_the_version(client, teacher, classroom):
+    test = add_test(teacher, classroom)
+
+    response = client.post(f'/api/save_grades/{test.id}', json={'grades': [
+        {'student_id': 999, 'grade': 12, 'absent': False},
+    ]})
+
+    assert response.status_code == 404
+    assert data_version(teacher) == 0
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.grade_matrix import (
+    ClassAverageAccumulator, MatrixLayout, class_averages, compute_grade_matrix, student_totals,
+)
+
+
+def make_tests(specs):
+    return [SimpleNamespace(id=i + 1, competency=competency, max_points=max_points, test_weight=weight)
+            for i, (competency, max_points, weight) in enumerate(specs)]
+
+
+def weighted(pairs):
+    """The review grid's rule: mean of the graded values, '--' (None) when no weight is behind it."""
+    pairs = [(value, weight) for value, weight in pairs if value is not None]
+    total_weight = sum(weight for _value, weight in pairs)
+    if not pairs or total_weight <= 0:
+        return None
+    return sum(value * weight for value, weight in pairs) / total_weight
+
+
+def reference_totals(tests, competency_weights, grades):
+    """Student totals and class averages the way review_grades.html computed them in the browser."""
+    competencies = sorted({t.competency for t in tests})
+    by_comp = {c: [t for t in tests if t.competency == c] for c in competencies}
+
+    def pct(points, test):
+        return None if points is None else points / test.max_points * 100.0
+
+    students = {}
+    for student_id, row in grades.items():
+        comp = {c: weighted([(pct(row.get(t.id), t), t.test_weight or 0) for t in by_comp[c]]) for c in competencies}
+        grand = weighted([(comp[c], competency_weights.get(c, 0)) for c in competencies])
+        students[student_id] = (comp, grand)
+
+    test_avgs = {}
+    for t in tests:
+        values = [pct(row.get(t.id), t) for row in grades.values()]
+        values = [v for v in values if v is not None]
+        test_avgs[t.id] = sum(values) / len(values) if values else None
+    comp_avgs = {c: weighted([(test_avgs[t.id], t.test_weight or 0) for t in by_comp[c]]) for c in competencies}
+    grand_avg = weighted([(comp_avgs[c], competency_weights.get(c, 0)) for c in competencies])
+    return students, (test_avgs, comp_avgs, grand_avg)
+
+
+def approx_or_none(value):
+    return None if value is None else pytest.approx(value, abs=1e-4)
+
+
+def test_totals_match_the_review_grid_rules():
+    tests = make_tests([
+        ('C1', 20, 50), ('C1', 10, 50), ('C1', 40, 0),
+        ('C2', 25, 100),
+        ('C3', 10, 30), ('C3', 10, 70),
+    ])
+    competency_weights = {'C1': 40, 'C2': 60, 'C3': 0}
+    rng = np.random.default_rng(3)
+    grades = {}
+    for student_id in range(1, 13):
+        grades[student_id] = {
+            t.id: None if rng.random() < 0.35 else float(rng.integers(0, t.max_points + 1)) for t in tests
+        }
+    grades[13] = {}  # Absent from everything
+    grades[14] = {3: 30.0}  # Only a zero-weight test
+
+    matrix = compute_grade_matrix(tests, competency_weights, list(grades), grades).as_json()
+    students, (test_avgs, comp_avgs, grand_avg) = reference_totals(tests, competency_weights, grades)
+
+    for student_id, (comp, grand) in students.items():
+        totals = matrix['totals'][student_id]
+        assert totals['competencies'] == {c: approx_or_none(v) for c, v in comp.items()}, student_id
+        assert totals['grand'] == approx_or_none(grand), student_id
+    assert matrix['averages']['tests'] == {t: approx_or_none(v) for t, v in test_avgs.items()}
+    assert matrix['averages']['competencies'] == {c: approx_or_none(v) for c, v in comp_avgs.items()}
+    assert matrix['averages']['grand'] == approx_or_none(grand_avg)
+
+
+def test_absent_and_zero_weight_cells_leave_totals_empty():
+    tests = make_tests([('C1', 20, 100), ('C2', 20, 0)])
+    matrix = compute_grade_matrix(tests, {'C1': 50, 'C2': 50}, [1, 2], {1: {2: 10.0}, 2: {1: 5.0}}).as_json()
+
+    assert matrix['totals'][1] == {'competencies': {'C1': None, 'C2': None}, 'grand': None}
+    assert matrix['totals'][2] == {'competencies': {'C1': 25.0, 'C2': None}, 'grand': 25.0}
+
+
+def test_single_competency_has_no_grand_total():
+    tests = make_tests([('C1', 20, 100)])
+    matrix = compute_grade_matrix(tests, {'C1': 100}, [1], {1: {1: 10.0}}).as_json()
+
+    assert matrix['totals'][1]['grand'] is None
+    assert matrix['averages']['grand'] is None
+
+
+def test_class_averages_accumulate_over_student_blocks():
+    tests = make_tests([('C1', 20, 50), ('C1', 10, 50), ('C2', 25, 100)])
+    layout = MatrixLayout.build(tests, {'C1': 30, 'C2': 70})
+    rng = np.random.default_rng(11)
+    points = rng.integers(0, 11, size=(50, 3)).astype(float)
+    points[rng.random(points.shape) < 0.3] = np.nan
+    points[:, 2] = np.nan  # Nobody took the last test
+    percentages = student_totals(points, layout).percentages
+
+    accumulator = ClassAverageAccumulator(layout)
+    for start in range(0, 50, 16):
+        accumulator.add(percentages[start:start + 16])
+    streamed = accumulator.result()
+    whole = class_averages(percentages, layout)
+
+    np.testing.assert_allclose(streamed.tests, whole.tests)
+    np.testing.assert_allclose(streamed.competencies, whole.competencies)
+    assert streamed.grand == pytest.approx(whole.grand)
+    assert np.isnan(whole.tests[2]) and np.isnan(whole.competencies[1])
+    # With C2 empty, the grand average is C1's
+    assert whole.grand == pytest.approx(whole.competencies[0])
@@ -0,0 +1,124 @@
+from app import db
+from app.grade_writes import apply_grade_updates, save_test_grades
+from app.models import Grade, Student
+
+from .conftest import add_test
+
+
+def grades_by_student(test):
+    db.session.expire_all()
+    return {grade.student_id: grade for grade in Grade.query.filter_by(test_id=test.id)}
+
+
+def test_save_test_grades_inserts_updates_and_deletes(teacher, classroom):
+    ann, ben, cy = Student.query.order_by(Student.id).all()
+    test = add_test(teacher, classroom)
+    save_test_grades(test, [
+        {'student_id': ann.id, 'grade': 10, 'absent': False},
+        {'student_id': ben.id, 'grade': 11, 'absent': False},
+    ])
+    db.session.commit()
+
+    counts = save_test_grades(test, [
+        {'student_id': ann.id, 'grade': 12, 'absent': False},
+        {'student_id': ben.id, 'grade': None, 'absent': False},
+        {'student_id': cy.id, 'grade': None, 'absent': True},
+    ])
+    db.session.commit()
+
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1}
+    grades = grades_by_student(test)
+    assert set(grades) == {ann.id, cy.id}
+    assert grades[ann.id].grade == 12
+    assert grades[cy.id].grade is None and grades[cy.id].absent
+
+
+def test_save_test_grades_writes_originals_only_once(teacher, classroom):
+    ann = Student.query.order_by(Student.id).first()
+    test = add_test(teacher, classroom)
+    for grade, absent in [(9, False), (14, False), (None, True)]:
+        save_test_grades(test, [{'student_id': ann.id, 'grade': grade, 'absent': absent}])
+        db.session.commit()
+
+    grade = grades_by_student(test)[ann.id]
+    assert (grade.grade, grade.absent) == (None, True)
+    assert (grade.original_grade, grade.original_absent) == (9, False)
+
+
+def test_save_test_grades_skips_empty_entries_without_a_row(teacher, classroom):
+    ann = Student.query.order_by(Student.id).first()
+    test = add_test(teacher, classroom)
+
+    counts = save_test_grades(test, [{'student_id': ann.id, 'grade': None, 'absent': False}])
+
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert grades_by_student(test) == {}
+
+
+def test_save_grades_reports_counts(client, teacher, classroom):
+    ann, ben, _cy = Student.query.order_by(Student.id).all()
+    test = add_test(teacher, classroom)
+
+    response = client.post(f'/api/save_grades/{test.id}', json={'grades': [
+        {'student_id': ann.id, 'grade': 18, 'absent': False},
+        {'student_id': ben.id, 'grade': None, 'absent': True},
+    ]})
+
+    assert response.status_code == 200
+    assert response.get_json()['counts'] == {'inserted': 2, 'updated': 0, 'deleted': 0}
+
+
+def test_save_grades_refuses_students_of_other_teachers(client, teacher, classroom):
+    test = add_test(teacher, classroom)
+
+    response = client.post(f'/api/save_grades/{test.id}', json={'grades': [
+        {'student_id': 999, 'grade': 18, 'absent': False},
+    ]})
+
+    assert response.status_code == 404
+    assert grades_by_student(test) == {}
+
+
+def test_apply_grade_updates_rejects_other_teachers_cells(teacher, classroom):
+    ann = Student.query.order_by(Student.id).first()
+    test = add_test(teacher, classroom)
+
+    result = apply_grade_updates(teacher.id, [
+        {'student_id': ann.id, 'test_id': test.id, 'grade': 15},
+        {'student_id': ann.id, 'test_id': test.id + 100, 'grade': 15},
+        {'student_id': 'x', 'test_id': test.id, 'grade': 15},
+    ])
+    db.session.commit()
+
+    assert (result['inserted'], result['updated'], result['deleted']) == (1, 0, 0)
+    assert sorted(r['reason'] for r in result['rejected']) == ['invalid', 'test not found']
+    assert grades_by_student(test)[ann.id].original_grade == 15
+
+
+def test_apply_grade_updates_rejects_malformed_cells(teacher, classroom):
+    ann, ben, _cy = Student.query.order_by(Student.id).all()
+    test = add_test(teacher, classroom)
+
+    result = apply_grade_updates(teacher.id, [
+        5,
+        None,
+        {'student_id': ann.id, 'test_id': test.id, 'grade': 'nan'},
+        {'student_id': ann.id, 'test_id': test.id, 'grade': float('inf')},
+        {'student_id': ann.id, 'test_id': test.id, 'grade': '-Infinity'},
+        {'student_id': ben.id, 'test_id': test.id, 'grade': '12.5'},
+    ])
+    db.session.commit()
+
+    assert [r['reason'] for r in result['rejected']] == ['invalid'] * 5
+    assert result['inserted'] == 1
+    assert {student_id: grade.grade for student_id, grade in grades_by_student(test).items()} == {ben.id: 12.5}
+
+
+def test_save_grade_updates_rejects_non_object_cells(client, teacher, classroom):
+    test = add_test(teacher, classroom)
+
+    response = client.post('/api/save_grade_updates', json={'updates': [[1, 2], 'x']})
+
+    assert response.status_code == 200
+    assert len(response.get_json()['rejected']) == 2
+    assert grades_by_student(test) == {}
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, jobs
+from app.jobs import JobError, _claim, claim_next_job, run_job
+from app.models import Grade, Job, Student, Teacher
+
+from .conftest import add_test
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """Register job handlers for one test."""
+    def register(kind, func, max_attempts=None):
+        monkeypatch.setitem(jobs._handlers, kind, (func, max_attempts))
+    return register
+
+
+def queue(teacher, kind, run_after=None, **fields):
+    job = Job(teacher_id=teacher.id, kind=kind, params='{}', status='queued', max_attempts=3,
+              run_after=run_after or datetime.utcnow(), **fields)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def make_due(job):
+    job.run_after = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_claims_the_oldest_runnable_job(teacher):
+    later = queue(teacher, 'noop', run_after=datetime.utcnow() + timedelta(minutes=5))
+    due = queue(teacher, 'noop', run_after=datetime.utcnow() - timedelta(minutes=1))
+
+    job = claim_next_job('worker-1')
+
+    assert job.id == due.id
+    assert (job.status, job.worker, job.attempts) == ('running', 'worker-1', 1)
+    assert db.session.get(Job, later.id).status == 'queued'
+
+
+def test_failed_jobs_are_retried_with_exponential_backoff(app, teacher, handlers):
+    def explode(context, params):
+        raise RuntimeError('database went away')
+    handlers('explode', explode)
+    delay = app.config['JOB_RETRY_DELAY']
+    queue(teacher, 'explode')
+
+    for attempt, backoff in [(1, delay), (2, 2 * delay)]:
+        started = datetime.utcnow()
+        job = run_job(claim_next_job('worker-1'))
+        assert (job.status, job.attempts) == ('queued', attempt)
+        assert 'database went away' in job.error
+        assert job.run_after >= started + timedelta(seconds=backoff)
+        assert job.run_after < datetime.utcnow() + timedelta(seconds=backoff + 5)
+        # Not claimable until the backoff has passed
+        assert claim_next_job('worker-1') is None
+        make_due(job)
+
+    job = run_job(claim_next_job('worker-1'))
+    assert (job.status, job.attempts) == ('failed', 3)
+    assert job.finished_at is not None
+
+
+def test_job_errors_fail_without_retrying(teacher, handlers):
+    def reject(context, params):
+        raise JobError('Nothing to export')
+    handlers('reject', reject)
+    queue(teacher, 'reject')
+
+    job = run_job(claim_next_job('worker-1'))
+
+    assert (job.status, job.attempts, job.error) == ('failed', 1, 'Nothing to export')
+
+
+def test_successful_jobs_store_their_summary(teacher, handlers):
+    handlers('count', lambda context, params: {'counted': context.attempt})
+    queue(teacher, 'count')
+
+    job = run_job(claim_next_job('worker-1'))
+
+    assert (job.status, job.progress) == ('succeeded', 100)
+    assert job.summary == '{"counted": 1}'
+
+
+def test_teacher_concurrency_limit_is_enforced_by_the_claim(app, teacher):
+    app.config['JOB_TEACHER_CONCURRENCY'] = 1
+    running = queue(teacher, 'noop')
+    waiting = queue(teacher, 'noop')
+    other_teacher = Teacher(first_name='Bo', last_name='Ng', email='bo@example.com', password_hash='x')
+    db.session.add(other_teacher)
+    db.session.commit()
+    other = queue(other_teacher, 'noop')
+
+    assert claim_next_job('worker-1').id == running.id
+    # Another worker that already picked the job as a candidate still cannot claim it
+    assert _claim(waiting.id, 'worker-2', teacher.id) is None
+    assert claim_next_job('worker-2').id == other.id
+    assert db.session.get(Job, waiting.id).status == 'queued'
+
+
+def submit_and_run(client, kind, params):
+    response = client.post('/api/jobs', json={'kind': kind, 'params': params})
+    assert response.status_code == 202
+    run_job(claim_next_job('worker-1'))
+    return client.get(response.headers['Location']).get_json()['job']
+
+
+def test_excel_export_runs_as_a_job(client, teacher, classroom, wizard):
+    test = add_test(teacher, classroom)
+    db.session.add(Grade(test_id=test.id, student_id=Student.query.first().id, grade=15, absent=False))
+    db.session.commit()
+
+    job = submit_and_run(client, 'grade_matrix_xlsx', {'semester': 'Semester 1'})
+
+    assert job['status'] == 'succeeded'
+    download = client.get(job['download_url'])
+    assert download.status_code == 200
+    assert download.data.startswith(b'PK')
+    assert "runBackgroundJob('grade_matrix_xlsx'" in client.get('/review_grades').get_data(as_text=True)
+
+
+def test_flush_runs_as_a_job(client, teacher, classroom, wizard):
+    add_test(teacher, classroom)
+
+    job = submit_and_run(client, 'flush_database', {})
+
+    assert job['status'] == 'succeeded'
+    assert job['summary']['deleted']['student'] == 3
+    assert Student.query.count() == 0
+    assert db.session.get(Teacher, teacher.id) is not None
+    assert "runBackgroundJob('flush_database'" in client.get('/preferences').get_data(as_text=True)
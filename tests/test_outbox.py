@@ -0,0 +1,78 @@
+import socket
+
+import pytest
+
+from app import db
+from app.debug_smtp import DebuggingSMTPServer
+from app.models import OutboxMessage
+from app.outbox import SMTPConnection, deliver_outbox, enqueue_mail
+
+
+@pytest.fixture
+def smtp_server(app):
+    server = DebuggingSMTPServer(port=0, reject={'nobody@example.com'}).start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.port, MAIL_USE_TLS=False,
+                      MAIL_DEFAULT_SENDER='grades@example.com')
+    yield server
+    server.stop()
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_forgot_password_only_queues_the_email(app, client, smtp_server):
+    response = client.post('/forgot_password', data={'email': 'ada@example.com'})
+
+    message = OutboxMessage.query.one()
+    assert response.status_code == 302
+    assert (message.kind, message.status, message.to_address) == ('password_reset', 'pending', 'ada@example.com')
+    assert smtp_server.messages == []
+
+
+def test_deliver_outbox_sends_over_one_connection(app, smtp_server, monkeypatch):
+    connections = []
+    connect = SMTPConnection._connect
+    monkeypatch.setattr(SMTPConnection, '_connect', lambda self: connections.append(1) or connect(self))
+    for i in range(3):
+        enqueue_mail(f'parent{i}@example.com', f'Report {i}', 'Line one\n.Line two')
+    db.session.commit()
+
+    assert deliver_outbox() == 3
+
+    assert len(connections) == 1
+    assert [m['To'] for m in smtp_server.messages] == [f'parent{i}@example.com' for i in range(3)]
+    # The leading dot survives SMTP's dot-stuffing
+    assert smtp_server.messages[0].get_content().splitlines() == ['Line one', '.Line two']
+    assert {m.status for m in OutboxMessage.query} == {'sent'}
+
+
+def test_rejected_recipients_fail_without_retrying(app, smtp_server):
+    enqueue_mail('nobody@example.com', 'Hello', 'Body')
+    db.session.commit()
+
+    assert deliver_outbox() == 0
+
+    message = OutboxMessage.query.one()
+    assert (message.status, message.attempts) == ('failed', 1)
+    assert '550' in message.last_error
+
+
+def test_unreachable_servers_are_retried_with_backoff(app, smtp_server):
+    app.config['MAIL_PORT'] = unused_port()
+    enqueue_mail('parent@example.com', 'Hello', 'Body')
+    db.session.commit()
+
+    assert deliver_outbox() == 0
+    message = OutboxMessage.query.one()
+    assert (message.status, message.attempts) == ('pending', 1)
+    # Not due again until MAIL_RETRY_DELAY has passed
+    app.config['MAIL_PORT'] = smtp_server.port
+    assert deliver_outbox() == 0
+
+    message.next_attempt_at = message.created_at
+    db.session.commit()
+    assert deliver_outbox() == 1
+    assert smtp_server.messages[0]['Subject'] == 'Hello'
@@ -0,0 +1,61 @@
+import json
+
+from app import db, models
+from app.models import Classroom, ClassroomLayout, Grade, Job, School, SetupWizardData, Student, Teacher
+from app.purge import purge_classrooms, purge_teacher, purge_teacher_data
+
+from .conftest import add_classroom, add_test
+
+
+def add_grades(test, students):
+    for student in students:
+        db.session.add(Grade(test_id=test.id, student_id=student.id, grade=15, absent=False))
+    db.session.commit()
+
+
+def test_purge_teacher_deletes_everything_and_counts_rows(teacher, classroom, wizard):
+    other = add_classroom(teacher, '201 (Grade 2)', school_name='Hillside', students=[('Dee', 'Ord')])
+    add_grades(add_test(teacher, classroom), classroom.students)
+    add_grades(add_test(teacher, other, class_name='201'), other.students)
+    db.session.add(ClassroomLayout(teacher_id=teacher.id, classroom_id=classroom.id, layout_data=json.dumps({})))
+    db.session.add(Job(teacher_id=teacher.id, kind='flush_database', params='{}'))
+    db.session.commit()
+
+    counts = purge_teacher(teacher.id)
+    db.session.commit()
+
+    assert counts == {
+        'grade': 4, 'test': 2, 'student': 4, 'classroom_layout': 1, 'classroom': 2,
+        'school': 2, 'setup_wizard_data': 1, 'job': 1, 'teacher': 1,
+    }
+    for model in (Teacher, School, Classroom, Student, models.Test, Grade, ClassroomLayout, SetupWizardData, Job):
+        assert model.query.count() == 0
+
+
+def test_purge_teacher_data_keeps_the_account_and_other_teachers(teacher, classroom):
+    add_grades(add_test(teacher, classroom), classroom.students)
+    db.session.add(Job(teacher_id=teacher.id, kind='flush_database', params='{}'))
+    neighbour = Teacher(first_name='Bo', last_name='Ng', email='bo@example.com', password_hash='x')
+    db.session.add(neighbour)
+    db.session.commit()
+    add_classroom(neighbour, '301 (Grade 3)', school_name='Lakeside', students=[('Eli', 'Park')])
+
+    counts = purge_teacher_data(teacher.id)
+    db.session.commit()
+
+    assert counts['grade'] == 3 and counts['student'] == 3
+    assert db.session.get(Teacher, teacher.id) is not None
+    assert Job.query.count() == 1
+    assert [s.first_name for s in Student.query] == ['Eli']
+
+
+def test_purge_classrooms_keeps_tests_without_their_classroom(teacher, classroom):
+    test = add_test(teacher, classroom)
+    add_grades(test, classroom.students)
+
+    counts = purge_classrooms([classroom.id])
+    db.session.commit()
+    db.session.expire_all()
+
+    assert counts == {'grade': 3, 'student': 3, 'classroom_layout': 0, 'classroom': 1}
+    assert db.session.get(models.Test, test.id).classroom_id is None
@@ -0,0 +1,56 @@
+import re
+
+import pytest
+from sqlalchemy import text
+
+from app import db
+from app.request_metrics import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def run_queries(app):
+    """A view that runs ?n= statements with a budget of 2."""
+    @query_budget(2)
+    def view():
+        from flask import request
+        for _ in range(int(request.args['n'])):
+            db.session.execute(text('SELECT 1'))
+        return 'ok'
+    app.add_url_rule('/_run_queries', 'run_queries', view)
+    return app.test_client()
+
+
+def server_timing(response):
+    match = re.fullmatch(r'db;dur=([\d.]+);desc="(\d+) queries", app;dur=([\d.]+)',
+                         response.headers['Server-Timing'])
+    return float(match.group(1)), int(match.group(2)), float(match.group(3))
+
+
+def test_server_timing_counts_the_requests_statements(run_queries):
+    response = run_queries.get('/_run_queries?n=2')
+
+    db_ms, queries, app_ms = server_timing(response)
+    assert response.status_code == 200
+    assert queries == 2
+    assert 0 <= db_ms <= app_ms
+
+
+def test_server_timing_can_be_turned_off(app, run_queries):
+    app.config['SERVER_TIMING'] = False
+
+    assert 'Server-Timing' not in run_queries.get('/_run_queries?n=1').headers
+
+
+def test_going_over_budget_raises_under_testing(run_queries):
+    with pytest.raises(QueryBudgetExceeded, match='ran 3 SQL statements, over its budget of 2'):
+        run_queries.get('/_run_queries?n=3')
+
+
+def test_going_over_budget_only_warns_when_raising_is_off(app, run_queries, caplog):
+    app.config['QUERY_BUDGET_RAISE'] = False
+
+    response = run_queries.get('/_run_queries?n=3')
+
+    assert response.status_code == 200
+    assert server_timing(response)[1] == 3
+    assert 'over its budget of 2' in caplog.text
@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+from app import db
+from app.jobs import claim_next_job, run_job
+from app.models import Student
+from app.roster_import import (
+    RosterImportError, StudentRecord, import_roster_file, import_students, iter_student_records,
+)
+
+from .conftest import add_classroom
+
+
+def roster_names(classroom):
+    return sorted((s.first_name, s.last_name) for s in Student.query.filter_by(classroom_id=classroom.id))
+
+
+def test_import_students_skips_existing_and_repeated_names(teacher, classroom):
+    other = add_classroom(teacher, '201 (Grade 2)')
+    records = [
+        StudentRecord(row=2, first_name='Ann', last_name='Lee', classroom='101'),
+        StudentRecord(row=3, first_name='Dana', last_name='Ray', classroom='101'),
+        StudentRecord(row=4, first_name='dana ', last_name=' RAY', classroom='101 (Grade 1)'),
+        StudentRecord(row=5, first_name='Dana', last_name='Ray', classroom='201'),
+    ]
+
+    result = import_students(teacher.id, records)
+    db.session.commit()
+
+    assert (result.rows, result.inserted, result.existing, result.duplicates) == (4, 2, 1, 1)
+    assert ('Dana', 'Ray') in roster_names(classroom)
+    assert roster_names(other) == [('Dana', 'Ray')]
+    assert {c['name']: c['inserted'] for c in result.classrooms.values()} == {'101 (Grade 1)': 1, '201 (Grade 2)': 1}
+
+
+def test_import_students_reports_bad_rows_and_imports_the_rest(teacher, classroom):
+    add_classroom(teacher, '101 (Grade 1)', school_name='Hillside')
+    records = [
+        StudentRecord(row=2, first_name='', last_name='Lee', classroom='101', school='Riverside'),
+        StudentRecord(row=3, first_name='Eve', last_name='Stone', classroom='999'),
+        StudentRecord(row=4, first_name='Eve', last_name='Stone', classroom='101'),
+        StudentRecord(row=5, first_name='X' * 200, last_name='Stone', classroom='101', school='Riverside'),
+        StudentRecord(row=6, first_name='Eve', last_name='Stone', classroom='101', school='riverside'),
+    ]
+
+    result = import_students(teacher.id, records)
+    db.session.commit()
+
+    assert result.inserted == 1
+    assert result.error_count == 4
+    assert [error['row'] for error in result.errors] == [2, 3, 4, 5]
+    assert 'several schools' in result.errors[2]['error']
+    assert ('Eve', 'Stone') in roster_names(classroom)
+
+
+def test_import_students_uses_the_default_classroom(teacher, classroom):
+    result = import_students(teacher.id, [StudentRecord(row=2, first_name='Finn', last_name='Hale')], classroom.id)
+
+    assert result.inserted == 1
+    with pytest.raises(RosterImportError):
+        import_students(teacher.id, [], classroom.id + 100)
+
+
+def test_import_roster_file_reads_semicolon_csv(teacher, classroom):
+    upload = io.BytesIO('Prénom;Nom;Classe\nGil;Roy;101\n'.encode('utf-8-sig'))
+
+    result = import_roster_file(teacher.id, 'eleves.csv', upload)
+    db.session.commit()
+
+    assert result.inserted == 1
+    assert ('Gil', 'Roy') in roster_names(classroom)
+
+
+def test_missing_columns_reject_the_whole_file():
+    with pytest.raises(RosterImportError, match='Classroom'):
+        list(iter_student_records([['First Name', 'Last Name'], ['Ann', 'Lee']], require_classroom=True))
+
+
+LATIN1_CSV = 'Prénom;Nom;Classe\nZoé;Lefèvre;101\n'.encode('latin-1')
+
+
+def test_non_utf8_csv_is_an_import_error(teacher, classroom):
+    with pytest.raises(RosterImportError, match='not UTF-8'):
+        import_roster_file(teacher.id, 'eleves.csv', io.BytesIO(LATIN1_CSV))
+
+
+def test_import_roster_rejects_non_utf8_csv(client, teacher, classroom):
+    response = client.post('/api/import_roster', data={'file': (io.BytesIO(LATIN1_CSV), 'eleves.csv')})
+
+    assert response.status_code == 400
+    assert 'not UTF-8' in response.get_json()['error']
+    assert len(roster_names(classroom)) == 3
+
+
+def test_roster_import_job_fails_non_utf8_csv_without_retrying(client, teacher, classroom):
+    response = client.post('/api/jobs', data={'kind': 'roster_import', 'file': (io.BytesIO(LATIN1_CSV), 'eleves.csv')})
+    assert response.status_code == 202
+
+    job = run_job(claim_next_job('worker-1'))
+
+    assert (job.status, job.attempts) == ('failed', 1)
+    assert 'not UTF-8' in job.error